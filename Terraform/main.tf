@@ -73,6 +73,7 @@ module "ecs" {
   service1_image              = var.service1_image
   service2_image              = var.service2_image
   sqs_queue_url               = module.sqs.queue_url
+  sqs_dlq_url                 = module.sqs.dlq_url
   s3_bucket_name              = module.s3.bucket_name
   ssm_parameter_name          = module.ssm.parameter_name
   aws_region                  = var.aws_region
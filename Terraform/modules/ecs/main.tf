@@ -207,6 +207,10 @@ resource "aws_ecs_task_definition" "service1" {
           name  = "SSM_PARAMETER_NAME"
           value = var.ssm_parameter_name
         },
+        {
+          name  = "CLAIM_CHECK_BUCKET"
+          value = var.s3_bucket_name
+        },
         {
           name  = "AWS_REGION"
           value = var.aws_region
@@ -254,6 +258,10 @@ resource "aws_ecs_task_definition" "service2" {
         {
           name  = "AWS_REGION"
           value = var.aws_region
+        },
+        {
+          name  = "DLQ_URL"
+          value = var.sqs_dlq_url
         }
       ]
 
@@ -89,6 +89,11 @@ variable "sqs_queue_url" {
   type        = string
 }
 
+variable "sqs_dlq_url" {
+  description = "URL of the dead letter queue"
+  type        = string
+}
+
 variable "s3_bucket_name" {
   description = "Name of the S3 bucket"
   type        = string
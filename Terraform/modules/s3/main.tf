@@ -45,5 +45,24 @@ resource "aws_s3_bucket_lifecycle_configuration" "main" {
     noncurrent_version_expiration {
       noncurrent_days = 30
     }
+
+    abort_incomplete_multipart_upload {
+      days_after_initiation = 1
+    }
+  }
+
+  # Large message payloads offloaded by service1; only needed until the
+  # message is processed (SQS keeps messages for at most 14 days)
+  rule {
+    id     = "expire-claim-checks"
+    status = "Enabled"
+
+    filter {
+      prefix = "claim-checks/"
+    }
+
+    expiration {
+      days = 14
+    }
   }
 }
@@ -100,6 +100,7 @@ resource "aws_iam_role_policy" "ecs_task_policy" {
           "sqs:SendMessage",
           "sqs:ReceiveMessage",
           "sqs:DeleteMessage",
+          "sqs:ChangeMessageVisibility",
           "sqs:GetQueueAttributes",
           "sqs:GetQueueUrl"
         ]
@@ -109,6 +110,7 @@ resource "aws_iam_role_policy" "ecs_task_policy" {
         Effect = "Allow"
         Action = [
           "s3:PutObject",
+          "s3:AbortMultipartUpload",
           "s3:GetObject",
           "s3:ListBucket"
         ]
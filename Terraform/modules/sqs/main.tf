@@ -31,7 +31,9 @@ resource "aws_sqs_queue_redrive_policy" "main" {
 
   redrive_policy = jsonencode({
     deadLetterTargetArn = aws_sqs_queue.dlq.arn
-    maxReceiveCount     = 3
+    # Above service2's POISON_MAX_RECEIVES, so the worker quarantines
+    # poison messages itself and the redrive is only a backstop
+    maxReceiveCount = 5
   })
 }
 
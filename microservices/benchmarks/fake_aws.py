@@ -0,0 +1,261 @@
+"""
+In-process stand-ins for the SQS, S3 and SSM clients used by the services.
+
+They implement only the calls the services make, keep everything in memory
+and can add a fixed per-call latency to approximate real AWS round trips.
+Used by the benchmark scripts in this directory; no AWS account needed.
+"""
+import asyncio
+import io
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from botocore.exceptions import ClientError
+
+
+class FakeClientBase:
+    def __init__(self, latency_ms=0.0):
+        self.latency = latency_ms / 1000.0
+        self.calls = Counter()
+        self._calls_lock = threading.Lock()
+
+    def _call(self, name):
+        with self._calls_lock:
+            self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class FakeSQS(FakeClientBase):
+    def __init__(self, latency_ms=0.0, visibility_timeout=30):
+        super().__init__(latency_ms)
+        self.visibility_timeout = visibility_timeout
+        self._condition = threading.Condition()
+        self._visible = deque()
+        self._in_flight = {}
+        self._closed = False
+        self.sent = 0
+        self.deleted = 0
+        self.redelivered = 0
+
+    def _enqueue(self, body, attributes):
+        message = {
+            'MessageId': str(uuid.uuid4()),
+            'Body': body,
+            'MessageAttributes': attributes or {},
+            'Attributes': {
+                'SentTimestamp': str(int(time.time() * 1000)),
+                'ApproximateReceiveCount': '0'
+            }
+        }
+        with self._condition:
+            self._visible.append(message)
+            self.sent += 1
+            self._condition.notify()
+        return message['MessageId']
+
+    def send_message(self, QueueUrl, MessageBody, MessageAttributes=None, **kwargs):
+        self._call('SendMessage')
+        return {'MessageId': self._enqueue(MessageBody, MessageAttributes)}
+
+    def send_message_batch(self, QueueUrl, Entries):
+        self._call('SendMessageBatch')
+        return {
+            'Successful': [
+                {'Id': entry['Id'], 'MessageId': self._enqueue(entry['MessageBody'], entry.get('MessageAttributes'))}
+                for entry in Entries
+            ],
+            'Failed': []
+        }
+
+    def _requeue_expired(self):
+        now = time.monotonic()
+        expired = [handle for handle, (_, deadline) in self._in_flight.items() if deadline <= now]
+        for handle in expired:
+            message, _ = self._in_flight.pop(handle)
+            self._visible.append(message)
+            self.redelivered += 1
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages=1, WaitTimeSeconds=0, **kwargs):
+        self._call('ReceiveMessage')
+        deadline = time.monotonic() + WaitTimeSeconds
+
+        with self._condition:
+            while True:
+                self._requeue_expired()
+                remaining = deadline - time.monotonic()
+                if self._visible or self._closed or remaining <= 0:
+                    break
+                self._condition.wait(min(remaining, 0.5))
+
+            messages = []
+            while self._visible and len(messages) < MaxNumberOfMessages:
+                message = self._visible.popleft()
+                message['Attributes']['ApproximateReceiveCount'] = str(
+                    int(message['Attributes']['ApproximateReceiveCount']) + 1
+                )
+                receipt_handle = uuid.uuid4().hex
+                self._in_flight[receipt_handle] = (message, time.monotonic() + self.visibility_timeout)
+                messages.append({**message, 'ReceiptHandle': receipt_handle})
+
+        return {'Messages': messages} if messages else {}
+
+    def _delete(self, receipt_handle):
+        with self._condition:
+            if self._in_flight.pop(receipt_handle, None) is not None:
+                self.deleted += 1
+
+    def delete_message(self, QueueUrl, ReceiptHandle):
+        self._call('DeleteMessage')
+        self._delete(ReceiptHandle)
+        return {}
+
+    def delete_message_batch(self, QueueUrl, Entries):
+        self._call('DeleteMessageBatch')
+        for entry in Entries:
+            self._delete(entry['ReceiptHandle'])
+        return {'Successful': [{'Id': entry['Id']} for entry in Entries], 'Failed': []}
+
+    def _change_visibility(self, receipt_handle, timeout):
+        with self._condition:
+            if receipt_handle in self._in_flight:
+                message, _ = self._in_flight[receipt_handle]
+                self._in_flight[receipt_handle] = (message, time.monotonic() + timeout)
+            self._condition.notify_all()
+
+    def change_message_visibility(self, QueueUrl, ReceiptHandle, VisibilityTimeout):
+        self._call('ChangeMessageVisibility')
+        self._change_visibility(ReceiptHandle, VisibilityTimeout)
+        return {}
+
+    def change_message_visibility_batch(self, QueueUrl, Entries):
+        self._call('ChangeMessageVisibilityBatch')
+        for entry in Entries:
+            self._change_visibility(entry['ReceiptHandle'], entry['VisibilityTimeout'])
+        return {'Successful': [{'Id': entry['Id']} for entry in Entries], 'Failed': []}
+
+    def get_queue_attributes(self, QueueUrl, AttributeNames=None):
+        self._call('GetQueueAttributes')
+        with self._condition:
+            return {
+                'Attributes': {
+                    'ApproximateNumberOfMessages': str(len(self._visible)),
+                    'ApproximateNumberOfMessagesNotVisible': str(len(self._in_flight))
+                }
+            }
+
+    def close(self):
+        """Wake up any long-polling receivers so pollers can stop."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+class FakeS3(FakeClientBase):
+    def __init__(self, latency_ms=0.0, on_put=None):
+        super().__init__(latency_ms)
+        self.objects = {}
+        self.on_put = on_put
+        self._lock = threading.Lock()
+        self._uploads = {}
+
+    def _store(self, key, body, extra):
+        if hasattr(body, 'read'):
+            body = body.read()
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        with self._lock:
+            self.objects[key] = {'Body': bytes(body), **extra}
+        if self.on_put:
+            self.on_put(key, self.objects[key])
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self._call('PutObject')
+        self._store(Key, Body, kwargs)
+        return {'ETag': uuid.uuid4().hex}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self._call('GetObject')
+        with self._lock:
+            stored = self.objects.get(Key)
+        if stored is None:
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'The specified key does not exist.'}},
+                              'GetObject')
+        return {
+            'Body': io.BytesIO(stored['Body']),
+            'ContentLength': len(stored['Body']),
+            'ContentEncoding': stored.get('ContentEncoding', '')
+        }
+
+    def list_objects_v2(self, Bucket, Prefix='', ContinuationToken=None, MaxKeys=1000, StartAfter='', **kwargs):
+        self._call('ListObjectsV2')
+        with self._lock:
+            keys = sorted(key for key in self.objects if key.startswith(Prefix) and key > StartAfter)
+        start = int(ContinuationToken or 0)
+        page = keys[start:start + MaxKeys]
+        response = {
+            'Contents': [{'Key': key, 'Size': len(self.objects[key]['Body'])} for key in page],
+            'KeyCount': len(page),
+            'IsTruncated': start + MaxKeys < len(keys)
+        }
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = str(start + MaxKeys)
+        return response
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self._call('DeleteObject')
+        with self._lock:
+            self.objects.pop(Key, None)
+        return {}
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        self._call('CreateMultipartUpload')
+        upload_id = uuid.uuid4().hex
+        with self._lock:
+            self._uploads[upload_id] = {'Key': Key, 'Parts': {}, 'Extra': kwargs}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, **kwargs):
+        self._call('UploadPart')
+        with self._lock:
+            self._uploads[UploadId]['Parts'][PartNumber] = bytes(Body)
+        return {'ETag': f'etag-{PartNumber}'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self._call('CompleteMultipartUpload')
+        with self._lock:
+            upload = self._uploads.pop(UploadId)
+        body = b''.join(upload['Parts'][part['PartNumber']] for part in MultipartUpload['Parts'])
+        self._store(Key, body, upload['Extra'])
+        return {'Key': Key}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self._call('AbortMultipartUpload')
+        with self._lock:
+            self._uploads.pop(UploadId, None)
+        return {}
+
+
+class FakeSSM(FakeClientBase):
+    def __init__(self, parameters, latency_ms=0.0):
+        super().__init__(latency_ms)
+        self.parameters = dict(parameters)
+
+    def get_parameter(self, Name, WithDecryption=False):
+        self._call('GetParameter')
+        return {'Parameter': {'Name': Name, 'Value': self.parameters[Name]}}
+
+
+class AsyncFakeSQS:
+    """aiobotocore-style SQS client (awaitable calls) backed by a FakeSQS."""
+
+    def __init__(self, sqs):
+        self.sqs = sqs
+
+    async def send_message(self, QueueUrl, MessageBody, MessageAttributes=None, **kwargs):
+        if self.sqs.latency:
+            await asyncio.sleep(self.sqs.latency)
+        with self.sqs._calls_lock:
+            self.sqs.calls['SendMessage'] += 1
+        return {'MessageId': self.sqs._enqueue(MessageBody, MessageAttributes)}
@@ -0,0 +1,141 @@
+"""
+Shared helpers for the benchmark scripts: loading the service modules side
+by side, recording latencies and writing/comparing JSON results.
+"""
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+MICROSERVICES_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COMMON_DIR = os.path.join(MICROSERVICES_DIR, 'common')
+
+
+def load_service(service, module_name=None, filename='app.py'):
+    """
+    Import microservices/<service>/<filename> under a unique module name so
+    both services (each with its own app.py) can live in one process.
+    """
+    service_dir = os.path.join(MICROSERVICES_DIR, service)
+    module_name = module_name or f'{service}_{os.path.splitext(filename)[0]}'
+    for path in (COMMON_DIR, service_dir):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(service_dir, filename))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(values_ms):
+    values = sorted(values_ms)
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean_ms': round(sum(values) / len(values), 3),
+        'p50_ms': round(percentile(values, 50), 3),
+        'p95_ms': round(percentile(values, 95), 3),
+        'p99_ms': round(percentile(values, 99), 3),
+        'max_ms': round(values[-1], 3)
+    }
+
+
+class LatencyRecorder:
+    def __init__(self):
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, elapsed_ms):
+        with self._lock:
+            self._samples.setdefault(name, []).append(elapsed_ms)
+
+    @contextmanager
+    def measure(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - start) * 1000)
+
+    def wrap(self, module, function_name, stage_name=None):
+        """Replace module.function_name with a timed wrapper."""
+        original = getattr(module, function_name)
+        stage_name = stage_name or function_name
+
+        @wraps(original)
+        def timed(*args, **kwargs):
+            with self.measure(stage_name):
+                return original(*args, **kwargs)
+
+        setattr(module, function_name, timed)
+        return original
+
+    def samples(self, name):
+        with self._lock:
+            return list(self._samples.get(name, []))
+
+    def summary(self):
+        with self._lock:
+            names = sorted(self._samples)
+        return {name: summarize(self.samples(name)) for name in names}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=MICROSERVICES_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(results, path):
+    results = {'commit': git_commit(), 'timestamp': time.time(), **results}
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if path:
+        with open(path, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+    return results
+
+
+def compare_to_baseline(results, baseline_path, metrics, tolerance):
+    """
+    Compare selected metrics against a previous results file. metrics maps
+    a dotted path to 'higher' or 'lower' (which direction is better).
+    Returns a list of human-readable regressions.
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    def lookup(data, path):
+        for part in path.split('.'):
+            if not isinstance(data, dict) or part not in data:
+                return None
+            data = data[part]
+        return data
+
+    regressions = []
+    for path, better in metrics.items():
+        current, previous = lookup(results, path), lookup(baseline, path)
+        if current is None or not previous:
+            continue
+        change = (current - previous) / previous
+        if (better == 'higher' and change < -tolerance) or (better == 'lower' and change > tolerance):
+            regressions.append(f"{path}: {previous} -> {current} ({change:+.1%})")
+    return regressions
@@ -0,0 +1,191 @@
+"""
+Measure what logging costs the threads that handle messages.
+
+Each worker thread runs the log statements of one message's trip through
+both services: service1's send_to_sqs and, in service2, the poll (once per
+10 messages), process_message, upload_to_s3 and delete_message. They are
+written to a sink that stands in for the container's stderr pipe: every
+write takes --write-latency-us, the way a write blocks while the log driver
+catches up. Between messages each thread sleeps --work-ms, standing in for
+the AWS calls a real worker waits on. Cases:
+
+    before               the original f-string INFO lines, written synchronously as text
+    sync_json            structured_logging's JSON lines, still written by the caller
+    async_json           JSON lines through the queue handler, every success logged
+    async_json_sampled   as above, with successes sampled at --sample-rate
+
+Per-message times are the wall-clock microseconds the worker thread spent
+in logging calls. For the async cases, drain_s is how long the listener took
+to write the queued lines once the workers finished.
+
+Examples:
+    python logging_benchmark.py
+    python logging_benchmark.py --threads 16 --messages 50000 --write-latency-us 100 --output logging.json
+"""
+import argparse
+import logging
+import sys
+import threading
+import time
+import uuid
+
+from harness import compare_to_baseline, load_service, percentile, write_results
+
+CASES = ('before', 'sync_json', 'async_json', 'async_json_sampled')
+
+
+class SlowSink:
+    """File-like stream whose writes take latency seconds and are then discarded."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.writes = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def write(self, text):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.writes += 1
+            self.bytes += len(text)
+
+    def flush(self):
+        pass
+
+
+def log_before(logger, message_id, index):
+    key = f'messages/2025/01/02/03/{message_id}.json'
+    logger.info(f"Message sent to SQS. MessageId: {message_id}")
+    if index % 10 == 0:
+        logger.info("Received 10 messages from SQS")
+    logger.info(f"Processing message: {message_id}")
+    logger.info(f"Uploaded message to S3: s3://benchmark-bucket/{key}")
+    logger.info("Message deleted from SQS")
+    logger.info(f"Successfully processed message {message_id}")
+
+
+def log_after(structured_logging, logger, message_id, index):
+    log_success = structured_logging.log_success
+    log_success(logger, "Message sent to SQS", message_id)
+    if index % 10 == 0:
+        log_success(logger, "Received messages from SQS", count=10)
+    log_success(logger, "Processing message", message_id)
+    log_success(logger, "Uploaded message to S3", message_id,
+                uri=f's3://benchmark-bucket/messages/2025/01/02/03/{message_id}.json')
+    log_success(logger, "Message deleted from SQS")
+    log_success(logger, "Processed message", message_id)
+
+
+def summarize_us(values):
+    values = sorted(values)
+    return {
+        'mean_us': round(sum(values) / len(values), 2),
+        'p50_us': round(percentile(values, 50), 2),
+        'p99_us': round(percentile(values, 99), 2),
+        'max_us': round(values[-1], 2)
+    }
+
+
+def run_case(structured_logging, case, args):
+    sink = SlowSink(args.write_latency_us / 1e6)
+    logger = logging.getLogger('benchmark')
+    if case == 'before':
+        handler = logging.StreamHandler(sink)
+        handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+        logging.getLogger().handlers = [handler]
+        logging.getLogger().setLevel(logging.INFO)
+    else:
+        structured_logging.configure('benchmark', level='INFO', log_format='json', use_queue=case != 'sync_json',
+                                     queue_size=args.queue_size, stream=sink)
+    structured_logging.LOG_SUCCESS_SAMPLE_RATE = args.sample_rate if case == 'async_json_sampled' else 1.0
+
+    per_thread = args.messages // args.threads
+    message_ids = [str(uuid.uuid4()) for _ in range(per_thread * args.threads)]
+    samples = [[] for _ in range(args.threads)]
+    barrier = threading.Barrier(args.threads)
+    work = args.work_ms / 1000
+
+    def worker(number):
+        timings = samples[number]
+        barrier.wait()
+        for index in range(number * per_thread, (number + 1) * per_thread):
+            start = time.perf_counter()
+            if case == 'before':
+                log_before(logger, message_ids[index], index)
+            else:
+                log_after(structured_logging, logger, message_ids[index], index)
+            timings.append((time.perf_counter() - start) * 1e6)
+            if work:
+                time.sleep(work)
+
+    threads = [threading.Thread(target=worker, args=(i,), name=f'logging-load-{i}') for i in range(args.threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - start
+    drain_start = time.perf_counter()
+    structured_logging.shutdown()
+    drain = time.perf_counter() - drain_start
+
+    return {
+        'per_message': summarize_us([value for timings in samples for value in timings]),
+        'messages_per_s': round(len(message_ids) / duration, 1),
+        'lines_written': sink.writes,
+        'dropped': structured_logging.dropped_records() if case.startswith('async') else 0,
+        'drain_s': round(drain, 3)
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cases', default=','.join(CASES), help='Comma-separated cases to run')
+    parser.add_argument('--threads', type=int, default=8, help='Threads logging at once')
+    parser.add_argument('--messages', type=int, default=20000, help='Messages logged per case')
+    parser.add_argument('--write-latency-us', type=float, default=50, help='Simulated time per write to stderr')
+    parser.add_argument('--work-ms', type=float, default=5, help='Simulated AWS time per message, not measured')
+    parser.add_argument('--sample-rate', type=float, default=0.01, help='LOG_SUCCESS_SAMPLE_RATE for the sampled case')
+    parser.add_argument('--queue-size', type=int, default=10000, help='LOG_QUEUE_SIZE for the async cases')
+    parser.add_argument('--output', help='Write results JSON to this file')
+    parser.add_argument('--baseline', help='Previous results JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='Allowed relative regression vs baseline')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    structured_logging = load_service('common', module_name='structured_logging', filename='structured_logging.py')
+    cases = {case: run_case(structured_logging, case, args) for case in args.cases.split(',')}
+    structured_logging.configure(use_queue=False)
+
+    results = write_results({
+        'config': {
+            'threads': args.threads,
+            'messages': args.messages,
+            'write_latency_us': args.write_latency_us,
+            'work_ms': args.work_ms,
+            'sample_rate': args.sample_rate,
+            'queue_size': args.queue_size,
+            'json_backend': 'orjson' if structured_logging.orjson else 'json'
+        },
+        'cases': cases
+    }, args.output)
+
+    if args.baseline:
+        metrics = {}
+        for case in cases:
+            metrics[f'cases.{case}.per_message.mean_us'] = 'lower'
+            metrics[f'cases.{case}.per_message.p99_us'] = 'lower'
+        regressions = compare_to_baseline(results, args.baseline, metrics, args.tolerance)
+        if regressions:
+            print('Regressions against baseline:', file=sys.stderr)
+            for regression in regressions:
+                print(f'  {regression}', file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,128 @@
+"""
+Microbenchmark of service1's per-request CPU cost for parsing, validating
+and encoding a message.
+
+'legacy' is the original path (json.loads, two-pass validation, json.dumps)
+kept here for reference. Each available JSON backend is then measured on
+the current path, first for parse/validate/encode alone and then for a full
+POST /api/message through the Flask test client against a fake SQS. Results
+are CPU microseconds per request.
+
+Examples:
+    python parsing_benchmark.py
+    python parsing_benchmark.py --content-size 65536 --iterations 5000 --output after.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from fake_aws import FakeSQS
+from harness import compare_to_baseline, load_service, write_results
+from pipeline_benchmark import API_TOKEN, BASE_ENV
+
+BACKENDS = ('json', 'orjson', 'msgspec')
+
+
+def legacy_validate_payload(data, required_fields):
+    if not data:
+        return False, "Missing 'data' field in payload"
+    if not isinstance(data, dict):
+        return False, "Field 'data' must be an object"
+    missing_fields = [field for field in required_fields if field not in data]
+    if missing_fields:
+        return False, f"Missing required fields: {', '.join(missing_fields)}"
+    for field in required_fields:
+        if not isinstance(data[field], str) or not data[field].strip():
+            return False, f"Field '{field}' must be a non-empty string"
+    return True, None
+
+
+def cpu_us_per_op(function, iterations):
+    function()
+    start = time.process_time()
+    for _ in range(iterations):
+        function()
+    return round((time.process_time() - start) / iterations * 1e6, 2)
+
+
+def make_body(content_size):
+    return json.dumps({
+        'token': API_TOKEN,
+        'data': {
+            'email_subject': 'Benchmark subject',
+            'email_sender': 'Benchmark',
+            'email_timestream': str(int(time.time())),
+            'email_content': 'x' * content_size
+        }
+    }).encode('utf-8')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=20000, help='Requests measured per case')
+    parser.add_argument('--content-size', type=int, default=1024, help='Bytes of email_content per message')
+    parser.add_argument('--output', help='Write results JSON to this file')
+    parser.add_argument('--baseline', help='Previous results JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='Allowed relative regression vs baseline')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.environ.update(BASE_ENV)
+    service = load_service('service1')
+    service.logger.disabled = True
+    service.sqs_client = FakeSQS()
+    service.token_cache._current = API_TOKEN
+    service.auth_failure_limiter = None
+    client = service.app.test_client()
+    body = make_body(args.content_size)
+
+    def legacy():
+        payload = json.loads(body)
+        legacy_validate_payload(payload.get('data'), service.REQUIRED_FIELDS)
+        return json.dumps(payload['data'])
+
+    def current():
+        payload, raw_data = service.parse_request_body(body)
+        service.validate_payload(payload.get('data'))
+        return raw_data if raw_data is not None else service.dumps(payload['data'])
+
+    def request():
+        response = client.post('/api/message', data=body, content_type='application/json')
+        assert response.status_code == 200, response.data
+
+    parse_results = {'legacy': cpu_us_per_op(legacy, args.iterations)}
+    request_results = {}
+    available = [backend for backend in BACKENDS if service.select_json_backend(backend) == backend]
+    for backend in available:
+        service.json_backend = backend
+        parse_results[backend] = cpu_us_per_op(current, args.iterations)
+        request_results[backend] = cpu_us_per_op(request, max(1, args.iterations // 10))
+
+    results = write_results({
+        'config': {
+            'iterations': args.iterations,
+            'content_size': args.content_size,
+            'body_bytes': len(body)
+        },
+        'parse_validate_encode_us': parse_results,
+        'request_us': request_results
+    }, args.output)
+
+    if args.baseline:
+        metrics = {f'parse_validate_encode_us.{name}': 'lower' for name in parse_results}
+        metrics.update({f'request_us.{name}': 'lower' for name in request_results})
+        regressions = compare_to_baseline(results, args.baseline, metrics, args.tolerance)
+        if regressions:
+            print('Regressions against baseline:', file=sys.stderr)
+            for regression in regressions:
+                print(f'  {regression}', file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,284 @@
+"""
+End-to-end load test for the service1 -> SQS -> service2 -> S3 pipeline.
+
+Both services run in this process against the in-memory fakes from
+fake_aws.py: service1 behind a real HTTP server, service2 with its normal
+pollers and upload pipeline. The script drives POST /api/message at the
+requested concurrency and rate, then reports throughput, per-stage
+latencies and time from ingest to S3 landing as JSON.
+
+Examples:
+    python pipeline_benchmark.py --requests 5000 --concurrency 32
+    python pipeline_benchmark.py --rate 500 --aws-latency-ms 10 --output after.json --baseline before.json
+    python pipeline_benchmark.py --env S3_WRITE_MODE=segment
+"""
+import argparse
+import gzip
+import http.client
+import itertools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from fake_aws import FakeS3, FakeSQS, FakeSSM
+from harness import LatencyRecorder, compare_to_baseline, load_service, summarize, write_results
+
+API_TOKEN = 'benchmark-token'
+BASE_ENV = {
+    'AWS_REGION': 'us-east-1',
+    'SQS_QUEUE_URL': 'https://sqs.us-east-1.amazonaws.com/000000000000/benchmark-queue',
+    'S3_BUCKET_NAME': 'benchmark-bucket',
+    'SSM_PARAMETER_NAME': '/benchmark/api-token'
+}
+
+BASELINE_METRICS = {
+    'ingest.requests_per_s': 'higher',
+    'ingest.latency.p99_ms': 'lower',
+    'pipeline.messages_per_s': 'higher',
+    'end_to_end.p99_ms': 'lower'
+}
+
+
+class LandingTracker:
+    """Records when each benchmark message first lands in S3."""
+
+    def __init__(self):
+        self.sent_at = {}
+        self.landed_at = {}
+        self.duplicates = 0
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+
+    def on_put(self, key, stored):
+        if not key.startswith(('messages/', 'segments/')):
+            return
+        body = stored['Body']
+        if stored.get('ContentEncoding') == 'gzip':
+            body = gzip.decompress(body)
+
+        if key.endswith('.json'):
+            records = [json.loads(body)]
+        else:
+            records = [json.loads(line) for line in body.splitlines() if line.strip()]
+
+        now = time.time()
+        with self._condition:
+            for record in records:
+                subject = record.get('data', {}).get('email_subject')
+                if subject in self.landed_at:
+                    self.duplicates += 1
+                else:
+                    self.landed_at[subject] = now
+            self._condition.notify_all()
+
+    def wait_for(self, count, timeout):
+        with self._condition:
+            return self._condition.wait_for(lambda: len(self.landed_at) >= count, timeout)
+
+    def latencies_ms(self):
+        with self._lock:
+            return [
+                (self.landed_at[subject] - sent) * 1000
+                for subject, sent in self.sent_at.items()
+                if subject in self.landed_at
+            ]
+
+
+def start_service1(service1):
+    from werkzeug.serving import make_server
+
+    server = make_server('127.0.0.1', 0, service1.app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, name='service1-http', daemon=True)
+    thread.start()
+    return server
+
+
+def start_service2(service2):
+    heartbeat = service2.VisibilityHeartbeat() if service2.VISIBILITY_HEARTBEAT else None
+    if heartbeat:
+        heartbeat.start()
+    segment_writer = service2.SegmentWriter() if service2.S3_WRITE_MODE == 'segment' else None
+    pipeline = service2.MessagePipeline(heartbeat=heartbeat, segment_writer=segment_writer)
+    pollers = service2.PollerGroup(pipeline)
+    pollers.scale_to(max(service2.POLLER_COUNT, 1))
+    return heartbeat, pipeline, pollers
+
+
+def stop_service2(fake_sqs, heartbeat, pipeline, pollers):
+    fake_sqs.close()
+    pollers.stop()
+    pipeline.shutdown(wait=True)
+    if heartbeat:
+        heartbeat.stop()
+
+
+def drive_load(port, args, recorder, tracker):
+    counter = itertools.count()
+    counts = {'succeeded': 0, 'failed': 0}
+    counts_lock = threading.Lock()
+    start = time.perf_counter()
+
+    def worker():
+        while True:
+            index = next(counter)
+            if index >= args.requests:
+                return
+            if args.rate:
+                delay = start + index / args.rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+            subject = f'bench-{index}'
+            body = json.dumps({
+                'token': API_TOKEN,
+                'data': {
+                    'email_subject': subject,
+                    'email_sender': 'Benchmark',
+                    'email_timestream': str(int(time.time())),
+                    'email_content': 'x' * args.content_size
+                }
+            })
+
+            tracker.sent_at[subject] = time.time()
+            request_start = time.perf_counter()
+            try:
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                conn.request('POST', '/api/message', body, {'Content-Type': 'application/json'})
+                response = conn.getresponse()
+                response.read()
+                conn.close()
+                ok = response.status == 200
+            except OSError:
+                ok = False
+            recorder.record('ingest.http', (time.perf_counter() - request_start) * 1000)
+
+            with counts_lock:
+                counts['succeeded' if ok else 'failed'] += 1
+            if not ok:
+                tracker.sent_at.pop(subject, None)
+
+    threads = [threading.Thread(target=worker, name=f'load-{i}') for i in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return counts, time.perf_counter() - start
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000, help='Total requests to send')
+    parser.add_argument('--concurrency', type=int, default=16, help='Concurrent client connections')
+    parser.add_argument('--rate', type=float, default=0, help='Target requests/s across all clients (0 = unbounded)')
+    parser.add_argument('--content-size', type=int, default=256, help='Bytes of email_content per message')
+    parser.add_argument('--aws-latency-ms', type=float, default=0, help='Simulated latency of every AWS call')
+    parser.add_argument('--drain-timeout', type=float, default=120, help='Seconds to wait for messages to land in S3')
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help='Environment variable for the services (repeatable)')
+    parser.add_argument('--log-level', default='WARNING', help='Log level for the services')
+    parser.add_argument('--output', help='Write results JSON to this file')
+    parser.add_argument('--baseline', help='Previous results JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='Allowed relative regression vs baseline')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    env = dict(BASE_ENV)
+    for item in args.env:
+        key, _, value = item.partition('=')
+        env[key] = value
+    os.environ.update(env)
+
+    service1 = load_service('service1')
+    service2 = load_service('service2')
+    logging.getLogger().setLevel(args.log_level)
+    logging.getLogger('werkzeug').setLevel(args.log_level)
+
+    tracker = LandingTracker()
+    fake_sqs = FakeSQS(args.aws_latency_ms, visibility_timeout=service2.VISIBILITY_TIMEOUT)
+    fake_s3 = FakeS3(args.aws_latency_ms, on_put=tracker.on_put)
+    fake_ssm = FakeSSM({env['SSM_PARAMETER_NAME']: API_TOKEN}, args.aws_latency_ms)
+    service1.sqs_client = fake_sqs
+    service1.ssm_client = fake_ssm
+    service1.s3_client = fake_s3
+    service2.sqs_client = fake_sqs
+    service2.s3_client = fake_s3
+
+    recorder = LatencyRecorder()
+    for name in ('validate_token', 'send_to_sqs', 'send_batch_to_sqs'):
+        recorder.wrap(service1, name, f'service1.{name}')
+    for name in ('poll_sqs', 'process_message', 'upload_to_s3', 'delete_message', 'delete_message_batch'):
+        recorder.wrap(service2, name, f'service2.{name}')
+    recorder.wrap(service2.SegmentStream, 'finish', 'service2.segment_upload')
+
+    server = start_service1(service1)
+    heartbeat, pipeline, pollers = start_service2(service2)
+    pipeline_start = time.perf_counter()
+
+    try:
+        counts, ingest_duration = drive_load(server.server_port, args, recorder, tracker)
+        drained = tracker.wait_for(counts['succeeded'], args.drain_timeout)
+        pipeline_duration = time.perf_counter() - pipeline_start
+    finally:
+        server.shutdown()
+        stop_service2(fake_sqs, heartbeat, pipeline, pollers)
+
+    processed, errors = pipeline.stats()
+    landed = len(tracker.landed_at)
+    end_to_end = summarize(tracker.latencies_ms())
+    end_to_end.update({
+        'landed': landed,
+        'missing': counts['succeeded'] - landed,
+        'duplicates': tracker.duplicates,
+        'drained': drained
+    })
+    stages = recorder.summary()
+
+    results = write_results({
+        'config': {
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'rate': args.rate,
+            'content_size': args.content_size,
+            'aws_latency_ms': args.aws_latency_ms,
+            'env': {key: value for key, value in env.items() if key not in BASE_ENV}
+        },
+        'ingest': {
+            **counts,
+            'duration_s': round(ingest_duration, 3),
+            'requests_per_s': round(args.requests / ingest_duration, 1) if ingest_duration else None,
+            'latency': stages.pop('ingest.http', {})
+        },
+        'pipeline': {
+            'processed': processed,
+            'errors': errors,
+            'duration_s': round(pipeline_duration, 3),
+            'messages_per_s': round(landed / pipeline_duration, 1) if pipeline_duration else None
+        },
+        'end_to_end': end_to_end,
+        'stages': stages,
+        'aws_calls': {
+            'sqs': dict(fake_sqs.calls),
+            's3': dict(fake_s3.calls),
+            'ssm': dict(fake_ssm.calls)
+        }
+    }, args.output)
+
+    if args.baseline:
+        regressions = compare_to_baseline(results, args.baseline, BASELINE_METRICS, args.tolerance)
+        if regressions:
+            print('Regressions against baseline:', file=sys.stderr)
+            for regression in regressions:
+                print(f'  {regression}', file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,191 @@
+"""
+Show the effect of the boto3 connection pool size (AWS_MAX_POOL_CONNECTIONS)
+under concurrent calls.
+
+Unlike the other benchmarks this goes through real botocore and urllib3:
+clients from common/aws_clients.py call PutObject on a local HTTP endpoint
+with a simulated latency per call and per new connection (standing in for
+the TCP and TLS handshakes against real AWS). Calls come in waves of
+--concurrency, the way a poll batch fans out to the upload workers.
+
+urllib3 never blocks on a full pool. It opens extra connections and
+closes whatever does not fit back in the pool once a wave finishes, so a
+pool smaller than the number of calling threads shows up as new
+connections on every wave. For each pool size the script reports
+throughput, latency percentiles, the connections the endpoint accepted and
+the "Connection pool is full" warnings urllib3 logged.
+
+Examples:
+    python pool_benchmark.py
+    python pool_benchmark.py --concurrency 64 --pool-sizes 10,32,64 --latency-ms 10 --output pools.json
+"""
+import argparse
+import logging
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from harness import compare_to_baseline, load_service, summarize, write_results
+
+
+class FakeS3Endpoint(ThreadingHTTPServer):
+    """
+    Answers every PUT with 200 after latency_ms, delays each new connection
+    by connect_latency_ms and counts accepted connections.
+    """
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, latency_ms, connect_latency_ms):
+        self.latency = latency_ms / 1000.0
+        self.connect_latency = connect_latency_ms / 1000.0
+        self.connections = 0
+        self._lock = threading.Lock()
+        super().__init__(('127.0.0.1', 0), FakeS3Handler)
+
+    def connection_opened(self):
+        with self._lock:
+            self.connections += 1
+
+
+class FakeS3Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.connection_opened()
+        time.sleep(self.server.connect_latency)
+
+    def do_PUT(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(self.server.latency)
+        self.send_response(200)
+        self.send_header('ETag', '"benchmark"')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PoolFullCounter(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.count = 0
+
+    def emit(self, record):
+        if 'Connection pool is full' in record.getMessage():
+            self.count += 1
+
+
+def run_pool_size(aws_clients, endpoint, pool_size, args):
+    client = aws_clients.create_client(
+        's3',
+        config=aws_clients.client_config(
+            max_pool_connections=pool_size,
+            s3={'addressing_style': 'path'}
+        ),
+        endpoint_url=f'http://127.0.0.1:{endpoint.server_port}',
+        aws_access_key_id='benchmark',
+        aws_secret_access_key='benchmark'
+    )
+    body = b'x' * args.body_size
+    client.put_object(Bucket='benchmark-bucket', Key='warmup', Body=body)
+
+    warnings = PoolFullCounter()
+    urllib3_logger = logging.getLogger('urllib3.connectionpool')
+    urllib3_logger.addHandler(warnings)
+    connections_before = endpoint.connections
+    waves = max(1, args.requests // args.concurrency)
+    barrier = threading.Barrier(args.concurrency)
+    latencies = []
+    errors = []
+
+    def worker():
+        for _ in range(waves):
+            barrier.wait()
+            start = time.perf_counter()
+            try:
+                client.put_object(Bucket='benchmark-bucket', Key='benchmark', Body=body)
+            except Exception as e:
+                errors.append(e)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    threads = [threading.Thread(target=worker, name=f'pool-load-{i}') for i in range(args.concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - start
+    urllib3_logger.removeHandler(warnings)
+    client.close()
+
+    return {
+        'duration_s': round(duration, 3),
+        'requests_per_s': round(len(latencies) / duration, 1) if duration else None,
+        'latency': summarize(latencies),
+        'errors': len(errors),
+        'connections_opened': endpoint.connections - connections_before,
+        'pool_full_warnings': warnings.count
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pool-sizes', default='10,25,50', help='Comma-separated max_pool_connections values')
+    parser.add_argument('--concurrency', type=int, default=32, help='Threads calling PutObject at once')
+    parser.add_argument('--requests', type=int, default=3200, help='PutObject calls per pool size')
+    parser.add_argument('--latency-ms', type=float, default=20, help='Simulated endpoint latency per call')
+    parser.add_argument('--connect-latency-ms', type=float, default=30,
+                        help='Simulated handshake time per new connection')
+    parser.add_argument('--body-size', type=int, default=1024, help='Bytes per object')
+    parser.add_argument('--output', help='Write results JSON to this file')
+    parser.add_argument('--baseline', help='Previous results JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='Allowed relative regression vs baseline')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    pool_sizes = [int(size) for size in args.pool_sizes.split(',')]
+    aws_clients = load_service('common', module_name='aws_clients', filename='aws_clients.py')
+
+    endpoint = FakeS3Endpoint(args.latency_ms, args.connect_latency_ms)
+    threading.Thread(target=endpoint.serve_forever, name='fake-s3-endpoint', daemon=True).start()
+    try:
+        pools = {str(size): run_pool_size(aws_clients, endpoint, size, args) for size in pool_sizes}
+    finally:
+        endpoint.shutdown()
+
+    results = write_results({
+        'config': {
+            'concurrency': args.concurrency,
+            'requests': args.requests,
+            'latency_ms': args.latency_ms,
+            'connect_latency_ms': args.connect_latency_ms,
+            'body_size': args.body_size,
+            'retry_mode': aws_clients.AWS_RETRY_MODE,
+            'tcp_keepalive': aws_clients.AWS_TCP_KEEPALIVE
+        },
+        'pools': pools
+    }, args.output)
+
+    if args.baseline:
+        metrics = {}
+        for size in pools:
+            metrics[f'pools.{size}.requests_per_s'] = 'higher'
+            metrics[f'pools.{size}.latency.p99_ms'] = 'lower'
+        regressions = compare_to_baseline(results, args.baseline, metrics, args.tolerance)
+        if regressions:
+            print('Regressions against baseline:', file=sys.stderr)
+            for regression in regressions:
+                print(f'  {regression}', file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,210 @@
+"""
+Compare service1's sync (gunicorn gthread, app.py) and async (hypercorn,
+asgi.py) serving modes under many concurrent connections.
+
+Each mode runs in its own child process, one worker, against the in-memory
+AWS fakes with a simulated per-call latency; the parent drives
+POST /api/message over keep-alive connections and reports throughput,
+latency percentiles and errors per mode as JSON.
+
+Examples:
+    python serving_benchmark.py --concurrency 1000 --requests 20000 --aws-latency-ms 20
+    python serving_benchmark.py --mode async --concurrency 5000 --output async.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from fake_aws import AsyncFakeSQS, FakeSQS, FakeSSM
+from harness import compare_to_baseline, load_service, summarize, write_results
+from pipeline_benchmark import API_TOKEN, BASE_ENV
+
+MODES = ('sync', 'async')
+
+BASELINE_METRICS = {
+    f'{mode}.{metric}': better
+    for mode in MODES
+    for metric, better in (('requests_per_s', 'higher'), ('latency.p99_ms', 'lower'))
+}
+
+
+def serve(args):
+    """Child process: start service1 in the given mode on args.port."""
+    os.environ.update(BASE_ENV)
+    service = load_service('service1', module_name='app')
+    logging.getLogger().setLevel(args.log_level)
+
+    fake_sqs = FakeSQS(args.aws_latency_ms)
+    service.sqs_client = fake_sqs
+    service.ssm_client = FakeSSM({BASE_ENV['SSM_PARAMETER_NAME']: API_TOKEN}, args.aws_latency_ms)
+
+    if args.serve == 'async':
+        from hypercorn.asyncio import serve as hypercorn_serve
+        from hypercorn.config import Config
+
+        asgi = load_service('service1', module_name='asgi', filename='asgi.py')
+        asgi.sqs_client = AsyncFakeSQS(fake_sqs)
+        config = Config()
+        config.bind = [f'127.0.0.1:{args.port}']
+        config.backlog = 4096
+        config.keep_alive_timeout = 60
+        config.loglevel = args.log_level
+        asyncio.run(hypercorn_serve(asgi.app, config))
+    else:
+        from gunicorn.app.base import BaseApplication
+
+        class Server(BaseApplication):
+            def load_config(self):
+                for key, value in {
+                    'bind': f'127.0.0.1:{args.port}',
+                    'workers': 1,
+                    'threads': args.threads,
+                    'worker_class': 'gthread',
+                    'backlog': 4096,
+                    'keepalive': 60,
+                    'loglevel': args.log_level.lower()
+                }.items():
+                    self.cfg.set(key, value)
+
+            def load(self):
+                return service.app
+
+        Server().run()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def wait_until_ready(session, url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(f'{url}/health') as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f'Server at {url} did not become ready')
+
+
+async def drive_load(url, args):
+    import aiohttp
+
+    latencies = []
+    counts = {'succeeded': 0, 'failed': 0}
+    body = json.dumps({
+        'token': API_TOKEN,
+        'data': {
+            'email_subject': 'bench',
+            'email_sender': 'Benchmark',
+            'email_timestream': str(int(time.time())),
+            'email_content': 'x' * args.content_size
+        }
+    })
+    remaining = iter(range(args.requests))
+
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    timeout = aiohttp.ClientTimeout(total=args.request_timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        await wait_until_ready(session, url)
+
+        async def client():
+            for _ in remaining:
+                start = time.perf_counter()
+                try:
+                    async with session.post(f'{url}/api/message', data=body,
+                                            headers={'Content-Type': 'application/json'}) as response:
+                        await response.read()
+                        ok = response.status == 200
+                except (aiohttp.ClientError, asyncio.TimeoutError, OSError):
+                    ok = False
+                latencies.append((time.perf_counter() - start) * 1000)
+                counts['succeeded' if ok else 'failed'] += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(args.concurrency)))
+        duration = time.perf_counter() - start
+
+    return {
+        **counts,
+        'duration_s': round(duration, 3),
+        'requests_per_s': round(args.requests / duration, 1) if duration else None,
+        'latency': summarize(latencies)
+    }
+
+
+def run_mode(mode, args):
+    port = free_port()
+    command = [
+        sys.executable, os.path.abspath(__file__), '--serve', mode, '--port', str(port),
+        '--aws-latency-ms', str(args.aws_latency_ms), '--threads', str(args.threads),
+        '--log-level', args.log_level
+    ]
+    server = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)))
+    try:
+        return asyncio.run(drive_load(f'http://127.0.0.1:{port}', args))
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=MODES + ('both',), default='both', help='Serving mode(s) to benchmark')
+    parser.add_argument('--requests', type=int, default=10000, help='Total requests per mode')
+    parser.add_argument('--concurrency', type=int, default=1000, help='Concurrent client connections')
+    parser.add_argument('--content-size', type=int, default=256, help='Bytes of email_content per message')
+    parser.add_argument('--aws-latency-ms', type=float, default=20, help='Simulated latency of every AWS call')
+    parser.add_argument('--threads', type=int, default=8, help='gunicorn threads for the sync worker')
+    parser.add_argument('--request-timeout', type=float, default=60, help='Client timeout per request (seconds)')
+    parser.add_argument('--log-level', default='WARNING', help='Log level for the service')
+    parser.add_argument('--output', help='Write results JSON to this file')
+    parser.add_argument('--baseline', help='Previous results JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='Allowed relative regression vs baseline')
+    parser.add_argument('--serve', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.serve:
+        serve(args)
+        return 0
+
+    modes = MODES if args.mode == 'both' else (args.mode,)
+    results = {
+        'config': {
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'content_size': args.content_size,
+            'aws_latency_ms': args.aws_latency_ms,
+            'sync_threads': args.threads
+        }
+    }
+    for mode in modes:
+        results[mode] = run_mode(mode, args)
+    results = write_results(results, args.output)
+
+    if args.baseline:
+        regressions = compare_to_baseline(results, args.baseline, BASELINE_METRICS, args.tolerance)
+        if regressions:
+            print('Regressions against baseline:', file=sys.stderr)
+            for regression in regressions:
+                print(f'  {regression}', file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
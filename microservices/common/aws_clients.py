@@ -0,0 +1,93 @@
+"""
+boto3 client factory shared by both microservices.
+
+Every client gets one botocore Config built from the environment, and the
+module-level clients in the services are LazyClient proxies: the real
+client is created on first use, so importing a service (or its tests)
+needs no AWS credentials, and each gunicorn worker builds its own clients
+after the fork.
+"""
+import os
+import threading
+import boto3
+from botocore.config import Config
+
+AWS_REGION = os.environ.get('AWS_REGION', 'us-east-1')
+# Connections kept per client; botocore's default of 10 is below the number
+# of threads that call AWS at once in either service
+AWS_MAX_POOL_CONNECTIONS = int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', '50'))
+AWS_CONNECT_TIMEOUT = float(os.environ.get('AWS_CONNECT_TIMEOUT', '5'))
+# Must stay above the 20s SQS long-poll
+AWS_READ_TIMEOUT = float(os.environ.get('AWS_READ_TIMEOUT', '30'))
+# 'adaptive' adds client-side rate limiting on throttling errors to the
+# 'standard' retry mode. Same variable names (and meaning: attempts include
+# the first call) that botocore itself reads
+AWS_RETRY_MODE = os.environ.get('AWS_RETRY_MODE', 'adaptive')
+AWS_MAX_ATTEMPTS = int(os.environ.get('AWS_MAX_ATTEMPTS', '5'))
+AWS_TCP_KEEPALIVE = os.environ.get('AWS_TCP_KEEPALIVE', 'true').lower() == 'true'
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def config_options(min_pool_connections=0, **overrides):
+    """Keyword arguments for botocore's Config (or aiobotocore's AioConfig)."""
+    options = {
+        'max_pool_connections': max(AWS_MAX_POOL_CONNECTIONS, min_pool_connections),
+        'connect_timeout': AWS_CONNECT_TIMEOUT,
+        'read_timeout': AWS_READ_TIMEOUT,
+        'retries': {'mode': AWS_RETRY_MODE, 'total_max_attempts': AWS_MAX_ATTEMPTS},
+        'tcp_keepalive': AWS_TCP_KEEPALIVE
+    }
+    options.update(overrides)
+    return options
+
+
+def client_config(min_pool_connections=0, **overrides):
+    return Config(**config_options(min_pool_connections, **overrides))
+
+
+def create_client(service_name, region_name=None, config=None, **kwargs):
+    """Build a new client with the shared config; kwargs go to boto3.client."""
+    return boto3.client(
+        service_name,
+        region_name=region_name or AWS_REGION,
+        config=config or client_config(),
+        **kwargs
+    )
+
+
+def get_client(service_name, region_name=None, min_pool_connections=0):
+    """Return the process-wide client for service_name, creating it on first use."""
+    key = (service_name, region_name or AWS_REGION, min_pool_connections)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = create_client(
+                    service_name,
+                    region_name,
+                    client_config(min_pool_connections)
+                )
+                _clients[key] = client
+    return client
+
+
+class LazyClient:
+    """
+    Stands in for a boto3 client until it is first used. Attribute access
+    (e.g. lazy.send_message) creates the client through get_client and
+    forwards to it.
+    """
+
+    def __init__(self, service_name, region_name=None, min_pool_connections=0):
+        self.service_name = service_name
+        self.region_name = region_name
+        self.min_pool_connections = min_pool_connections
+
+    def __getattr__(self, name):
+        return getattr(get_client(self.service_name, self.region_name, self.min_pool_connections), name)
+
+    def __repr__(self):
+        return f"LazyClient({self.service_name!r}, region_name={self.region_name!r})"
@@ -0,0 +1,107 @@
+"""
+S3 key layout for stored messages and the hourly manifests that index
+them. service2 uses it to write both, tools/lookup_message.py to read them.
+
+The 'hourly' layout stores every message under messages/YYYY/MM/DD/HH/.
+The 'sharded' layout puts the first shard_chars hex characters of the
+record's SHA-256 in front of the hour, messages/{shard}/YYYY/MM/DD/HH/, so
+writes are spread over 16**shard_chars prefixes and each prefix gets its
+own S3 request-rate limit. In both layouts the key depends only on the
+record ID and the send hour, so a redelivered message is written to the
+same key.
+
+Manifests are gzip-compressed newline-delimited JSON objects under
+index/YYYY/MM/DD/HH/, sorted by message ID, with one
+{"id", "key", "sender"} line per stored message ("line" is the record's
+position when the key is a segment). The hour is the one in the key the
+entry points to, so finding a message reads a few small manifests for
+that hour instead of listing every object in it.
+"""
+import gzip
+import json
+import hashlib
+import uuid
+from datetime import datetime, timedelta
+
+LAYOUTS = ('hourly', 'sharded')
+MESSAGE_PREFIX = 'messages/'
+MANIFEST_PREFIX = 'index/'
+
+
+def hour_path(timestamp):
+    return timestamp.strftime('%Y/%m/%d/%H')
+
+
+def key_shard(record, shard_chars):
+    return hashlib.sha256(record.encode('utf-8')).hexdigest()[:shard_chars]
+
+
+def object_key(record, sent_at, layout='hourly', shard_chars=2):
+    hour = hour_path(sent_at)
+    if layout == 'sharded':
+        return f"{MESSAGE_PREFIX}{key_shard(record, shard_chars)}/{hour}/{record}.json"
+    return f"{MESSAGE_PREFIX}{hour}/{record}.json"
+
+
+def hour_prefixes(hour, layout='hourly', shard_chars=2):
+    """Every prefix holding messages sent in the hour partition hour ('YYYY/MM/DD/HH'), in key order."""
+    if layout == 'sharded':
+        width = 16 ** shard_chars
+        return [f"{MESSAGE_PREFIX}{shard:0{shard_chars}x}/{hour}/" for shard in range(width)]
+    return [f"{MESSAGE_PREFIX}{hour}/"]
+
+
+def manifest_key(hour, prefix=MANIFEST_PREFIX):
+    """Key for a new manifest of the hour partition hour ('YYYY/MM/DD/HH')."""
+    return f"{prefix}{hour}/manifest_{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}_{uuid.uuid4().hex[:8]}.ndjson.gz"
+
+
+def encode_manifest(entries):
+    body = ''.join(
+        json.dumps(entry, separators=(',', ':')) + '\n'
+        for entry in sorted(entries, key=lambda entry: entry['id'])
+    )
+    return gzip.compress(body.encode('utf-8'))
+
+
+def decode_manifest(body):
+    return [json.loads(line) for line in gzip.decompress(body).decode('utf-8').splitlines() if line]
+
+
+def hours_back(end, count):
+    """The count hour partitions ending with the one containing end, newest first."""
+    end = end.replace(minute=0, second=0, microsecond=0)
+    return [hour_path(end - timedelta(hours=offset)) for offset in range(count)]
+
+
+def list_keys(client, bucket, prefix, start_after=None):
+    token = None
+    while True:
+        kwargs = {'Bucket': bucket, 'Prefix': prefix}
+        if start_after:
+            kwargs['StartAfter'] = start_after
+        if token:
+            kwargs['ContinuationToken'] = token
+        response = client.list_objects_v2(**kwargs)
+        for item in response.get('Contents', []):
+            yield item['Key']
+        if not response.get('IsTruncated'):
+            return
+        token = response['NextContinuationToken']
+
+
+def search_manifests(client, bucket, hours, message_id=None, sender=None, prefix=MANIFEST_PREFIX):
+    """
+    Yield the manifest entries for hours (in the order given) that match
+    message_id and sender, whichever are set. Only the manifests are
+    listed and read, never the messages themselves.
+    """
+    for hour in hours:
+        for key in list_keys(client, bucket, f"{prefix}{hour}/"):
+            body = client.get_object(Bucket=bucket, Key=key)['Body'].read()
+            for entry in decode_manifest(body):
+                if message_id is not None and entry['id'] != message_id:
+                    continue
+                if sender is not None and entry.get('sender') != sender:
+                    continue
+                yield entry
@@ -0,0 +1,180 @@
+"""
+Logging setup shared by both microservices: one JSON object per line on
+stderr, written from a background thread, with per-message success logs
+sampled.
+
+configure() replaces the root logger's handlers. With LOG_ASYNC the
+handler only puts records on a bounded queue, and a QueueListener thread
+formats and writes them, so request and worker threads never wait on
+stderr (writes block when the container's log driver falls behind). If
+the queue is full, records below WARNING are dropped and counted, while
+warnings and errors are written straight away instead so they are never
+lost.
+
+Per-message success logs go through log_success(), which writes a
+LOG_SUCCESS_SAMPLE_RATE fraction of them. When a message ID is given the
+decision is made from its hash, so a sampled message is logged at every
+stage in both services. Details are passed as fields rather than
+formatted into the message, so a skipped log costs one hash and no string
+formatting.
+"""
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import zlib
+import logging
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+# 'json' (one object per line) or 'text'
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json').lower()
+LOG_ASYNC = os.environ.get('LOG_ASYNC', 'true').lower() == 'true'
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', '10000'))
+# Fraction of per-message success logs written; errors are always logged
+LOG_SUCCESS_SAMPLE_RATE = float(os.environ.get('LOG_SUCCESS_SAMPLE_RATE', '0.01'))
+
+SAMPLE_BUCKETS = 10000
+
+_listener = None
+_handler = None
+_lock = threading.Lock()
+
+
+def dumps(entry):
+    if orjson is not None:
+        return orjson.dumps(entry, default=str).decode('utf-8')
+    return json.dumps(entry, default=str, separators=(',', ':'))
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record, plus any fields passed with extra={'fields': {...}}, as one JSON line."""
+
+    def __init__(self, service_name=None):
+        super().__init__()
+        self.service_name = service_name
+
+    def format(self, record):
+        entry = {
+            'timestamp': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        if self.service_name:
+            entry['service'] = self.service_name
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return dumps(entry)
+
+
+class TextFormatter(logging.Formatter):
+    """The basicConfig format with fields appended as key=value."""
+
+    def __init__(self):
+        super().__init__('%(levelname)s:%(name)s:%(message)s')
+
+    def format(self, record):
+        line = super().format(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            line += ' ' + ' '.join(f'{key}={value}' for key, value in fields.items())
+        return line
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Queues records for a QueueListener without ever waiting. Records are
+    formatted on the listener thread, not here. When the queue is full,
+    warnings and errors go to fallback directly and anything lower is
+    dropped.
+    """
+
+    def __init__(self, log_queue, fallback):
+        super().__init__(log_queue)
+        self.fallback = fallback
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if record.levelno >= logging.WARNING:
+                self.fallback.handle(record)
+            else:
+                self.dropped += 1
+
+
+def configure(service_name=None, level=LOG_LEVEL, log_format=LOG_FORMAT, use_queue=LOG_ASYNC,
+              queue_size=LOG_QUEUE_SIZE, stream=None):
+    """Install the root handler; call once per process, after any fork. Returns the handler."""
+    global _listener, _handler
+    with _lock:
+        if _listener:
+            _listener.stop()
+            _listener = None
+
+        stream_handler = logging.StreamHandler(stream or sys.stderr)
+        stream_handler.setFormatter(JsonFormatter(service_name) if log_format == 'json' else TextFormatter())
+        if use_queue:
+            _handler = NonBlockingQueueHandler(queue.Queue(maxsize=queue_size), stream_handler)
+            _listener = QueueListener(_handler.queue, stream_handler)
+            _listener.start()
+        else:
+            _handler = stream_handler
+
+        root = logging.getLogger()
+        root.handlers = [_handler]
+        root.setLevel(level)
+    return _handler
+
+
+def shutdown():
+    """Write every queued record and stop the listener thread."""
+    global _listener
+    with _lock:
+        if _listener:
+            _listener.stop()
+            _listener = None
+
+
+def dropped_records():
+    return getattr(_handler, 'dropped', 0)
+
+
+def should_sample(key=None, rate=None):
+    rate = LOG_SUCCESS_SAMPLE_RATE if rate is None else rate
+    if rate >= 1:
+        return True
+    if rate <= 0:
+        return False
+    if key is None:
+        return random.random() < rate
+    return zlib.crc32(key.encode('utf-8')) % SAMPLE_BUCKETS < rate * SAMPLE_BUCKETS
+
+
+def log_success(logger, message, message_id=None, **fields):
+    """Log a per-message success at INFO if this message is sampled."""
+    if not should_sample(message_id) or not logger.isEnabledFor(logging.INFO):
+        return
+    if message_id is not None:
+        fields['message_id'] = message_id
+    logger.info(message, extra={'fields': fields}, stacklevel=2)
+
+
+atexit.register(shutdown)
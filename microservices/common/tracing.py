@@ -0,0 +1,253 @@
+"""
+Sampled tracing shared by both microservices, with no dependency beyond
+the standard library.
+
+Trace context travels between services as a W3C traceparent string
+(HTTP header into service1, TraceParent message attribute into service2).
+Every request gets a trace ID. Only sampled traces, chosen at the root by
+TRACE_SAMPLE_RATE, export their spans. Spans are written in the
+OpenTelemetry OTLP/JSON encoding: posted to a collector's /v1/traces
+endpoint, or appended one batch per line to a file (the format the
+collector's file exporter writes and its otlpjsonfile receiver reads).
+"""
+import os
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+import threading
+import urllib.request
+
+logger = logging.getLogger(__name__)
+
+# Fraction of new traces whose spans are exported; a sampled parent is
+# always followed
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0.01'))
+# 'none', 'file' (TRACE_FILE) or 'otlp' (OTEL_EXPORTER_OTLP_ENDPOINT)
+TRACE_EXPORTER = os.environ.get('TRACE_EXPORTER', 'none').lower()
+TRACE_FILE = os.environ.get('TRACE_FILE', '/tmp/traces.jsonl')
+OTEL_EXPORTER_OTLP_ENDPOINT = os.environ.get('OTEL_EXPORTER_OTLP_ENDPOINT', 'http://localhost:4318')
+TRACE_EXPORT_INTERVAL = float(os.environ.get('TRACE_EXPORT_INTERVAL', '5'))
+TRACE_MAX_QUEUE = int(os.environ.get('TRACE_MAX_QUEUE', '2048'))
+TRACE_MAX_BATCH = 512
+
+SPAN_KINDS = {'internal': 1, 'server': 2, 'client': 3, 'producer': 4, 'consumer': 5}
+STATUS_ERROR = 2
+
+
+def new_trace_id():
+    return f'{random.getrandbits(128):032x}'
+
+
+def new_span_id():
+    return f'{random.getrandbits(64):016x}'
+
+
+def parse_traceparent(value):
+    """Return (trace_id, span_id, sampled) from a traceparent string, or None if it is invalid."""
+    parts = value.strip().split('-') if isinstance(value, str) else ()
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16 or len(parts[3]) != 2:
+        return None
+    try:
+        flags = int(parts[3], 16)
+        if int(parts[1], 16) == 0 or int(parts[2], 16) == 0:
+            return None
+    except ValueError:
+        return None
+    return parts[1].lower(), parts[2].lower(), bool(flags & 1)
+
+
+def attribute_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+class Span:
+    """
+    One timed operation. Times are epoch seconds; a span is exported when
+    end() is called and its trace is sampled. Usable as a context manager,
+    which marks the span as an error if the block raises.
+    """
+
+    def __init__(self, tracer, name, trace_id, parent_id, sampled, kind='internal', start_time=None,
+                 attributes=None):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = new_span_id()
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.kind = kind
+        self.start_time = start_time if start_time is not None else time.time()
+        self.end_time = None
+        self.attributes = dict(attributes or {})
+        self.error = None
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def end(self, end_time=None):
+        if self.end_time is not None:
+            return
+        self.end_time = end_time if end_time is not None else time.time()
+        if self.sampled:
+            self.tracer.export(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.error = str(exc)
+        self.end()
+        return False
+
+    def to_otlp(self):
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': SPAN_KINDS.get(self.kind, 1),
+            'startTimeUnixNano': str(int(self.start_time * 1e9)),
+            'endTimeUnixNano': str(int(self.end_time * 1e9)),
+            'attributes': [{'key': key, 'value': attribute_value(value)} for key, value in self.attributes.items()]
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        if self.error is not None:
+            span['status'] = {'code': STATUS_ERROR, 'message': self.error}
+        return span
+
+
+class SpanExporter:
+    """
+    Queues finished spans and writes them from a background thread every
+    TRACE_EXPORT_INTERVAL seconds or TRACE_MAX_BATCH spans. Spans are
+    dropped (and counted) when the queue is full, so a slow collector never
+    holds up request handling.
+    """
+
+    def __init__(self, service_name, exporter=TRACE_EXPORTER, path=TRACE_FILE,
+                 endpoint=OTEL_EXPORTER_OTLP_ENDPOINT, interval=TRACE_EXPORT_INTERVAL, max_queue=TRACE_MAX_QUEUE):
+        self.service_name = service_name
+        self.exporter = exporter
+        self.path = path
+        self.url = endpoint.rstrip('/') + '/v1/traces'
+        self.interval = interval
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def _ensure_started(self):
+        # Started lazily so each gunicorn worker gets its own thread after fork
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='span-exporter', daemon=True)
+                    self._thread.start()
+                    atexit.register(self.close)
+
+    def export(self, span):
+        if self.exporter not in ('file', 'otlp'):
+            return
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _drain(self, limit=TRACE_MAX_BATCH):
+        spans = []
+        while len(spans) < limit:
+            try:
+                spans.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return spans
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.flush()
+
+    def flush(self):
+        while True:
+            spans = self._drain()
+            if not spans:
+                return
+            try:
+                self._write(spans)
+            except Exception as e:
+                logger.error(f"Failed to export {len(spans)} spans: {e}")
+
+    def close(self):
+        self._stop_event.set()
+        self.flush()
+
+    def payload(self, spans):
+        return {
+            'resourceSpans': [{
+                'resource': {
+                    'attributes': [{'key': 'service.name', 'value': attribute_value(self.service_name)}]
+                },
+                'scopeSpans': [{
+                    'scope': {'name': 'checkpoint-exam.tracing'},
+                    'spans': [span.to_otlp() for span in spans]
+                }]
+            }]
+        }
+
+    def _write(self, spans):
+        body = json.dumps(self.payload(spans), separators=(',', ':'))
+        if self.exporter == 'file':
+            with open(self.path, 'a') as f:
+                f.write(body + '\n')
+            return
+        request = urllib.request.Request(
+            self.url,
+            data=body.encode('utf-8'),
+            headers={'Content-Type': 'application/json'},
+            method='POST'
+        )
+        with urllib.request.urlopen(request, timeout=5) as response:
+            response.read()
+
+
+class Tracer:
+    def __init__(self, service_name, sample_rate=TRACE_SAMPLE_RATE, exporter=None):
+        self.sample_rate = sample_rate
+        self.exporter = exporter or SpanExporter(service_name)
+
+    def start_span(self, name, parent=None, kind='internal', start_time=None, attributes=None):
+        """
+        Start a span under parent: a Span, a traceparent string (e.g. from
+        another service) or None. Without a valid parent a new trace is
+        started and sampled with probability sample_rate.
+        """
+        if isinstance(parent, Span):
+            trace_id, parent_id, sampled = parent.trace_id, parent.span_id, parent.sampled
+        else:
+            context = parse_traceparent(parent) if parent else None
+            if context:
+                trace_id, parent_id, sampled = context
+            else:
+                trace_id, parent_id, sampled = new_trace_id(), None, random.random() < self.sample_rate
+        return Span(self, name, trace_id, parent_id, sampled, kind, start_time, attributes)
+
+    def export(self, span):
+        self.exporter.export(span)
+
+    def flush(self):
+        self.exporter.flush()
@@ -1,11 +1,42 @@
 import os
+import gzip
 import json
+import math
+import time
+import uuid
+import zlib
+import fcntl
+import base64
+import struct
+import sqlite3
+import hashlib
 import logging
-import boto3
-from flask import Flask, request, jsonify
-from botocore.exceptions import ClientError
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from flask import Flask, Response, g, request, jsonify
+from botocore.exceptions import BotoCoreError, ClientError, ConnectionError as AWSConnectionError, HTTPClientError
+import aws_clients
+import structured_logging
+import tracing
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter as MetricCounter, Gauge, Histogram,
+    generate_latest, multiprocess
+)
 
-logging.basicConfig(level=logging.INFO)
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# JSON lines written by a background thread; see common/structured_logging.py
+structured_logging.configure('service1')
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
@@ -14,71 +45,1661 @@ AWS_REGION = os.environ.get('AWS_REGION', 'us-east-1')
 SQS_QUEUE_URL = os.environ.get('SQS_QUEUE_URL')
 SSM_PARAMETER_NAME = os.environ.get('SSM_PARAMETER_NAME')
 
+# API token cache: background refresh interval and rotation grace window (seconds)
+TOKEN_CACHE_TTL_SECONDS = float(os.environ.get('TOKEN_CACHE_TTL_SECONDS', '60'))
+TOKEN_ROTATION_GRACE_SECONDS = float(os.environ.get('TOKEN_ROTATION_GRACE_SECONDS', '300'))
+TOKEN_REFRESH_RETRY_SECONDS = float(os.environ.get('TOKEN_REFRESH_RETRY_SECONDS', '5'))
+# Earliest re-read after a request presents an unknown token, in case it was just rotated
+TOKEN_MISS_REFRESH_SECONDS = float(os.environ.get('TOKEN_MISS_REFRESH_SECONDS', '5'))
+
+# Fast rejection of repeated bad tokens and per-client rate limits
+REJECTED_TOKEN_CACHE_SIZE = int(os.environ.get('REJECTED_TOKEN_CACHE_SIZE', '10000'))
+REJECTED_TOKEN_TTL_SECONDS = float(os.environ.get('REJECTED_TOKEN_TTL_SECONDS', '60'))
+AUTH_FAILURE_LIMIT = int(os.environ.get('AUTH_FAILURE_LIMIT', '10'))
+AUTH_FAILURE_WINDOW_SECONDS = float(os.environ.get('AUTH_FAILURE_WINDOW_SECONDS', '60'))
+CLIENT_RATE_LIMIT = float(os.environ.get('CLIENT_RATE_LIMIT', '0'))
+CLIENT_RATE_BURST = int(os.environ.get('CLIENT_RATE_BURST', '100'))
+RATE_LIMIT_MAX_CLIENTS = int(os.environ.get('RATE_LIMIT_MAX_CLIENTS', '10000'))
+
 REQUIRED_FIELDS = ['email_subject', 'email_sender', 'email_timestream', 'email_content']
 
-ssm_client = boto3.client('ssm', region_name=AWS_REGION)
-sqs_client = boto3.client('sqs', region_name=AWS_REGION)
+# Request bodies larger than this are refused with 413 before they are read (SQS caps messages at 256 KiB)
+MAX_REQUEST_BYTES = int(os.environ.get('MAX_REQUEST_BYTES', str(256 * 1024)))
+
+# JSON library for request parsing and SQS message bodies: auto, msgspec, orjson or json
+JSON_BACKEND = os.environ.get('JSON_BACKEND', 'auto').lower()
+
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_BYTES
+
+# Claim-check handling of large messages: 'off', 'compress' (gzip inline,
+# falling back to S3 when still too large) or 's3' (always store in S3)
+CLAIM_CHECK_MODE = os.environ.get('CLAIM_CHECK_MODE', 'off').lower()
+CLAIM_CHECK_THRESHOLD_BYTES = int(os.environ.get('CLAIM_CHECK_THRESHOLD_BYTES', str(64 * 1024)))
+CLAIM_CHECK_BUCKET = os.environ.get('CLAIM_CHECK_BUCKET')
+CLAIM_CHECK_PREFIX = os.environ.get('CLAIM_CHECK_PREFIX', 'claim-checks/')
+
+# SQS rejects messages over 256 KiB including attributes; leave room for them
+SQS_MAX_BODY_BYTES = 250 * 1024
+
+# SQS accepts at most 10 entries per SendMessageBatch call, totalling at most 256 KiB
+SQS_BATCH_SIZE = 10
+SQS_MAX_BATCH_BYTES = 256 * 1024
+MAX_BATCH_MESSAGES = int(os.environ.get('MAX_BATCH_MESSAGES', '100'))
+
+# Server-side micro-batching of /api/message requests
+SQS_MICRO_BATCHING = os.environ.get('SQS_MICRO_BATCHING', 'false').lower() == 'true'
+SQS_BATCH_MAX_DELAY_MS = int(os.environ.get('SQS_BATCH_MAX_DELAY_MS', '20'))
+SQS_BATCH_SENDERS = int(os.environ.get('SQS_BATCH_SENDERS', '4'))
+
+# Asynchronous acknowledgement: 'off', 'prefer' (requests sending
+# 'Prefer: respond-async') or 'always'. Accepted messages get 202 and are
+# sent by background batch senders
+ASYNC_ACK_MODE = os.environ.get('ASYNC_ACK_MODE', 'off').lower()
+ASYNC_ACK_QUEUE_SIZE = int(os.environ.get('ASYNC_ACK_QUEUE_SIZE', '10000'))
+ASYNC_ACK_MAX_DELAY_MS = int(os.environ.get('ASYNC_ACK_MAX_DELAY_MS', '50'))
+ASYNC_ACK_SENDERS = int(os.environ.get('ASYNC_ACK_SENDERS', '4'))
+# SQLite file shared by the gunicorn workers, so any worker can answer a status lookup
+ASYNC_ACK_STATUS_DB = os.environ.get('ASYNC_ACK_STATUS_DB', '/tmp/service1-ack-status.db')
+ASYNC_ACK_STATUS_TTL_SECONDS = float(os.environ.get('ASYNC_ACK_STATUS_TTL_SECONDS', '3600'))
+ASYNC_ACK_DRAIN_SECONDS = float(os.environ.get('ASYNC_ACK_DRAIN_SECONDS', '10'))
+
+# Local write-ahead spill log for messages SQS refuses with throttling or
+# server errors; replayed in the background once SQS recovers
+SPILL_ENABLED = os.environ.get('SPILL_ENABLED', 'false').lower() == 'true'
+SPILL_DIR = os.environ.get('SPILL_DIR', '/var/spool/service1')
+SPILL_MAX_BYTES = int(os.environ.get('SPILL_MAX_BYTES', str(512 * 1024 * 1024)))
+SPILL_SEGMENT_BYTES = int(os.environ.get('SPILL_SEGMENT_BYTES', str(16 * 1024 * 1024)))
+SPILL_FSYNC = os.environ.get('SPILL_FSYNC', 'true').lower() == 'true'
+SPILL_REPLAY_INTERVAL_SECONDS = float(os.environ.get('SPILL_REPLAY_INTERVAL_SECONDS', '1'))
+SPILL_REPLAY_BACKOFF_MAX = float(os.environ.get('SPILL_REPLAY_BACKOFF_MAX', '30'))
+SPILL_REPLAY_SENDERS = int(os.environ.get('SPILL_REPLAY_SENDERS', '4'))
+# After SQS fails, requests spool without trying it for this long
+SPILL_BYPASS_SECONDS = float(os.environ.get('SPILL_BYPASS_SECONDS', '5'))
+
+# SQS error codes worth spilling for; anything else would fail again on replay
+SPILL_ERROR_CODES = {
+    'ThrottlingException', 'Throttling', 'RequestThrottled', 'ServiceUnavailable', 'InternalError',
+    'InternalFailure', 'KMS.ThrottlingException'
+}
+AWS_CONNECTION_ERRORS = (AWSConnectionError, HTTPClientError)
+# SendMessage errors caused by the message itself; a replayed message failing with one is dropped
+MESSAGE_REJECTED_CODES = {
+    'InvalidParameterValue', 'InvalidMessageContents', 'InvalidAttributeName', 'InvalidAttributeValue'
+}
+
+MESSAGE_ATTRIBUTES = {
+    'Source': {
+        'StringValue': 'microservice1',
+        'DataType': 'String'
+    }
+}
+
+# Spans for /api/message(s); every message carries its trace ID, but only
+# sampled traces (TRACE_SAMPLE_RATE) are exported
+tracer = tracing.Tracer('service1')
+
+# Latency buckets (seconds) sized for in-process work up to multi-second AWS calls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+STAGE_LATENCY = Histogram(
+    'service1_stage_latency_seconds',
+    'Latency of hot-path stages',
+    ['stage'],
+    buckets=LATENCY_BUCKETS
+)
+REQUESTS = MetricCounter(
+    'service1_requests_total',
+    'HTTP requests handled',
+    ['endpoint', 'status']
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    'service1_requests_in_flight',
+    'HTTP requests currently being handled',
+    multiprocess_mode='livesum'
+)
+AWS_ERRORS = MetricCounter(
+    'service1_aws_errors_total',
+    'AWS errors by operation and error code',
+    ['operation', 'code']
+)
+SQS_BATCH_SIZE_HISTOGRAM = Histogram(
+    'service1_sqs_batch_size',
+    'Messages per SendMessageBatch call',
+    buckets=tuple(range(1, SQS_BATCH_SIZE + 1))
+)
+
+REJECTED_TOKEN_CACHE_HITS = MetricCounter(
+    'service1_rejected_token_cache_hits_total',
+    'Requests refused from the rejected-token cache'
+)
+REJECTED_TOKEN_CACHE_EVICTIONS = MetricCounter(
+    'service1_rejected_token_cache_evictions_total',
+    'Entries dropped from the rejected-token cache',
+    ['reason']
+)
+REJECTED_TOKEN_CACHE_ENTRIES = Gauge(
+    'service1_rejected_token_cache_entries',
+    'Entries in the rejected-token cache',
+    multiprocess_mode='livesum'
+)
+REJECTED_TOKEN_CACHE_CAPACITY = Gauge(
+    'service1_rejected_token_cache_capacity',
+    'Maximum entries in the rejected-token cache (per worker)',
+    multiprocess_mode='livemax'
+)
+CLAIM_CHECKS = MetricCounter(
+    'service1_claim_checks_total',
+    'Large messages compressed inline or offloaded to S3',
+    ['action']
+)
+RATE_LIMITED = MetricCounter(
+    'service1_rate_limited_total',
+    'Requests refused with 429 by reason',
+    ['reason']
+)
+SPILL_MESSAGES = MetricCounter(
+    'service1_spill_messages_total',
+    'Messages spooled to, replayed from, dropped from or rejected by the spill log',
+    ['event']
+)
+SPILL_DEPTH = Gauge(
+    'service1_spill_depth_messages',
+    'Spilled messages waiting to be replayed to SQS',
+    multiprocess_mode='livesum'
+)
+SPILL_BYTES = Gauge(
+    'service1_spill_bytes',
+    'Disk used by the spill log',
+    multiprocess_mode='livesum'
+)
+ASYNC_ACK_MESSAGES = MetricCounter(
+    'service1_async_ack_messages_total',
+    'Asynchronously acknowledged messages by result',
+    ['result']
+)
+ASYNC_ACK_QUEUE_DEPTH = Gauge(
+    'service1_async_ack_queue_depth',
+    'Accepted messages not yet sent to SQS',
+    multiprocess_mode='livesum'
+)
+SPILL_REPLAY_LAG = Gauge(
+    'service1_spill_replay_lag_seconds',
+    'Age of the oldest spilled message not yet replayed',
+    multiprocess_mode='livemax'
+)
+
 
-_cached_token = None
+def aws_error_code(error):
+    if not isinstance(error, ClientError):
+        # Connection and timeout errors never reached the service
+        return type(error).__name__
+    return error.response.get('Error', {}).get('Code', 'Unknown')
+
+
+# Created on first use, i.e. in each gunicorn worker after the fork
+ssm_client = aws_clients.LazyClient('ssm', region_name=AWS_REGION)
+sqs_client = aws_clients.LazyClient('sqs', region_name=AWS_REGION)
+s3_client = aws_clients.LazyClient('s3', region_name=AWS_REGION)
 
 
 def get_token_from_ssm():
-    global _cached_token
-    
-    if _cached_token:
-        return _cached_token
-    
     try:
         response = ssm_client.get_parameter(
             Name=SSM_PARAMETER_NAME,
             WithDecryption=True
         )
-        _cached_token = response['Parameter']['Value']
-        logger.info(f"Successfully retrieved token from SSM: {SSM_PARAMETER_NAME}")
-        return _cached_token
-    except ClientError as e:
+        structured_logging.log_success(logger, "Retrieved token from SSM", parameter=SSM_PARAMETER_NAME)
+        return response['Parameter']['Value']
+    except (ClientError, BotoCoreError) as e:
+        AWS_ERRORS.labels('GetParameter', aws_error_code(e)).inc()
         logger.error(f"Failed to get token from SSM: {e}")
         raise
 
 
+class TokenCache:
+    """
+    Holds the API token from SSM. The token is loaded once (at worker start
+    or on the first request) and then refreshed in the background every
+    ttl_seconds, so requests never wait on SSM after the first load. After a
+    rotation the previous token stays valid for grace_seconds. A failed
+    refresh keeps the last known good token and retries with backoff.
+    request_refresh() wakes the refresh thread early, at most once per
+    miss_refresh_seconds, so a client already using a rotated token is not
+    rejected for a whole TTL.
+    """
+    
+    def __init__(self, ttl_seconds=TOKEN_CACHE_TTL_SECONDS, grace_seconds=TOKEN_ROTATION_GRACE_SECONDS,
+                 retry_seconds=TOKEN_REFRESH_RETRY_SECONDS, miss_refresh_seconds=TOKEN_MISS_REFRESH_SECONDS):
+        self.ttl = ttl_seconds
+        self.grace = grace_seconds
+        self.retry = retry_seconds
+        self.miss_refresh = miss_refresh_seconds
+        self._last_requested = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._current = None
+        self._previous = None
+        self._previous_expires_at = 0
+        self.version = 0
+        self._stop = threading.Event()
+        self._thread = None
+    
+    @property
+    def loaded(self):
+        return self._current is not None
+    
+    def _ensure_started(self):
+        # Started lazily so the thread is created in each gunicorn worker after fork
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='token-refresh', daemon=True)
+                self._thread.start()
+    
+    def start(self):
+        """Load the token now; background refreshes start with the first load."""
+        try:
+            self.get()
+        except (ClientError, BotoCoreError):
+            logger.warning("API token not loaded at startup; will retry on first request")
+    
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+    
+    def request_refresh(self):
+        """Refresh in the background now, unless an early refresh was requested recently."""
+        now = time.monotonic()
+        with self._lock:
+            if self._last_requested is not None and now - self._last_requested < self.miss_refresh:
+                return
+            self._last_requested = now
+        self._wake.set()
+    
+    def refresh(self):
+        """Fetch the token from SSM. Returns False if the last known token is kept."""
+        try:
+            token = get_token_from_ssm()
+        except (ClientError, BotoCoreError):
+            if self._current is None:
+                raise
+            logger.warning("Token refresh failed; serving last known token")
+            return False
+        
+        with self._lock:
+            if self._current is not None and token != self._current:
+                self._previous = self._current
+                self._previous_expires_at = time.monotonic() + self.grace
+                self.version += 1
+                rotated = True
+                logger.info(f"API token rotated; previous token accepted for {self.grace}s")
+            else:
+                rotated = False
+            self._current = token
+        if rotated:
+            # Failures counted against the old token say nothing about the new one
+            reset_auth_failures()
+        return True
+    
+    def get(self):
+        if self._current is None:
+            with self._load_lock:
+                if self._current is None:
+                    try:
+                        self.refresh()
+                    finally:
+                        self._ensure_started()
+        return self._current
+    
+    def is_valid(self, provided_token):
+        if provided_token == self.get():
+            return True
+        with self._lock:
+            previous, expires_at = self._previous, self._previous_expires_at
+        return previous is not None and time.monotonic() < expires_at and provided_token == previous
+    
+    def _next_delay(self, failures):
+        if not failures:
+            return self.ttl
+        return min(self.retry * 2 ** (failures - 1), self.ttl)
+    
+    def _run(self):
+        failures = 0 if self.loaded else 1
+        while True:
+            self._wake.wait(self._next_delay(failures))
+            if self._stop.is_set():
+                return
+            self._wake.clear()
+            try:
+                refreshed = self.refresh()
+            except (ClientError, BotoCoreError):
+                refreshed = False
+            except Exception as e:
+                # Never let the refresh thread die, or rotations stop being picked up
+                logger.error(f"Unexpected error refreshing API token: {e}")
+                refreshed = False
+            failures = 0 if refreshed else failures + 1
+
+
+token_cache = TokenCache()
+
+
+@STAGE_LATENCY.labels('validate_token').time()
 def validate_token(provided_token):
-    stored_token = get_token_from_ssm()
-    return provided_token == stored_token
+    return token_cache.is_valid(provided_token)
 
 
-def validate_payload(data):
-    if not data:
-        return False, "Missing 'data' field in payload"
+class RejectedTokenCache:
+    """
+    Bounded LRU of fingerprints of recently rejected tokens, each kept for
+    ttl_seconds. Entries are tied to the token version they were rejected
+    under, so a rotation never keeps a newly valid token blocked.
+    """
+    
+    def __init__(self, max_entries=REJECTED_TOKEN_CACHE_SIZE, ttl_seconds=REJECTED_TOKEN_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        REJECTED_TOKEN_CACHE_CAPACITY.set(max_entries)
+    
+    @staticmethod
+    def fingerprint(token):
+        return hashlib.sha256(token.encode('utf-8')).digest()[:16]
+    
+    def contains(self, token, version):
+        if not isinstance(token, str):
+            return False
+        key = self.fingerprint(token)
+        
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False
+            if entry[0] != version or entry[1] <= time.monotonic():
+                del self._entries[key]
+                REJECTED_TOKEN_CACHE_EVICTIONS.labels('expired').inc()
+                REJECTED_TOKEN_CACHE_ENTRIES.dec()
+                return False
+            self._entries.move_to_end(key)
+        
+        REJECTED_TOKEN_CACHE_HITS.inc()
+        return True
     
-    missing_fields = [field for field in REQUIRED_FIELDS if field not in data]
+    def add(self, token, version):
+        if not isinstance(token, str):
+            return
+        key = self.fingerprint(token)
+        
+        with self._lock:
+            if key not in self._entries:
+                REJECTED_TOKEN_CACHE_ENTRIES.inc()
+            self._entries[key] = (version, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                REJECTED_TOKEN_CACHE_EVICTIONS.labels('capacity').inc()
+                REJECTED_TOKEN_CACHE_ENTRIES.dec()
     
-    if missing_fields:
-        return False, f"Missing required fields: {', '.join(missing_fields)}"
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class RateLimiter:
+    """
+    Per-client token buckets holding up to burst tokens, refilled at rate
+    tokens per second. Only the max_clients most recently seen clients are
+    tracked; a client that falls out starts again with a full bucket.
+    """
     
-    for field in REQUIRED_FIELDS:
-        if not isinstance(data[field], str) or not data[field].strip():
-            return False, f"Field '{field}' must be a non-empty string"
+    def __init__(self, rate, burst, max_clients=RATE_LIMIT_MAX_CLIENTS):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def _refill(self, key, now):
+        tokens, updated = self._buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        if len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        return tokens
+    
+    def acquire(self, key):
+        """Spend one token. Returns 0 if allowed, else seconds until one is available."""
+        now = time.monotonic()
+        with self._lock:
+            tokens = self._refill(key, now)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                return 0
+            return (1 - tokens) / self.rate
+    
+    def wait_time(self, key):
+        """Like acquire, but without spending a token."""
+        now = time.monotonic()
+        with self._lock:
+            tokens = self._refill(key, now)
+            return 0 if tokens >= 1 else (1 - tokens) / self.rate
+    
+    def reset(self):
+        """Give every client a full bucket again."""
+        with self._lock:
+            self._buckets.clear()
+
+
+rejected_tokens = RejectedTokenCache()
+auth_failure_limiter = (
+    RateLimiter(AUTH_FAILURE_LIMIT / AUTH_FAILURE_WINDOW_SECONDS, AUTH_FAILURE_LIMIT)
+    if AUTH_FAILURE_LIMIT > 0 else None
+)
+request_limiter = RateLimiter(CLIENT_RATE_LIMIT, CLIENT_RATE_BURST) if CLIENT_RATE_LIMIT > 0 else None
+
+
+def reset_auth_failures():
+    if auth_failure_limiter:
+        auth_failure_limiter.reset()
+
+RATE_LIMITED_ENDPOINTS = ('process_message', 'process_messages', 'message_status')
+
+
+def client_key(headers, remote_addr):
+    # The load balancer appends the caller's address as the last X-Forwarded-For entry
+    forwarded = headers.get('X-Forwarded-For')
+    if forwarded:
+        return forwarded.rsplit(',', 1)[-1].strip()
+    return remote_addr or 'unknown'
+
+
+def check_rate_limits(client):
+    """Returns 0 if the client may proceed, else seconds it should wait."""
+    if request_limiter:
+        wait = request_limiter.acquire(client)
+        if wait:
+            RATE_LIMITED.labels('requests').inc()
+            return wait
+    
+    if auth_failure_limiter:
+        wait = auth_failure_limiter.wait_time(client)
+        if wait:
+            RATE_LIMITED.labels('auth_failures').inc()
+            return wait
+    return 0
+
+
+def authenticate(token, client):
+    """Check a token, refusing recently rejected ones without validating them again."""
+    version = token_cache.version
+    if rejected_tokens.contains(token, version):
+        valid = False
+    elif validate_token(token):
+        return True
+    else:
+        rejected_tokens.add(token, version)
+        # The client may already have the rotated token; check SSM early
+        token_cache.request_refresh()
+        valid = False
+    
+    if auth_failure_limiter:
+        auth_failure_limiter.acquire(client)
+    return valid
+
+
+def bearer_token(headers):
+    """The token from an 'Authorization: Bearer <token>' header, or None."""
+    scheme, _, token = headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer':
+        return None
+    return token.strip() or None
+
+
+def retry_after(wait):
+    return str(max(1, math.ceil(wait)))
+
+
+def compile_validator(required_fields):
+    """
+    Build a payload validator for a fixed list of required fields. The
+    returned function checks presence and type in a single pass and reports
+    errors in the same order as a missing-fields check followed by a type check.
+    """
+    fields = tuple(required_fields)
+    missing_marker = object()
+    
+    def validate(data):
+        if not data:
+            return False, "Missing 'data' field in payload"
+        
+        if not isinstance(data, dict):
+            return False, "Field 'data' must be an object"
+        
+        missing_fields = []
+        type_error = None
+        for field in fields:
+            value = data.get(field, missing_marker)
+            if value is missing_marker:
+                missing_fields.append(field)
+            elif type_error is None and (not isinstance(value, str) or not value.strip()):
+                type_error = f"Field '{field}' must be a non-empty string"
+        
+        if missing_fields:
+            return False, f"Missing required fields: {', '.join(missing_fields)}"
+        if type_error:
+            return False, type_error
+        return True, None
     
-    return True, None
+    return validate
 
 
-def send_to_sqs(data):
+validate_payload = compile_validator(REQUIRED_FIELDS)
+
+
+def select_json_backend(name):
+    available = {'msgspec': msgspec is not None, 'orjson': orjson is not None, 'json': True}
+    if name == 'auto':
+        return next(backend for backend, installed in available.items() if installed)
+    if not available.get(name):
+        logger.warning(f"JSON backend '{name}' is not available; using json")
+        return 'json'
+    return name
+
+
+json_backend = select_json_backend(JSON_BACKEND)
+
+if msgspec is not None:
+    # Decodes only the top level; each value stays as raw JSON bytes until needed
+    _envelope_decoder = msgspec.json.Decoder(dict[str, msgspec.Raw])
+    _msgspec_decoder = msgspec.json.Decoder()
+    _msgspec_encoder = msgspec.json.Encoder()
+
+
+def dumps(obj):
+    if json_backend == 'msgspec':
+        return _msgspec_encoder.encode(obj).decode('utf-8')
+    if json_backend == 'orjson':
+        return orjson.dumps(obj).decode('utf-8')
+    return json.dumps(obj)
+
+
+def parse_request_body(body):
+    """
+    Parse a request body into (payload, raw_data). payload is None unless the
+    body is a JSON object. raw_data is the original JSON text of the 'data'
+    field when the backend can provide it, so a valid message can be
+    forwarded to SQS without encoding it again; otherwise it is None.
+    """
+    try:
+        if json_backend == 'msgspec':
+            envelope = _envelope_decoder.decode(body)
+            payload = {key: _msgspec_decoder.decode(value) for key, value in envelope.items()}
+            raw_data = envelope.get('data')
+            return payload, bytes(raw_data).decode('utf-8') if raw_data is not None else None
+        if json_backend == 'orjson':
+            payload = orjson.loads(body)
+        else:
+            payload = json.loads(body)
+    except ValueError:
+        return None, None
+    
+    return (payload if isinstance(payload, dict) else None), None
+
+
+def string_attribute(value):
+    return {'StringValue': value, 'DataType': 'String'}
+
+
+def claim_check_needed(body):
+    # A character is at most 4 UTF-8 bytes, so short bodies skip the encode
+    if CLAIM_CHECK_MODE == 'off' or len(body) <= CLAIM_CHECK_THRESHOLD_BYTES // 4:
+        return False
+    return len(body.encode('utf-8')) > CLAIM_CHECK_THRESHOLD_BYTES
+
+
+@STAGE_LATENCY.labels('claim_check_upload').time()
+def store_claim_check(compressed):
+    key = f"{CLAIM_CHECK_PREFIX}{datetime.utcnow().strftime('%Y/%m/%d')}/{uuid.uuid4().hex}.json.gz"
+    try:
+        s3_client.put_object(
+            Bucket=CLAIM_CHECK_BUCKET,
+            Key=key,
+            Body=compressed,
+            ContentType='application/json',
+            ContentEncoding='gzip'
+        )
+        structured_logging.log_success(logger, "Stored large message in S3", uri=f"s3://{CLAIM_CHECK_BUCKET}/{key}")
+        return key
+    except ClientError as e:
+        AWS_ERRORS.labels('PutObject', aws_error_code(e)).inc()
+        logger.error(f"Failed to store large message in S3: {e}")
+        raise
+
+
+def message_attributes(span, ingested_at):
+    """
+    MESSAGE_ATTRIBUTES plus the trace context service2 continues from:
+    IngestTimestamp (epoch milliseconds the request arrived) and
+    TraceParent (W3C traceparent of the span that sent the message).
+    """
+    return {
+        **MESSAGE_ATTRIBUTES,
+        'IngestTimestamp': {'StringValue': str(int(ingested_at * 1000)), 'DataType': 'Number'},
+        'TraceParent': string_attribute(span.traceparent)
+    }
+
+
+def prepare_message_body(body, attributes=None):
+    """
+    Apply claim-check handling to an encoded message body and return
+    (body, message_attributes), starting from attributes (MESSAGE_ATTRIBUTES
+    by default). Bodies up to CLAIM_CHECK_THRESHOLD_BYTES are
+    returned unchanged. Larger ones are gzipped and either sent inline as
+    base64 (ContentEncoding=gzip+base64) or stored in S3, with the bucket and
+    key sent as ClaimCheckBucket/ClaimCheckKey attributes.
+    """
+    attributes = attributes or MESSAGE_ATTRIBUTES
+    if not claim_check_needed(body):
+        return body, attributes
+    
+    compressed = gzip.compress(body.encode('utf-8'))
+    
+    if CLAIM_CHECK_MODE == 'compress' or not CLAIM_CHECK_BUCKET:
+        encoded = base64.b64encode(compressed).decode('ascii')
+        if len(encoded) <= SQS_MAX_BODY_BYTES or not CLAIM_CHECK_BUCKET:
+            CLAIM_CHECKS.labels('compressed').inc()
+            return encoded, {**attributes, 'ContentEncoding': string_attribute('gzip+base64')}
+    
+    key = store_claim_check(compressed)
+    CLAIM_CHECKS.labels('offloaded').inc()
+    return f"s3://{CLAIM_CHECK_BUCKET}/{key}", {
+        **attributes,
+        'ContentEncoding': string_attribute('gzip'),
+        'ClaimCheckBucket': string_attribute(CLAIM_CHECK_BUCKET),
+        'ClaimCheckKey': string_attribute(key)
+    }
+
+
+@STAGE_LATENCY.labels('send_to_sqs').time()
+def send_to_sqs(data, body=None, attributes=None):
+    """
+    Send one message and return its MessageId, or a Spooled ID when the
+    message went to the spill log instead.
+    """
+    body, attributes = prepare_message_body(body if body is not None else dumps(data), attributes)
+    if spill_log and spill_log.bypassing:
+        # SQS failed moments ago; spool without waiting on its retries
+        return spill_log.append(body, attributes)
     try:
         response = sqs_client.send_message(
             QueueUrl=SQS_QUEUE_URL,
-            MessageBody=json.dumps(data),
-            MessageAttributes={
-                'Source': {
-                    'StringValue': 'microservice1',
-                    'DataType': 'String'
-                }
-            }
+            MessageBody=body,
+            MessageAttributes=attributes
         )
-        logger.info(f"Message sent to SQS. MessageId: {response['MessageId']}")
+        structured_logging.log_success(logger, "Message sent to SQS", response['MessageId'])
         return response['MessageId']
-    except ClientError as e:
+    except (ClientError, *AWS_CONNECTION_ERRORS) as e:
+        AWS_ERRORS.labels('SendMessage', aws_error_code(e)).inc()
         logger.error(f"Failed to send message to SQS: {e}")
-        raise
+        if not spillable(e):
+            raise
+    spill_log.trip()
+    return spill_log.append(body, attributes)
+
+
+def message_size(body, attributes):
+    """Bytes SQS counts against its size limits: the body plus each attribute's name, type and value."""
+    size = len(body.encode('utf-8'))
+    for name, attribute in attributes.items():
+        size += len(name.encode('utf-8')) + len(attribute['DataType'].encode('utf-8'))
+        size += len(attribute.get('StringValue', '').encode('utf-8')) + len(attribute.get('BinaryValue', b''))
+    return size
+
+
+def batch_chunks(entries, max_entries=SQS_BATCH_SIZE, max_bytes=SQS_MAX_BATCH_BYTES):
+    """
+    Split SendMessageBatch entries into chunks of at most max_entries whose
+    messages total at most max_bytes. An entry too large to share a chunk
+    gets one to itself.
+    """
+    chunk, chunk_bytes = [], 0
+    for entry in entries:
+        size = message_size(entry['MessageBody'], entry['MessageAttributes'])
+        if chunk and (len(chunk) == max_entries or chunk_bytes + size > max_bytes):
+            yield chunk
+            chunk, chunk_bytes = [], 0
+        chunk.append(entry)
+        chunk_bytes += size
+    if chunk:
+        yield chunk
+
+
+def send_batch_to_sqs(items, attributes=None):
+    """
+    Send a list of data dicts to SQS using SendMessageBatch, in chunks of at
+    most SQS_BATCH_SIZE entries and SQS_MAX_BATCH_BYTES. attributes, if
+    given, holds the message attributes for each item. Returns a list of
+    (message_id, error) tuples in the same order as the input; exactly one
+    of the two is set for every item. Entries that fail with a spillable
+    error get a Spooled ID instead.
+    """
+    results = [(None, None)] * len(items)
+    
+    prepared = []
+    for index, data in enumerate(items):
+        try:
+            body, entry_attributes = prepare_message_body(
+                dumps(data),
+                attributes[index] if attributes else None
+            )
+        except ClientError:
+            results[index] = (None, 'Failed to store message')
+            continue
+        prepared.append({
+            'Id': str(index),
+            'MessageBody': body,
+            'MessageAttributes': entry_attributes
+        })
+    
+    for entries in batch_chunks(prepared):
+        if spill_log and spill_log.bypassing:
+            spill_entries(entries, results)
+            continue
+        
+        SQS_BATCH_SIZE_HISTOGRAM.observe(len(entries))
+        try:
+            with STAGE_LATENCY.labels('send_message_batch').time():
+                response = sqs_client.send_message_batch(
+                    QueueUrl=SQS_QUEUE_URL,
+                    Entries=entries
+                )
+        except (ClientError, *AWS_CONNECTION_ERRORS) as e:
+            AWS_ERRORS.labels('SendMessageBatch', aws_error_code(e)).inc()
+            logger.error(f"Failed to send message batch to SQS: {e}")
+            if spillable(e):
+                spill_log.trip()
+                spill_entries(entries, results)
+                continue
+            for entry in entries:
+                results[int(entry['Id'])] = (None, 'Failed to send message to queue')
+            continue
+        
+        for success in response.get('Successful', []):
+            results[int(success['Id'])] = (success['MessageId'], None)
+        
+        failed_entries = {entry['Id']: entry for entry in entries}
+        to_spill = []
+        for failure in response.get('Failed', []):
+            AWS_ERRORS.labels('SendMessageBatch', failure.get('Code', 'Unknown')).inc()
+            logger.error(
+                f"Failed to send batch entry to SQS: {failure.get('Code')} - {failure.get('Message')}"
+            )
+            if spill_log and not failure.get('SenderFault'):
+                to_spill.append(failed_entries[failure['Id']])
+            else:
+                results[int(failure['Id'])] = (None, 'Failed to send message to queue')
+        if to_spill:
+            spill_log.trip()
+            spill_entries(to_spill, results)
+        
+        structured_logging.log_success(
+            logger,
+            "Message batch sent to SQS",
+            successful=len(response.get('Successful', [])),
+            failed=len(response.get('Failed', []))
+        )
+    
+    return results
+
+
+class SQSBatchAggregator:
+    """
+    Buffers messages from concurrent requests and sends them with
+    SendMessageBatch once max_batch_size messages or max_batch_bytes are
+    queued, or the oldest one has waited max_delay_ms. A message that would
+    take a batch past max_batch_bytes starts the next one. Each caller gets
+    its own MessageId or error.
+    """
+    
+    def __init__(self, max_batch_size=SQS_BATCH_SIZE, max_delay_ms=SQS_BATCH_MAX_DELAY_MS,
+                 senders=SQS_BATCH_SENDERS, max_batch_bytes=SQS_MAX_BATCH_BYTES):
+        self.max_batch_size = max_batch_size
+        self.max_batch_bytes = max_batch_bytes
+        self.max_delay = max_delay_ms / 1000.0
+        self.senders = senders
+        self._pending = []
+        self._pending_bytes = 0
+        self._condition = threading.Condition()
+        self._thread = None
+        self._executor = None
+        self._stats_lock = threading.Lock()
+        self.batch_sizes = Counter()
+    
+    def _ensure_started(self):
+        # Started lazily so the thread is created in each gunicorn worker after fork
+        if self._thread is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.senders,
+                thread_name_prefix='sqs-batch-sender'
+            )
+            self._thread = threading.Thread(target=self._run, name='sqs-batch-aggregator', daemon=True)
+            self._thread.start()
+    
+    def submit(self, data, attributes=None, body=None):
+        """Queue data for the next batch; body, if given, is its encoded JSON and only used for sizing."""
+        size = message_size(body if body is not None else dumps(data), attributes or MESSAGE_ATTRIBUTES)
+        future = Future()
+        with self._condition:
+            self._ensure_started()
+            self._pending.append((data, future, time.monotonic(), attributes, size))
+            self._pending_bytes += size
+            if len(self._pending) == 1 or self._batch_full():
+                self._condition.notify()
+        return future
+    
+    def send(self, data, attributes=None, body=None):
+        return self.submit(data, attributes, body).result()
+    
+    def _batch_full(self):
+        return len(self._pending) >= self.max_batch_size or self._pending_bytes >= self.max_batch_bytes
+    
+    def _take_batch(self):
+        count, size = 0, 0
+        for entry in self._pending[:self.max_batch_size]:
+            if count and size + entry[4] > self.max_batch_bytes:
+                break
+            count += 1
+            size += entry[4]
+        batch = self._pending[:count]
+        del self._pending[:count]
+        self._pending_bytes -= size
+        return batch
+    
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                
+                deadline = self._pending[0][2] + self.max_delay
+                while not self._batch_full():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                
+                batch = self._take_batch()
+            
+            self._executor.submit(self._flush, batch)
+    
+    def _flush(self, batch):
+        with self._stats_lock:
+            self.batch_sizes[len(batch)] += 1
+        
+        try:
+            results = send_batch_to_sqs(
+                [data for data, _, _, _, _ in batch],
+                [attributes for _, _, _, attributes, _ in batch]
+            )
+        except Exception as e:
+            logger.error(f"Failed to flush message batch: {e}")
+            for _, future, _, _, _ in batch:
+                future.set_exception(e)
+            return
+        
+        for (_, future, _, _, _), (message_id, error_message) in zip(batch, results):
+            if message_id:
+                future.set_result(message_id)
+            else:
+                future.set_exception(ClientError(
+                    {'Error': {'Code': 'BatchEntryFailed', 'Message': error_message}},
+                    'SendMessageBatch'
+                ))
+    
+    def stats(self):
+        with self._stats_lock:
+            batches = sum(self.batch_sizes.values())
+            messages = sum(size * count for size, count in self.batch_sizes.items())
+            return {
+                'batches': batches,
+                'messages': messages,
+                'average_batch_size': round(messages / batches, 2) if batches else 0,
+                'batch_size_distribution': {
+                    str(size): count for size, count in sorted(self.batch_sizes.items())
+                }
+            }
+
+
+batch_aggregator = SQSBatchAggregator()
+
+
+class Spooled(str):
+    """ID of a message accepted into the spill log rather than sent to SQS."""
+
+
+class SpillFull(Exception):
+    pass
+
+
+def spillable(error):
+    """True if the spill log is on and error is a throttle, server error or connection failure."""
+    if spill_log is None:
+        return False
+    if isinstance(error, ClientError):
+        status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode') or 0
+        return aws_error_code(error) in SPILL_ERROR_CODES or status >= 500
+    return isinstance(error, AWS_CONNECTION_ERRORS)
+
+
+def spill_entries(entries, results):
+    """Spool SendMessageBatch entries, filling in their (message_id, error) results."""
+    try:
+        ids = spill_log.append_many([(entry['MessageBody'], entry['MessageAttributes']) for entry in entries])
+    except (SpillFull, OSError) as e:
+        logger.error(f"Failed to spool {len(entries)} messages: {e}")
+        ids = [None] * len(entries)
+    for entry, spool_id in zip(entries, ids):
+        results[int(entry['Id'])] = (spool_id, None) if spool_id else (None, 'Failed to send message to queue')
+
+
+def send_spilled_message(record):
+    """Replay one spilled record with SendMessage; returns 'sent', 'dropped' or 'retry'."""
+    try:
+        with STAGE_LATENCY.labels('spill_replay').time():
+            sqs_client.send_message(
+                QueueUrl=SQS_QUEUE_URL,
+                MessageBody=record['body'],
+                MessageAttributes=record['attributes']
+            )
+        return 'sent'
+    except (ClientError, *AWS_CONNECTION_ERRORS) as e:
+        AWS_ERRORS.labels('SendMessage', aws_error_code(e)).inc()
+        if aws_error_code(e) in MESSAGE_REJECTED_CODES:
+            logger.error(f"Dropping spilled message {record['id']}: {e}")
+            return 'dropped'
+        logger.warning(f"Failed to replay spilled message to SQS: {e}")
+        return 'retry'
+
+
+def send_spilled_batch(records):
+    """
+    Replay up to SQS_BATCH_SIZE spilled records with SendMessageBatch, or
+    with SendMessage for a single record too large for a batch. Returns
+    'sent', 'dropped' (SQS rejected the entry itself) or 'retry' for each
+    record.
+    """
+    if len(records) == 1 and message_size(records[0]['body'], records[0]['attributes']) > SQS_MAX_BATCH_BYTES:
+        return [send_spilled_message(records[0])]
+    
+    entries = [
+        {'Id': str(index), 'MessageBody': record['body'], 'MessageAttributes': record['attributes']}
+        for index, record in enumerate(records)
+    ]
+    outcomes = ['retry'] * len(records)
+    try:
+        with STAGE_LATENCY.labels('spill_replay').time():
+            response = sqs_client.send_message_batch(
+                QueueUrl=SQS_QUEUE_URL,
+                Entries=entries
+            )
+    except (ClientError, *AWS_CONNECTION_ERRORS) as e:
+        AWS_ERRORS.labels('SendMessageBatch', aws_error_code(e)).inc()
+        logger.warning(f"Failed to replay spilled messages to SQS: {e}")
+        return outcomes
+    
+    for success in response.get('Successful', []):
+        outcomes[int(success['Id'])] = 'sent'
+    for failure in response.get('Failed', []):
+        AWS_ERRORS.labels('SendMessageBatch', failure.get('Code', 'Unknown')).inc()
+        if failure.get('SenderFault'):
+            record = records[int(failure['Id'])]
+            logger.error(
+                f"Dropping spilled message {record['id']}: {failure.get('Code')} - {failure.get('Message')}"
+            )
+            outcomes[int(failure['Id'])] = 'dropped'
+    return outcomes
+
+
+class SpillLog:
+    """
+    Append-only spill log for messages SQS could not take. Records are
+    length- and CRC32-framed JSON, written to numbered segment files and
+    fsynced before the request is answered. A background thread replays
+    them with SendMessageBatch, replay_senders batches at a time, and
+    persists its position in a checkpoint file, so after a crash the
+    replacement worker carries on from there; messages sent just before a
+    crash may be sent again. Between checkpoints the reader keeps its own
+    byte offset, so every record is decoded once.
+    
+    Each gunicorn worker holds an flock on its own worker-N directory under
+    directory, so workers never share a file and a restarted worker takes
+    over the slot (and backlog) of the one that died. For bypass_seconds
+    after a send or replay fails, new messages are spooled without trying
+    SQS; after that they go to SQS first again, whatever the backlog.
+    """
+    
+    HEADER = struct.Struct('>II')
+    
+    def __init__(self, directory=SPILL_DIR, max_bytes=SPILL_MAX_BYTES, segment_bytes=SPILL_SEGMENT_BYTES,
+                 fsync=SPILL_FSYNC, replay_interval=SPILL_REPLAY_INTERVAL_SECONDS,
+                 backoff_max=SPILL_REPLAY_BACKOFF_MAX, replay_senders=SPILL_REPLAY_SENDERS,
+                 bypass_seconds=SPILL_BYPASS_SECONDS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.replay_interval = replay_interval
+        self.backoff_max = backoff_max
+        self.replay_senders = replay_senders
+        self.bypass_seconds = bypass_seconds
+        self.path = None
+        self.depth = 0
+        self.size = 0
+        self._lock = threading.Lock()
+        self._lock_fd = None
+        self._file = None
+        self._write_position = (0, 0)
+        self._checkpoint = (0, 0)
+        self._read_position = (0, 0)
+        self._bypass_until = 0
+        self._executor = ThreadPoolExecutor(max_workers=replay_senders, thread_name_prefix='spill-replay-sender')
+        self._thread = None
+        self._stop_event = threading.Event()
+    
+    @property
+    def bypassing(self):
+        """True while requests should spool without trying SQS."""
+        return time.monotonic() < self._bypass_until
+    
+    def trip(self):
+        """Note an SQS failure; requests skip SQS for the next bypass_seconds."""
+        self._bypass_until = time.monotonic() + self.bypass_seconds
+    
+    def _segment_path(self, segment):
+        return os.path.join(self.path, f'{segment:010d}.log')
+    
+    def _segments(self):
+        return sorted(int(name[:-4]) for name in os.listdir(self.path) if name.endswith('.log'))
+    
+    def _claim_slot(self):
+        slot = 0
+        while True:
+            path = os.path.join(self.directory, f'worker-{slot}')
+            os.makedirs(path, exist_ok=True)
+            fd = os.open(os.path.join(path, 'lock'), os.O_CREAT | os.O_RDWR, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                slot += 1
+                continue
+            return path, fd
+    
+    def _scan(self, segment, offset, max_records=None, end=None):
+        """
+        Return (records, end offset of the last valid record) from offset
+        on, stopping after max_records or at byte offset end.
+        """
+        records = []
+        try:
+            with open(self._segment_path(segment), 'rb') as f:
+                f.seek(offset)
+                while max_records is None or len(records) < max_records:
+                    header = f.read(self.HEADER.size)
+                    if len(header) < self.HEADER.size:
+                        break
+                    length, crc = self.HEADER.unpack(header)
+                    if end is not None and offset + self.HEADER.size + length > end:
+                        break
+                    payload = f.read(length)
+                    if len(payload) < length or zlib.crc32(payload) != crc:
+                        break
+                    offset += self.HEADER.size + length
+                    records.append((offset, payload))
+        except FileNotFoundError:
+            pass
+        return records, offset
+    
+    def open(self):
+        """Claim a worker slot and recover its segments. Called once, before first use."""
+        with self._lock:
+            if self.path is not None:
+                return
+            self.path, self._lock_fd = self._claim_slot()
+            try:
+                with open(os.path.join(self.path, 'checkpoint')) as f:
+                    checkpoint = json.load(f)
+                self._checkpoint = (checkpoint['segment'], checkpoint['offset'])
+            except (FileNotFoundError, ValueError, KeyError):
+                segments = self._segments()
+                self._checkpoint = (segments[0] if segments else 0, 0)
+            
+            segments = [segment for segment in self._segments() if segment >= self._checkpoint[0]]
+            for segment in self._segments():
+                if segment < self._checkpoint[0]:
+                    os.remove(self._segment_path(segment))
+            
+            write_segment = segments[-1] if segments else self._checkpoint[0]
+            for segment in segments:
+                offset = self._checkpoint[1] if segment == self._checkpoint[0] else 0
+                records, end = self._scan(segment, offset)
+                self.depth += len(records)
+                if segment == write_segment:
+                    # Drop a record torn by a crash mid-write
+                    os.truncate(self._segment_path(segment), end)
+                self.size += os.path.getsize(self._segment_path(segment))
+            
+            self._file = open(self._segment_path(write_segment), 'ab')
+            self._write_position = (write_segment, self._file.tell())
+            self._read_position = self._checkpoint
+            SPILL_DEPTH.set(self.depth)
+            SPILL_BYTES.set(self.size)
+            if self.depth:
+                logger.warning(f"Recovered {self.depth} spilled messages from {self.path}")
+    
+    def append(self, body, attributes):
+        return self.append_many([(body, attributes)])[0]
+    
+    def append_many(self, messages):
+        """Durably spool (body, attributes) pairs; returns a Spooled ID for each."""
+        if self.path is None:
+            self.open()
+        now = time.time()
+        ids = []
+        frames = []
+        for body, attributes in messages:
+            spool_id = Spooled(uuid.uuid4().hex)
+            payload = json.dumps({
+                'id': spool_id,
+                'body': body,
+                'attributes': attributes,
+                'spooled_at': now
+            }, separators=(',', ':')).encode('utf-8')
+            frames.append(self.HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+            ids.append(spool_id)
+        data = b''.join(frames)
+        
+        with self._lock:
+            if self.size + len(data) > self.max_bytes:
+                SPILL_MESSAGES.labels('rejected').inc(len(messages))
+                raise SpillFull(f"Spill log is full ({self.size} of {self.max_bytes} bytes)")
+            segment, offset = self._write_position
+            if offset >= self.segment_bytes:
+                self._file.close()
+                segment, offset = segment + 1, 0
+                self._file = open(self._segment_path(segment), 'ab')
+            self._file.write(data)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self._write_position = (segment, offset + len(data))
+            self.size += len(data)
+            self.depth += len(messages)
+        
+        SPILL_MESSAGES.labels('spooled').inc(len(messages))
+        SPILL_DEPTH.inc(len(messages))
+        SPILL_BYTES.inc(len(data))
+        logger.warning(f"Spooled {len(messages)} messages to {self.path}")
+        return ids
+    
+    def read(self, max_records=SQS_BATCH_SIZE):
+        """
+        Return up to max_records (position, record) pairs following the ones
+        the previous call returned; rewind() starts again from the checkpoint.
+        """
+        with self._lock:
+            write_segment, write_offset = self._write_position
+        segment, offset = self._read_position
+        records = []
+        while True:
+            scanned, end = self._scan(
+                segment, offset, max_records - len(records), write_offset if segment == write_segment else None
+            )
+            records.extend(((segment, record_end), json.loads(payload)) for record_end, payload in scanned)
+            if len(records) == max_records or segment >= write_segment:
+                self._read_position = (segment, end)
+                return records
+            if not records and (segment, offset) == self._checkpoint:
+                # Older segment fully replayed (or its tail unreadable); move past it
+                self.commit((segment + 1, 0), 0)
+            segment, offset = segment + 1, 0
+    
+    def rewind(self):
+        """Read again from the checkpoint, after records that were read could not be sent."""
+        self._read_position = self._checkpoint
+    
+    def commit(self, position, count):
+        """Mark everything before position as replayed and delete finished segments."""
+        checkpoint_path = os.path.join(self.path, 'checkpoint')
+        with open(checkpoint_path + '.tmp', 'w') as f:
+            json.dump({'segment': position[0], 'offset': position[1]}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(checkpoint_path + '.tmp', checkpoint_path)
+        
+        freed = 0
+        with self._lock:
+            self._checkpoint = position
+            self.depth -= count
+            for segment in self._segments():
+                if segment < position[0]:
+                    freed += os.path.getsize(self._segment_path(segment))
+                    os.remove(self._segment_path(segment))
+            self.size -= freed
+        SPILL_DEPTH.dec(count)
+        SPILL_BYTES.dec(freed)
+    
+    def replay_once(self):
+        """
+        Replay up to replay_senders batches, each of at most SQS_BATCH_SIZE
+        records and SQS_MAX_BATCH_BYTES, sent in parallel. The checkpoint
+        moves past the records before the first one that must be retried;
+        those after it are read again next time and may be sent twice.
+        Returns (records replayed or dropped, whether SQS failed).
+        """
+        records = self.read(self.replay_senders * SQS_BATCH_SIZE)
+        if not records:
+            SPILL_REPLAY_LAG.set(0)
+            return 0, False
+        SPILL_REPLAY_LAG.set(max(time.time() - records[0][1]['spooled_at'], 0))
+        
+        # An oversized batch fails as a whole and would never move the checkpoint
+        batches = [[]]
+        batch_bytes = 0
+        for position, record in records:
+            size = message_size(record['body'], record['attributes'])
+            if batches[-1] and (len(batches[-1]) == SQS_BATCH_SIZE or batch_bytes + size > SQS_MAX_BATCH_BYTES):
+                batches.append([])
+                batch_bytes = 0
+            batches[-1].append((position, record))
+            batch_bytes += size
+        
+        sends = [
+            self._executor.submit(send_spilled_batch, [record for _, record in batch])
+            for batch in batches
+        ]
+        position = None
+        done = 0
+        failed = False
+        for batch, send in zip(batches, sends):
+            for (record_position, _), outcome in zip(batch, send.result()):
+                if outcome == 'retry':
+                    failed = True
+                    break
+                SPILL_MESSAGES.labels('replayed' if outcome == 'sent' else 'dropped').inc()
+                position = record_position
+                done += 1
+            if failed:
+                break
+        if position is not None:
+            self.commit(position, done)
+        if failed:
+            self.rewind()
+            self.trip()
+        else:
+            # SQS took the whole replay; stop bypassing it
+            self._bypass_until = 0
+        return done, failed
+    
+    def _run(self):
+        failures = 0
+        while not self._stop_event.is_set():
+            try:
+                replayed, failed = self.replay_once()
+            except Exception as e:
+                logger.error(f"Spill replay failed: {e}")
+                self.rewind()
+                self.trip()
+                replayed, failed = 0, True
+            
+            if failed:
+                failures += 1
+                delay = min(self.replay_interval * 2 ** (failures - 1), self.backoff_max)
+            else:
+                failures = 0
+                delay = 0 if replayed else self.replay_interval
+            self._stop_event.wait(delay)
+    
+    def start(self):
+        """Recover the log and start replaying it; call in each worker after the fork."""
+        self.open()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='spill-replay', daemon=True)
+            self._thread.start()
+    
+    def stop(self):
+        """Stop replaying and release the worker slot for another process."""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        self._executor.shutdown(wait=False)
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+            if self._lock_fd is not None:
+                os.close(self._lock_fd)
+                self._lock_fd = None
+
+
+spill_log = SpillLog() if SPILL_ENABLED else None
+
+
+class AckQueueFull(Exception):
+    pass
+
+
+def new_ack_id(accepted_at):
+    """A random ack ID whose first 12 hex digits are the acceptance time in milliseconds."""
+    return f'{int(accepted_at * 1000):012x}{uuid.uuid4().hex[:20]}'
+
+
+def ack_accepted_at(ack_id):
+    """Acceptance time encoded in ack_id, or None if it is not an ack ID."""
+    if len(ack_id) != 32:
+        return None
+    try:
+        int(ack_id, 16)
+    except ValueError:
+        return None
+    return int(ack_id[:12], 16) / 1000
+
+
+class AckStatusStore:
+    """
+    Status of asynchronously acknowledged messages in a local SQLite file,
+    shared by the gunicorn workers. Each thread uses its own connection;
+    rows are pruned ttl_seconds after they were accepted. Rows are written
+    once per sent batch, not per request; an ID with no row yet reads as
+    pending until ttl_seconds after the time encoded in it.
+    """
+    
+    PRUNE_INTERVAL_SECONDS = 60
+    
+    def __init__(self, path=ASYNC_ACK_STATUS_DB, ttl_seconds=ASYNC_ACK_STATUS_TTL_SECONDS):
+        self.path = path
+        self.ttl = ttl_seconds
+        self._local = threading.local()
+        self._next_prune = 0
+    
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10)
+            # WAL lets lookups read while senders write; NORMAL skips the fsync per commit
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS ack_status ('
+                'id TEXT PRIMARY KEY, status TEXT NOT NULL, message_id TEXT, error TEXT, '
+                'accepted_at REAL NOT NULL, completed_at REAL)'
+            )
+            self._local.connection = connection
+        return connection
+    
+    def complete(self, results):
+        """Record (ack_id, status, message_id, error) tuples in one transaction."""
+        now = time.time()
+        connection = self._connection()
+        with connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO ack_status (id, status, message_id, error, accepted_at, completed_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                [
+                    (ack_id, status, message_id, error, ack_accepted_at(ack_id), now)
+                    for ack_id, status, message_id, error in results
+                ]
+            )
+            if now >= self._next_prune:
+                self._next_prune = now + self.PRUNE_INTERVAL_SECONDS
+                connection.execute('DELETE FROM ack_status WHERE accepted_at < ?', (now - self.ttl,))
+    
+    def get(self, ack_id):
+        row = self._connection().execute(
+            'SELECT status, message_id, error, accepted_at, completed_at FROM ack_status WHERE id = ?',
+            (ack_id,)
+        ).fetchone()
+        if row is None:
+            # Accepted but its batch not sent yet, or lost with a killed worker
+            accepted_at = ack_accepted_at(ack_id)
+            if accepted_at is None or not time.time() - self.ttl <= accepted_at <= time.time():
+                return None
+            row = ('pending', None, None, accepted_at, None)
+        if row[3] < time.time() - self.ttl:
+            return None
+        status, message_id, error, accepted_at, completed_at = row
+        result = {'id': ack_id, 'status': status, 'accepted_at': datetime.utcfromtimestamp(accepted_at).isoformat()}
+        if status == 'spooled':
+            result['spool_id'] = message_id
+        elif message_id:
+            result['message_id'] = message_id
+        if error:
+            result['error'] = error
+        if completed_at:
+            result['completed_at'] = datetime.utcfromtimestamp(completed_at).isoformat()
+        return result
+
+
+class AsyncAckQueue(SQSBatchAggregator):
+    """
+    Bounded in-process queue behind the 202 ingest mode. accept() returns
+    the message's ID without waiting for SQS or touching the status store;
+    sender threads deliver batches with SendMessageBatch and write each
+    batch's results to the store in one transaction. At most max_pending messages per
+    worker may be waiting; beyond that accept() raises AckQueueFull.
+    """
+    
+    def __init__(self, max_pending=ASYNC_ACK_QUEUE_SIZE, max_delay_ms=ASYNC_ACK_MAX_DELAY_MS,
+                 senders=ASYNC_ACK_SENDERS, store=None):
+        super().__init__(max_delay_ms=max_delay_ms, senders=senders)
+        self.max_pending = max_pending
+        self.store = store or AckStatusStore()
+        self.outstanding = 0
+        self._ack_ids = {}
+        self._outstanding_condition = threading.Condition()
+    
+    def accept(self, data, attributes=None):
+        with self._outstanding_condition:
+            if self.outstanding >= self.max_pending:
+                ASYNC_ACK_MESSAGES.labels('rejected').inc()
+                raise AckQueueFull(f"{self.outstanding} messages already waiting to be sent")
+            self.outstanding += 1
+        ASYNC_ACK_QUEUE_DEPTH.inc()
+        
+        ack_id = new_ack_id(time.time())
+        with self._outstanding_condition:
+            future = self.submit(data, attributes)
+            self._ack_ids[future] = ack_id
+        ASYNC_ACK_MESSAGES.labels('accepted').inc()
+        return ack_id
+    
+    def _release(self, count):
+        with self._outstanding_condition:
+            self.outstanding -= count
+            self._outstanding_condition.notify_all()
+        ASYNC_ACK_QUEUE_DEPTH.dec(count)
+    
+    def _flush(self, batch):
+        now = time.monotonic()
+        for _, _, enqueued_at, _, _ in batch:
+            STAGE_LATENCY.labels('async_ack_delay').observe(now - enqueued_at)
+        super()._flush(batch)
+        
+        results = []
+        with self._outstanding_condition:
+            ack_ids = [self._ack_ids.pop(future) for _, future, _, _, _ in batch]
+        for ack_id, (_, future, _, _, _) in zip(ack_ids, batch):
+            error = future.exception()
+            if error is None:
+                result = future.result()
+                results.append((ack_id, 'spooled' if isinstance(result, Spooled) else 'sent', result, None))
+            else:
+                message = error.response['Error']['Message'] if isinstance(error, ClientError) else str(error)
+                results.append((ack_id, 'failed', None, message))
+            ASYNC_ACK_MESSAGES.labels(results[-1][1]).inc()
+        
+        try:
+            self.store.complete(results)
+        except sqlite3.Error as e:
+            logger.error(f"Failed to record status of {len(results)} messages: {e}")
+        self._release(len(batch))
+    
+    def drain(self, timeout):
+        """Wait up to timeout seconds for accepted messages to be sent; returns True if all were."""
+        with self._outstanding_condition:
+            return self._outstanding_condition.wait_for(lambda: self.outstanding == 0, timeout)
+
+
+async_ack = AsyncAckQueue() if ASYNC_ACK_MODE != 'off' else None
+
+
+def async_ack_requested(headers):
+    if async_ack is None:
+        return False
+    return ASYNC_ACK_MODE == 'always' or 'respond-async' in headers.get('Prefer', '')
+
+
+def send_message(data, body=None, attributes=None):
+    if SQS_MICRO_BATCHING:
+        return batch_aggregator.send(data, attributes, body)
+    return send_to_sqs(data, body, attributes)
+
+
+def validate_batch(items):
+    """
+    Check the 'data' field of a /api/messages request. Returns (error,
+    results, valid_indexes): error is set if the whole batch is rejected;
+    otherwise results holds an error entry for each invalid item and None
+    for the items in valid_indexes, which are to be sent.
+    """
+    if not isinstance(items, list) or not items:
+        return "Field 'data' must be a non-empty list", None, None
+    if len(items) > MAX_BATCH_MESSAGES:
+        return f"Too many messages in batch (max {MAX_BATCH_MESSAGES})", None, None
+    
+    results = [None] * len(items)
+    valid_indexes = []
+    for index, data in enumerate(items):
+        is_valid, error_message = validate_payload(data)
+        if is_valid:
+            valid_indexes.append(index)
+        else:
+            results[index] = {'index': index, 'status': 'error', 'error': error_message}
+    return None, results, valid_indexes
+
+
+def batch_response(results, valid_indexes, sent):
+    """Fill in results from send_batch_to_sqs output for valid_indexes and build the /api/messages body."""
+    for index, (message_id, error_message) in zip(valid_indexes, sent):
+        if isinstance(message_id, Spooled):
+            results[index] = {'index': index, 'status': 'spooled', 'spool_id': message_id}
+        elif message_id:
+            results[index] = {'index': index, 'status': 'success', 'message_id': message_id}
+        else:
+            results[index] = {'index': index, 'status': 'error', 'error': error_message}
+    
+    # Spooled messages are accepted and will be delivered by the replay thread
+    succeeded = sum(1 for result in results if result['status'] in ('success', 'spooled'))
+    
+    if succeeded == len(results):
+        status = 'success'
+    elif succeeded == 0:
+        status = 'failed'
+    else:
+        status = 'partial'
+    
+    return {
+        'status': status,
+        'succeeded': succeeded,
+        'failed': len(results) - succeeded,
+        'spooled': sum(1 for result in results if result['status'] == 'spooled'),
+        'results': results
+    }
+
+
+def service_stats():
+    """Body of GET /stats, shared with the async serving mode."""
+    return {
+        'micro_batching': {
+            'enabled': SQS_MICRO_BATCHING,
+            'max_delay_ms': SQS_BATCH_MAX_DELAY_MS,
+            **batch_aggregator.stats()
+        },
+        'async_ack': {
+            'mode': ASYNC_ACK_MODE,
+            'outstanding': async_ack.outstanding if async_ack else 0,
+            'max_pending': ASYNC_ACK_QUEUE_SIZE
+        },
+        'spill': {
+            'enabled': spill_log is not None,
+            'bypassing': bool(spill_log and spill_log.bypassing),
+            'depth': spill_log.depth if spill_log else 0,
+            'bytes': spill_log.size if spill_log else 0
+        },
+        'logging': {
+            'success_sample_rate': structured_logging.LOG_SUCCESS_SAMPLE_RATE,
+            'dropped': structured_logging.dropped_records()
+        }
+    }
+
+
+@app.before_request
+def track_request_start():
+    REQUESTS_IN_FLIGHT.inc()
+    g.request_tracked = True
+
+
+@app.before_request
+def start_trace():
+    if request.endpoint not in RATE_LIMITED_ENDPOINTS:
+        return None
+    # Continues the caller's trace when it sends a traceparent header
+    g.trace_span = tracer.start_span(
+        f'{request.method} {request.path}',
+        parent=request.headers.get('traceparent'),
+        kind='server',
+        attributes={'http.request.method': request.method, 'url.path': request.path}
+    )
+    return None
+
+
+@app.before_request
+def enforce_rate_limits():
+    if request.endpoint not in RATE_LIMITED_ENDPOINTS:
+        return None
+    g.client = client_key(request.headers, request.remote_addr)
+    wait = check_rate_limits(g.client)
+    if wait:
+        return jsonify({
+            'error': 'Too many requests'
+        }), 429, {'Retry-After': retry_after(wait)}
+    return None
+
+
+@app.after_request
+def count_request(response):
+    REQUESTS.labels(request.endpoint or 'unknown', response.status_code).inc()
+    if 'trace_span' in g:
+        g.trace_span.set_attribute('http.response.status_code', response.status_code)
+    return response
+
+
+@app.teardown_request
+def track_request_end(exception=None):
+    if g.pop('request_tracked', False):
+        REQUESTS_IN_FLIGHT.dec()
+    span = g.pop('trace_span', None)
+    if span is not None:
+        span.end()
+
+
+@app.errorhandler(413)
+def request_too_large(error):
+    return jsonify({
+        'error': f'Request body too large (max {MAX_REQUEST_BYTES} bytes)'
+    }), 413
 
 
 @app.route('/health', methods=['GET'])
@@ -88,8 +1709,9 @@ def health_check():
 
 @app.route('/api/message', methods=['POST'])
 def process_message():
+    body = request.get_data(cache=False)
     try:
-        payload = request.get_json()
+        payload, raw_data = parse_request_body(body)
         
         if not payload:
             return jsonify({
@@ -104,7 +1726,7 @@ def process_message():
                 'error': 'Missing token in payload'
             }), 401
         
-        if not validate_token(token):
+        if not authenticate(token, g.client):
             logger.warning("Invalid token provided")
             return jsonify({
                 'error': 'Invalid token'
@@ -116,7 +1738,25 @@ def process_message():
                 'error': error_message
             }), 400
         
-        message_id = send_to_sqs(data)
+        if async_ack_requested(request.headers):
+            ack_id = async_ack.accept(data, message_attributes(g.trace_span, g.trace_span.start_time))
+            return jsonify({
+                'status': 'accepted',
+                'message': 'Message queued for delivery',
+                'id': ack_id,
+                'status_url': f'/api/message/{ack_id}'
+            }), 202, {'Location': f'/api/message/{ack_id}', 'Preference-Applied': 'respond-async'}
+        
+        with tracer.start_span('SQS SendMessage', parent=g.trace_span, kind='producer') as span:
+            message_id = send_message(data, raw_data, message_attributes(span, g.trace_span.start_time))
+            span.set_attribute('messaging.message.id', message_id)
+        
+        if isinstance(message_id, Spooled):
+            return jsonify({
+                'status': 'spooled',
+                'message': 'Queue unavailable; message stored for delivery',
+                'spool_id': message_id
+            }), 202
         
         return jsonify({
             'status': 'success',
@@ -124,6 +1764,96 @@ def process_message():
             'message_id': message_id
         }), 200
         
+    except SpillFull as e:
+        logger.error(f"Spill log full: {e}")
+        return jsonify({
+            'error': 'Service temporarily unavailable'
+        }), 503, {'Retry-After': retry_after(SPILL_REPLAY_BACKOFF_MAX)}
+    except AckQueueFull as e:
+        logger.warning(f"Async ingest queue full: {e}")
+        return jsonify({
+            'error': 'Too many messages waiting to be sent'
+        }), 503, {'Retry-After': retry_after(ASYNC_ACK_MAX_DELAY_MS / 1000)}
+    except ClientError as e:
+        logger.error(f"AWS error: {e}")
+        return jsonify({
+            'error': 'Internal server error'
+        }), 500
+    except Exception as e:
+        logger.error(f"Unexpected error: {e}")
+        return jsonify({
+            'error': 'Internal server error'
+        }), 500
+
+
+@app.route('/api/message/<ack_id>', methods=['GET'])
+def message_status(ack_id):
+    token = bearer_token(request.headers)
+    if not token:
+        return jsonify({
+            'error': 'Missing bearer token'
+        }), 401
+    
+    if not authenticate(token, g.client):
+        logger.warning("Invalid token provided")
+        return jsonify({
+            'error': 'Invalid token'
+        }), 401
+    
+    if async_ack is None:
+        return jsonify({
+            'error': 'Asynchronous ingest is disabled'
+        }), 404
+    
+    status = async_ack.store.get(ack_id)
+    if status is None:
+        return jsonify({
+            'error': 'Unknown or expired message ID'
+        }), 404
+    return jsonify(status), 200
+
+
+@app.route('/api/messages', methods=['POST'])
+def process_messages():
+    body = request.get_data(cache=False)
+    try:
+        payload, _ = parse_request_body(body)
+        
+        if not payload:
+            return jsonify({
+                'error': 'Invalid JSON payload'
+            }), 400
+        
+        token = payload.get('token')
+        items = payload.get('data')
+        
+        if not token:
+            return jsonify({
+                'error': 'Missing token in payload'
+            }), 401
+        
+        if not authenticate(token, g.client):
+            logger.warning("Invalid token provided")
+            return jsonify({
+                'error': 'Invalid token'
+            }), 401
+        
+        error_message, results, valid_indexes = validate_batch(items)
+        if error_message:
+            return jsonify({
+                'error': error_message
+            }), 400
+        
+        with tracer.start_span('SQS SendMessageBatch', parent=g.trace_span, kind='producer') as span:
+            span.set_attribute('messaging.batch.message_count', len(valid_indexes))
+            attributes = message_attributes(span, g.trace_span.start_time)
+            sent = send_batch_to_sqs(
+                [items[index] for index in valid_indexes],
+                [attributes] * len(valid_indexes)
+            )
+        
+        return jsonify(batch_response(results, valid_indexes, sent)), 200
+        
     except ClientError as e:
         logger.error(f"AWS error: {e}")
         return jsonify({
@@ -136,13 +1866,32 @@ def process_message():
         }), 500
 
 
+@app.route('/stats', methods=['GET'])
+def stats():
+    return jsonify(service_stats()), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    registry = REGISTRY
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        # gunicorn workers each write their own samples; aggregate them here
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
 @app.route('/', methods=['GET'])
 def root():
     return jsonify({
         'service': 'Microservice 1 - REST API',
         'endpoints': {
             '/health': 'Health check',
-            '/api/message': 'POST - Send message to queue'
+            '/api/message': 'POST - Send message to queue',
+            '/api/message/<id>': 'GET - Delivery status of an asynchronously accepted message',
+            '/api/messages': 'POST - Send a batch of messages to queue',
+            '/stats': 'GET - Micro-batching, async ingest, spill log and logging statistics',
+            '/metrics': 'GET - Prometheus metrics'
         }
     }), 200
 
@@ -157,4 +1906,7 @@ if __name__ == '__main__':
     logger.info(f"SQS Queue: {SQS_QUEUE_URL}")
     logger.info(f"SSM Parameter: {SSM_PARAMETER_NAME}")
     
+    if spill_log:
+        spill_log.start()
+    
     app.run(host='0.0.0.0', port=8080)
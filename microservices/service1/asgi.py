@@ -0,0 +1,362 @@
+"""
+Async (ASGI) serving mode for Microservice 1.
+
+Exposes the same endpoints, validation and responses as app.py, but runs on
+an event loop: SendMessage goes through aiobotocore so a worker can hold
+thousands of slow client connections without a thread per request.
+Batch sends (/api/messages), SQS_MICRO_BATCHING and ASYNC_ACK_MODE reuse
+app.py's SendMessageBatch code on its threads, awaited from the loop.
+
+Run with:
+    hypercorn --bind 0.0.0.0:8080 --workers 2 asgi:app
+"""
+import os
+import asyncio
+import logging
+from aiobotocore.config import AioConfig
+from aiobotocore.session import get_session
+from botocore.exceptions import ClientError
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, generate_latest, multiprocess
+from quart import Quart, Response, g, request, jsonify
+
+import app as service
+import aws_clients
+import structured_logging
+
+logger = logging.getLogger(__name__)
+
+app = Quart(__name__)
+app.config['MAX_CONTENT_LENGTH'] = service.MAX_REQUEST_BYTES
+
+# Connections shared by all in-flight SendMessage calls in one worker
+SQS_MAX_CONNECTIONS = int(os.environ.get('SQS_MAX_CONNECTIONS', '100'))
+
+sqs_client = None
+_sqs_client_context = None
+
+
+@app.before_serving
+async def start_clients():
+    global sqs_client, _sqs_client_context
+
+    if sqs_client is None:
+        _sqs_client_context = get_session().create_client(
+            'sqs',
+            region_name=service.AWS_REGION,
+            config=AioConfig(**aws_clients.config_options(max_pool_connections=SQS_MAX_CONNECTIONS))
+        )
+        sqs_client = await _sqs_client_context.__aenter__()
+
+    # Load the token before serving so requests only compare against the cache
+    await asyncio.to_thread(service.token_cache.start)
+    if service.spill_log:
+        await asyncio.to_thread(service.spill_log.start)
+
+
+@app.after_serving
+async def stop_clients():
+    global sqs_client, _sqs_client_context
+
+    # Send messages already acknowledged with 202 before the worker goes away
+    if service.async_ack and not await asyncio.to_thread(service.async_ack.drain, service.ASYNC_ACK_DRAIN_SECONDS):
+        logger.warning(f"Exiting with {service.async_ack.outstanding} accepted messages unsent")
+
+    if _sqs_client_context is not None:
+        await _sqs_client_context.__aexit__(None, None, None)
+        _sqs_client_context = None
+        sqs_client = None
+
+
+async def authenticate(token, client):
+    if not service.token_cache.loaded:
+        await asyncio.to_thread(service.token_cache.get)
+    return service.authenticate(token, client)
+
+
+async def send_to_sqs(data, body=None, attributes=None):
+    body = body if body is not None else service.dumps(data)
+    attributes = attributes or service.MESSAGE_ATTRIBUTES
+    if service.claim_check_needed(body):
+        # Compression and the S3 upload use blocking calls; keep them off the event loop
+        body, attributes = await asyncio.to_thread(service.prepare_message_body, body, attributes)
+
+    spill_log = service.spill_log
+    if spill_log and spill_log.bypassing:
+        return await asyncio.to_thread(spill_log.append, body, attributes)
+    try:
+        with service.STAGE_LATENCY.labels('send_to_sqs').time():
+            response = await sqs_client.send_message(
+                QueueUrl=service.SQS_QUEUE_URL,
+                MessageBody=body,
+                MessageAttributes=attributes
+            )
+        structured_logging.log_success(logger, "Message sent to SQS", response['MessageId'])
+        return response['MessageId']
+    except (ClientError, *service.AWS_CONNECTION_ERRORS) as e:
+        service.AWS_ERRORS.labels('SendMessage', service.aws_error_code(e)).inc()
+        logger.error(f"Failed to send message to SQS: {e}")
+        if not service.spillable(e):
+            raise
+    spill_log.trip()
+    # Appending fsyncs; keep it off the event loop
+    return await asyncio.to_thread(spill_log.append, body, attributes)
+
+
+async def send_message(data, body=None, attributes=None):
+    if service.SQS_MICRO_BATCHING:
+        return await asyncio.wrap_future(service.batch_aggregator.submit(data, attributes, body))
+    return await send_to_sqs(data, body, attributes)
+
+
+@app.before_request
+async def track_request_start():
+    service.REQUESTS_IN_FLIGHT.inc()
+    g.request_tracked = True
+
+
+@app.before_request
+async def start_trace():
+    if request.endpoint not in service.RATE_LIMITED_ENDPOINTS:
+        return None
+    g.trace_span = service.tracer.start_span(
+        f'{request.method} {request.path}',
+        parent=request.headers.get('traceparent'),
+        kind='server',
+        attributes={'http.request.method': request.method, 'url.path': request.path}
+    )
+    return None
+
+
+@app.before_request
+async def enforce_rate_limits():
+    if request.endpoint not in service.RATE_LIMITED_ENDPOINTS:
+        return None
+    g.client = service.client_key(request.headers, request.remote_addr)
+    wait = service.check_rate_limits(g.client)
+    if wait:
+        return jsonify({
+            'error': 'Too many requests'
+        }), 429, {'Retry-After': service.retry_after(wait)}
+    return None
+
+
+@app.after_request
+async def count_request(response):
+    service.REQUESTS.labels(request.endpoint or 'unknown', response.status_code).inc()
+    if 'trace_span' in g:
+        g.trace_span.set_attribute('http.response.status_code', response.status_code)
+    return response
+
+
+@app.teardown_request
+async def track_request_end(exception=None):
+    if g.pop('request_tracked', False):
+        service.REQUESTS_IN_FLIGHT.dec()
+    span = g.pop('trace_span', None)
+    if span is not None:
+        span.end()
+
+
+@app.errorhandler(413)
+async def request_too_large(error):
+    return jsonify({
+        'error': f'Request body too large (max {service.MAX_REQUEST_BYTES} bytes)'
+    }), 413
+
+
+@app.route('/health', methods=['GET'])
+async def health_check():
+    return jsonify({'status': 'healthy'}), 200
+
+
+@app.route('/api/message', methods=['POST'])
+async def process_message():
+    body = await request.get_data()
+    try:
+        payload, raw_data = service.parse_request_body(body)
+
+        if not payload:
+            return jsonify({
+                'error': 'Invalid JSON payload'
+            }), 400
+
+        token = payload.get('token')
+        data = payload.get('data')
+
+        if not token:
+            return jsonify({
+                'error': 'Missing token in payload'
+            }), 401
+
+        if not await authenticate(token, g.client):
+            logger.warning("Invalid token provided")
+            return jsonify({
+                'error': 'Invalid token'
+            }), 401
+
+        is_valid, error_message = service.validate_payload(data)
+        if not is_valid:
+            return jsonify({
+                'error': error_message
+            }), 400
+
+        if service.async_ack_requested(request.headers):
+            # The status store is SQLite; keep its write off the event loop
+            ack_id = await asyncio.to_thread(
+                service.async_ack.accept, data, service.message_attributes(g.trace_span, g.trace_span.start_time)
+            )
+            return jsonify({
+                'status': 'accepted',
+                'message': 'Message queued for delivery',
+                'id': ack_id,
+                'status_url': f'/api/message/{ack_id}'
+            }), 202, {'Location': f'/api/message/{ack_id}', 'Preference-Applied': 'respond-async'}
+
+        with service.tracer.start_span('SQS SendMessage', parent=g.trace_span, kind='producer') as span:
+            message_id = await send_message(data, raw_data, service.message_attributes(span, g.trace_span.start_time))
+            span.set_attribute('messaging.message.id', message_id)
+
+        if isinstance(message_id, service.Spooled):
+            return jsonify({
+                'status': 'spooled',
+                'message': 'Queue unavailable; message stored for delivery',
+                'spool_id': message_id
+            }), 202
+
+        return jsonify({
+            'status': 'success',
+            'message': 'Message sent to queue',
+            'message_id': message_id
+        }), 200
+
+    except service.SpillFull as e:
+        logger.error(f"Spill log full: {e}")
+        return jsonify({
+            'error': 'Service temporarily unavailable'
+        }), 503, {'Retry-After': service.retry_after(service.SPILL_REPLAY_BACKOFF_MAX)}
+    except service.AckQueueFull as e:
+        logger.warning(f"Async ingest queue full: {e}")
+        return jsonify({
+            'error': 'Too many messages waiting to be sent'
+        }), 503, {'Retry-After': service.retry_after(service.ASYNC_ACK_MAX_DELAY_MS / 1000)}
+    except ClientError as e:
+        logger.error(f"AWS error: {e}")
+        return jsonify({
+            'error': 'Internal server error'
+        }), 500
+    except Exception as e:
+        logger.error(f"Unexpected error: {e}")
+        return jsonify({
+            'error': 'Internal server error'
+        }), 500
+
+
+@app.route('/api/message/<ack_id>', methods=['GET'])
+async def message_status(ack_id):
+    token = service.bearer_token(request.headers)
+    if not token:
+        return jsonify({
+            'error': 'Missing bearer token'
+        }), 401
+
+    if not await authenticate(token, g.client):
+        logger.warning("Invalid token provided")
+        return jsonify({
+            'error': 'Invalid token'
+        }), 401
+
+    if service.async_ack is None:
+        return jsonify({
+            'error': 'Asynchronous ingest is disabled'
+        }), 404
+
+    status = await asyncio.to_thread(service.async_ack.store.get, ack_id)
+    if status is None:
+        return jsonify({
+            'error': 'Unknown or expired message ID'
+        }), 404
+    return jsonify(status), 200
+
+
+@app.route('/api/messages', methods=['POST'])
+async def process_messages():
+    body = await request.get_data()
+    try:
+        payload, _ = service.parse_request_body(body)
+
+        if not payload:
+            return jsonify({
+                'error': 'Invalid JSON payload'
+            }), 400
+
+        token = payload.get('token')
+        items = payload.get('data')
+
+        if not token:
+            return jsonify({
+                'error': 'Missing token in payload'
+            }), 401
+
+        if not await authenticate(token, g.client):
+            logger.warning("Invalid token provided")
+            return jsonify({
+                'error': 'Invalid token'
+            }), 401
+
+        error_message, results, valid_indexes = service.validate_batch(items)
+        if error_message:
+            return jsonify({
+                'error': error_message
+            }), 400
+
+        with service.tracer.start_span('SQS SendMessageBatch', parent=g.trace_span, kind='producer') as span:
+            span.set_attribute('messaging.batch.message_count', len(valid_indexes))
+            attributes = service.message_attributes(span, g.trace_span.start_time)
+            # Claim checks, spooling and SendMessageBatch are all blocking; run them on a thread
+            sent = await asyncio.to_thread(
+                service.send_batch_to_sqs,
+                [items[index] for index in valid_indexes],
+                [attributes] * len(valid_indexes)
+            )
+
+        return jsonify(service.batch_response(results, valid_indexes, sent)), 200
+
+    except ClientError as e:
+        logger.error(f"AWS error: {e}")
+        return jsonify({
+            'error': 'Internal server error'
+        }), 500
+    except Exception as e:
+        logger.error(f"Unexpected error: {e}")
+        return jsonify({
+            'error': 'Internal server error'
+        }), 500
+
+
+@app.route('/stats', methods=['GET'])
+async def stats():
+    return jsonify(service.service_stats()), 200
+
+
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+    registry = REGISTRY
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+@app.route('/', methods=['GET'])
+async def root():
+    return jsonify({
+        'service': 'Microservice 1 - REST API (async)',
+        'endpoints': {
+            '/health': 'Health check',
+            '/api/message': 'POST - Send message to queue',
+            '/api/message/<id>': 'GET - Delivery status of an asynchronously accepted message',
+            '/api/messages': 'POST - Send a batch of messages to queue',
+            '/stats': 'GET - Micro-batching, async ingest, spill log and logging statistics',
+            '/metrics': 'GET - Prometheus metrics'
+        }
+    }), 200
@@ -0,0 +1,24 @@
+import os
+
+
+def post_worker_init(worker):
+    # Load the API token before the worker accepts its first request
+    import app
+    app.token_cache.start()
+    if app.spill_log:
+        # Recover this worker's spill log and replay it in the background
+        app.spill_log.start()
+
+
+def worker_exit(server, worker):
+    # Send messages already acknowledged with 202 before the worker goes away
+    import app
+    if app.async_ack and not app.async_ack.drain(app.ASYNC_ACK_DRAIN_SECONDS):
+        worker.log.warning(f"Exiting with {app.async_ack.outstanding} accepted messages unsent")
+
+
+def child_exit(server, worker):
+    # Drop the exited worker's live gauges from the shared Prometheus directory
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -1,16 +1,32 @@
 import json
+import time
+import logging
+import asyncio
+import threading
 import pytest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 import sys
 import os
 
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'common'))
 
 os.environ['SQS_QUEUE_URL'] = 'https://sqs.us-east-1.amazonaws.com/123456789/test-queue'
 os.environ['SSM_PARAMETER_NAME'] = '/test/api-token'
 os.environ['AWS_REGION'] = 'us-east-1'
 
-from app import app, validate_payload, REQUIRED_FIELDS
+from app import (
+    app, validate_payload, send_batch_to_sqs, SQSBatchAggregator, TokenCache, RejectedTokenCache, RateLimiter,
+    REQUIRED_FIELDS
+)
+
+
+@pytest.fixture(autouse=True)
+def fresh_rate_limits():
+    with patch('app.rejected_tokens', RejectedTokenCache()), \
+            patch('app.auth_failure_limiter', RateLimiter(10 / 60, 10)), \
+            patch('app.request_limiter', None):
+        yield
 
 
 @pytest.fixture
@@ -205,6 +221,1404 @@ class TestMessageEndpoint:
         mock_send_sqs.assert_called_once()
 
 
+def make_email(subject='Test Subject'):
+    return {
+        'email_subject': subject,
+        'email_sender': 'John Doe',
+        'email_timestream': '1693561101',
+        'email_content': 'Test content'
+    }
+
+
+class TestSendBatchToSQS:
+    @patch('app.sqs_client')
+    def test_chunks_into_batches_of_ten(self, mock_sqs):
+        mock_sqs.send_message_batch.side_effect = lambda QueueUrl, Entries: {
+            'Successful': [{'Id': e['Id'], 'MessageId': f"id-{e['Id']}"} for e in Entries]
+        }
+        
+        results = send_batch_to_sqs([make_email(str(i)) for i in range(25)])
+        
+        assert mock_sqs.send_message_batch.call_count == 3
+        sizes = [len(c.kwargs['Entries']) for c in mock_sqs.send_message_batch.call_args_list]
+        assert sizes == [10, 10, 5]
+        assert results == [(f'id-{i}', None) for i in range(25)]
+    
+    @patch('app.sqs_client')
+    def test_chunks_stay_under_batch_byte_limit(self, mock_sqs):
+        from app import SQS_MAX_BATCH_BYTES, message_size
+        mock_sqs.send_message_batch.side_effect = lambda QueueUrl, Entries: {
+            'Successful': [{'Id': e['Id'], 'MessageId': f"id-{e['Id']}"} for e in Entries]
+        }
+        items = [make_email(str(i)) for i in range(5)]
+        for item in items:
+            item['email_content'] = 'x' * 100 * 1024
+        
+        results = send_batch_to_sqs(items, [{'Source': {'StringValue': 'microservice1', 'DataType': 'String'}}] * 5)
+        
+        sizes = [len(c.kwargs['Entries']) for c in mock_sqs.send_message_batch.call_args_list]
+        assert sizes == [2, 2, 1]
+        for call in mock_sqs.send_message_batch.call_args_list:
+            total = sum(message_size(e['MessageBody'], e['MessageAttributes']) for e in call.kwargs['Entries'])
+            assert total <= SQS_MAX_BATCH_BYTES
+        assert results == [(f'id-{i}', None) for i in range(5)]
+    
+    @patch('app.sqs_client')
+    def test_partial_failure_is_reported_per_item(self, mock_sqs):
+        mock_sqs.send_message_batch.return_value = {
+            'Successful': [{'Id': '0', 'MessageId': 'id-0'}],
+            'Failed': [{'Id': '1', 'Code': 'InternalError', 'Message': 'Error', 'SenderFault': False}]
+        }
+        
+        results = send_batch_to_sqs([make_email(), make_email()])
+        
+        assert results[0] == ('id-0', None)
+        assert results[1][0] is None
+        assert results[1][1]
+    
+    @patch('app.sqs_client')
+    def test_client_error_fails_whole_chunk(self, mock_sqs):
+        from botocore.exceptions import ClientError
+        mock_sqs.send_message_batch.side_effect = ClientError(
+            {'Error': {'Code': '500', 'Message': 'Error'}},
+            'SendMessageBatch'
+        )
+        
+        results = send_batch_to_sqs([make_email(), make_email()])
+        
+        assert all(message_id is None and error for message_id, error in results)
+
+
+class TestBatchMessageEndpoint:
+    @patch('app.validate_token')
+    def test_invalid_token(self, mock_validate_token, client):
+        mock_validate_token.return_value = False
+        
+        response = client.post(
+            '/api/messages',
+            data=json.dumps({'data': [make_email()], 'token': 'invalid-token'}),
+            content_type='application/json'
+        )
+        assert response.status_code == 401
+    
+    @patch('app.validate_token')
+    def test_data_must_be_list(self, mock_validate_token, client):
+        mock_validate_token.return_value = True
+        
+        response = client.post(
+            '/api/messages',
+            data=json.dumps({'data': make_email(), 'token': 'valid-token'}),
+            content_type='application/json'
+        )
+        assert response.status_code == 400
+    
+    @patch('app.validate_token')
+    @patch('app.send_batch_to_sqs')
+    def test_mixed_valid_and_invalid_items(self, mock_send_batch, mock_validate_token, client):
+        mock_validate_token.return_value = True
+        mock_send_batch.return_value = [('id-0', None), (None, 'Failed to send message to queue')]
+        
+        payload = {
+            'data': [make_email(), {'email_subject': 'Test'}, make_email()],
+            'token': 'valid-token'
+        }
+        response = client.post(
+            '/api/messages',
+            data=json.dumps(payload),
+            content_type='application/json'
+        )
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert data['status'] == 'partial'
+        assert data['succeeded'] == 1
+        assert data['failed'] == 2
+        assert data['results'][0] == {'index': 0, 'status': 'success', 'message_id': 'id-0'}
+        assert 'email_sender' in data['results'][1]['error']
+        assert data['results'][2]['status'] == 'error'
+        assert mock_send_batch.call_args.args[0] == [make_email(), make_email()]
+
+
+class TestSQSBatchAggregator:
+    @patch('app.send_batch_to_sqs')
+    def test_flushes_when_batch_is_full(self, mock_send_batch):
+        mock_send_batch.side_effect = lambda items, attributes=None: [(f"id-{item['email_subject']}", None) for item in items]
+        aggregator = SQSBatchAggregator(max_batch_size=10, max_delay_ms=60000)
+        
+        futures = [aggregator.submit(make_email(str(i))) for i in range(10)]
+        
+        assert [future.result(timeout=5) for future in futures] == [f'id-{i}' for i in range(10)]
+        mock_send_batch.assert_called_once()
+        assert aggregator.stats()['batch_size_distribution'] == {'10': 1}
+    
+    @patch('app.send_batch_to_sqs')
+    def test_flushes_partial_batch_after_delay(self, mock_send_batch):
+        mock_send_batch.side_effect = lambda items, attributes=None: [('id', None) for _ in items]
+        aggregator = SQSBatchAggregator(max_batch_size=10, max_delay_ms=50)
+        
+        futures = [aggregator.submit(make_email()) for _ in range(3)]
+        
+        assert [future.result(timeout=5) for future in futures] == ['id', 'id', 'id']
+        stats = aggregator.stats()
+        assert stats['messages'] == 3
+    
+    @patch('app.send_batch_to_sqs')
+    def test_entry_failure_raises_for_that_caller_only(self, mock_send_batch):
+        from botocore.exceptions import ClientError
+        mock_send_batch.return_value = [('id-0', None), (None, 'Failed to send message to queue')]
+        aggregator = SQSBatchAggregator(max_batch_size=2, max_delay_ms=60000)
+        
+        first = aggregator.submit(make_email())
+        second = aggregator.submit(make_email())
+        
+        assert first.result(timeout=5) == 'id-0'
+        with pytest.raises(ClientError):
+            second.result(timeout=5)
+    
+    @patch('app.send_batch_to_sqs')
+    def test_large_messages_do_not_share_a_batch(self, mock_send_batch):
+        mock_send_batch.side_effect = lambda items, attributes=None: [(f"id-{item['email_subject']}", None) for item in items]
+        aggregator = SQSBatchAggregator(max_batch_size=10, max_delay_ms=60000)
+        emails = [make_email(str(i)) for i in range(2)]
+        for email in emails:
+            email['email_content'] = 'x' * 150 * 1024
+        
+        futures = [aggregator.submit(email) for email in emails]
+        
+        # The first batch closes as soon as the second message would not fit
+        assert futures[0].result(timeout=5) == 'id-0'
+        assert [len(c.args[0]) for c in mock_send_batch.call_args_list] == [1]
+        assert not futures[1].done()
+
+
+class TestMicroBatchingEndpoint:
+    @patch('app.validate_token')
+    @patch('app.send_to_sqs')
+    @patch('app.batch_aggregator')
+    @patch('app.SQS_MICRO_BATCHING', True)
+    def test_uses_aggregator_when_enabled(self, mock_aggregator, mock_send_sqs, mock_validate_token, client):
+        mock_validate_token.return_value = True
+        mock_aggregator.send.return_value = 'batched-message-id'
+        
+        response = client.post(
+            '/api/message',
+            data=json.dumps({'data': make_email(), 'token': 'valid-token'}),
+            content_type='application/json'
+        )
+        assert response.status_code == 200
+        assert json.loads(response.data)['message_id'] == 'batched-message-id'
+        mock_send_sqs.assert_not_called()
+    
+    def test_stats_endpoint(self, client):
+        response = client.get('/stats')
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert 'batch_size_distribution' in data['micro_batching']
+
+
+class TestMetricsEndpoint:
+    def test_metrics_endpoint_exposes_prometheus_text(self, client):
+        client.get('/health')
+        
+        response = client.get('/metrics')
+        
+        assert response.status_code == 200
+        body = response.data.decode('utf-8')
+        assert 'service1_requests_total{endpoint="health_check",status="200"}' in body
+        assert 'service1_stage_latency_seconds' in body
+    
+    @patch('app.sqs_client')
+    def test_send_errors_counted_by_code(self, mock_sqs):
+        from botocore.exceptions import ClientError
+        from prometheus_client import REGISTRY
+        from app import send_to_sqs
+        labels = {'operation': 'SendMessage', 'code': 'ThrottlingException'}
+        before = REGISTRY.get_sample_value('service1_aws_errors_total', labels) or 0
+        mock_sqs.send_message.side_effect = ClientError(
+            {'Error': {'Code': 'ThrottlingException', 'Message': 'Error'}},
+            'SendMessage'
+        )
+        
+        with pytest.raises(ClientError):
+            send_to_sqs(make_email())
+        
+        assert REGISTRY.get_sample_value('service1_aws_errors_total', labels) == before + 1
+
+
+class TestRejectedTokenCache:
+    def test_rejected_token_is_remembered(self):
+        cache = RejectedTokenCache(max_entries=10, ttl_seconds=60)
+        
+        cache.add('bad-token', 0)
+        
+        assert cache.contains('bad-token', 0) is True
+        assert cache.contains('other-token', 0) is False
+    
+    def test_entry_expires_after_ttl(self):
+        cache = RejectedTokenCache(max_entries=10, ttl_seconds=0)
+        cache.add('bad-token', 0)
+        
+        assert cache.contains('bad-token', 0) is False
+        assert len(cache) == 0
+    
+    def test_entry_ignored_after_token_rotation(self):
+        cache = RejectedTokenCache(max_entries=10, ttl_seconds=60)
+        cache.add('next-token', 0)
+        
+        assert cache.contains('next-token', 1) is False
+    
+    def test_least_recently_used_entry_evicted_at_capacity(self):
+        from prometheus_client import REGISTRY
+        labels = {'reason': 'capacity'}
+        before = REGISTRY.get_sample_value('service1_rejected_token_cache_evictions_total', labels) or 0
+        cache = RejectedTokenCache(max_entries=2, ttl_seconds=60)
+        cache.add('token-1', 0)
+        cache.add('token-2', 0)
+        cache.contains('token-1', 0)
+        
+        cache.add('token-3', 0)
+        
+        assert len(cache) == 2
+        assert cache.contains('token-1', 0) is True
+        assert cache.contains('token-2', 0) is False
+        assert REGISTRY.get_sample_value('service1_rejected_token_cache_evictions_total', labels) == before + 1
+    
+    def test_non_string_tokens_not_cached(self):
+        cache = RejectedTokenCache(max_entries=10, ttl_seconds=60)
+        
+        cache.add(12345, 0)
+        
+        assert len(cache) == 0
+        assert cache.contains(12345, 0) is False
+
+
+class TestRateLimiter:
+    def test_burst_then_limited(self):
+        limiter = RateLimiter(rate=1, burst=2)
+        
+        assert limiter.acquire('client-a') == 0
+        assert limiter.acquire('client-a') == 0
+        assert limiter.acquire('client-a') > 0
+        assert limiter.acquire('client-b') == 0
+    
+    @patch('app.time.monotonic')
+    def test_tokens_refill_over_time(self, mock_monotonic):
+        mock_monotonic.return_value = 100.0
+        limiter = RateLimiter(rate=2, burst=1)
+        limiter.acquire('client-a')
+        assert limiter.wait_time('client-a') == pytest.approx(0.5)
+        
+        mock_monotonic.return_value = 100.5
+        
+        assert limiter.wait_time('client-a') == 0
+    
+    def test_wait_time_does_not_spend_tokens(self):
+        limiter = RateLimiter(rate=1, burst=1)
+        
+        limiter.wait_time('client-a')
+        
+        assert limiter.acquire('client-a') == 0
+    
+    def test_tracked_clients_bounded(self):
+        limiter = RateLimiter(rate=1, burst=1, max_clients=2)
+        limiter.acquire('client-a')
+        limiter.acquire('client-b')
+        limiter.acquire('client-c')
+        
+        assert len(limiter._buckets) == 2
+        assert limiter.acquire('client-a') == 0
+
+
+class TestFastRejection:
+    @patch('app.validate_token')
+    def test_repeated_bad_token_rejected_from_cache(self, mock_validate_token, client):
+        mock_validate_token.return_value = False
+        payload = {'token': 'bad-token', 'data': make_email()}
+        
+        first = client.post('/api/message', json=payload)
+        second = client.post('/api/message', json=payload)
+        
+        assert first.status_code == 401
+        assert second.status_code == 401
+        assert json.loads(second.data)['error'] == 'Invalid token'
+        mock_validate_token.assert_called_once()
+    
+    @patch('app.validate_token')
+    def test_client_blocked_after_repeated_auth_failures(self, mock_validate_token, client):
+        mock_validate_token.return_value = False
+        
+        statuses = [
+            client.post('/api/message', json={'token': f'bad-{i}', 'data': make_email()}).status_code
+            for i in range(11)
+        ]
+        response = client.post('/api/message', data='not even json')
+        
+        assert statuses == [401] * 10 + [429]
+        assert response.status_code == 429
+        assert int(response.headers['Retry-After']) >= 1
+    
+    @patch('app.validate_token')
+    def test_auth_failures_tracked_per_forwarded_client(self, mock_validate_token, client):
+        mock_validate_token.return_value = False
+        for i in range(10):
+            client.post('/api/message', json={'token': f'bad-{i}', 'data': make_email()},
+                        headers={'X-Forwarded-For': 'spoofed, 10.0.0.1'})
+        
+        blocked = client.post('/api/message', json={'token': 'bad', 'data': make_email()},
+                              headers={'X-Forwarded-For': 'other, 10.0.0.1'})
+        other = client.post('/api/message', json={'token': 'bad', 'data': make_email()},
+                            headers={'X-Forwarded-For': '10.0.0.2'})
+        
+        assert blocked.status_code == 429
+        assert other.status_code == 401
+    
+    @patch('app.send_message')
+    @patch('app.validate_token')
+    def test_request_rate_limit(self, mock_validate_token, mock_send, client):
+        mock_validate_token.return_value = True
+        mock_send.return_value = 'msg-id'
+        
+        with patch('app.request_limiter', RateLimiter(rate=1, burst=2)):
+            statuses = [
+                client.post('/api/message', json={'token': 'valid-token', 'data': make_email()}).status_code
+                for _ in range(3)
+            ]
+        
+        assert statuses == [200, 200, 429]
+    
+    def test_health_not_rate_limited(self, client):
+        with patch('app.request_limiter', RateLimiter(rate=1, burst=1)):
+            statuses = [client.get('/health').status_code for _ in range(3)]
+        
+        assert statuses == [200, 200, 200]
+
+
+class TestFastPathParsing:
+    @pytest.mark.parametrize('backend', ['json', 'orjson', 'msgspec'])
+    def test_parse_object_body(self, backend):
+        from app import parse_request_body
+        body = json.dumps({'token': 'valid-token', 'data': make_email()}).encode('utf-8')
+        
+        with patch('app.json_backend', backend):
+            payload, _ = parse_request_body(body)
+        
+        assert payload == {'token': 'valid-token', 'data': make_email()}
+    
+    @pytest.mark.parametrize('backend', ['json', 'orjson', 'msgspec'])
+    @pytest.mark.parametrize('body', [b'', b'not json', b'[1, 2]', b'"text"'])
+    def test_parse_rejects_non_object_body(self, backend, body):
+        from app import parse_request_body
+        
+        with patch('app.json_backend', backend):
+            assert parse_request_body(body) == (None, None)
+    
+    def test_msgspec_keeps_raw_data_text(self):
+        from app import parse_request_body
+        raw = '{ "email_subject": "Caf\u00e9",  "extra": [1, 2] }'
+        
+        with patch('app.json_backend', 'msgspec'):
+            payload, raw_data = parse_request_body(f'{{"token": "t", "data": {raw}}}'.encode('utf-8'))
+        
+        assert raw_data == raw
+        assert payload['data']['email_subject'] == 'Caf\u00e9'
+    
+    @pytest.mark.parametrize('backend', ['json', 'orjson', 'msgspec'])
+    def test_dumps_round_trips(self, backend):
+        from app import dumps
+        
+        with patch('app.json_backend', backend):
+            assert json.loads(dumps(make_email())) == make_email()
+    
+    @patch('app.sqs_client')
+    @patch('app.validate_token')
+    def test_valid_message_forwarded_without_reencoding(self, mock_validate_token, mock_sqs, client):
+        mock_validate_token.return_value = True
+        mock_sqs.send_message.return_value = {'MessageId': 'msg-id'}
+        raw_data = json.dumps(make_email(), indent=1)
+        
+        with patch('app.json_backend', 'msgspec'):
+            response = client.post(
+                '/api/message',
+                data=f'{{"token": "valid-token", "data": {raw_data}}}',
+                content_type='application/json'
+            )
+        
+        assert response.status_code == 200
+        assert mock_sqs.send_message.call_args.kwargs['MessageBody'] == raw_data
+    
+    @patch('app.validate_token')
+    def test_oversized_body_rejected_before_parsing(self, mock_validate_token, client):
+        from app import MAX_REQUEST_BYTES
+        body = json.dumps({'token': 'valid-token', 'data': make_email()}) + ' ' * MAX_REQUEST_BYTES
+        
+        with patch('app.parse_request_body') as mock_parse:
+            response = client.post('/api/message', data=body, content_type='application/json')
+        
+        assert response.status_code == 413
+        assert 'too large' in json.loads(response.data)['error']
+        mock_parse.assert_not_called()
+        mock_validate_token.assert_not_called()
+    
+    def test_missing_fields_reported_before_type_errors(self):
+        is_valid, error = validate_payload({'email_subject': '', 'email_sender': 'John Doe'})
+        
+        assert is_valid is False
+        assert error == 'Missing required fields: email_timestream, email_content'
+    
+    def test_first_type_error_reported(self):
+        data = make_email()
+        data['email_sender'] = 42
+        data['email_content'] = ' '
+        
+        assert validate_payload(data) == (False, "Field 'email_sender' must be a non-empty string")
+
+
+class TestClaimCheck:
+    def large_body(self, size=100 * 1024):
+        return json.dumps({**make_email(), 'email_content': 'x' * size})
+    
+    @patch('app.CLAIM_CHECK_MODE', 'compress')
+    def test_small_body_unchanged(self):
+        from app import prepare_message_body, MESSAGE_ATTRIBUTES
+        body = json.dumps(make_email())
+        
+        assert prepare_message_body(body) == (body, MESSAGE_ATTRIBUTES)
+    
+    @patch('app.CLAIM_CHECK_MODE', 'off')
+    def test_large_body_unchanged_when_off(self):
+        from app import prepare_message_body, MESSAGE_ATTRIBUTES
+        body = self.large_body()
+        
+        assert prepare_message_body(body) == (body, MESSAGE_ATTRIBUTES)
+    
+    @patch('app.CLAIM_CHECK_BUCKET', None)
+    @patch('app.CLAIM_CHECK_MODE', 'compress')
+    def test_large_body_compressed_inline(self):
+        import base64
+        import gzip
+        from app import prepare_message_body
+        body = self.large_body()
+        
+        encoded, attributes = prepare_message_body(body)
+        
+        assert len(encoded) < len(body)
+        assert attributes['ContentEncoding']['StringValue'] == 'gzip+base64'
+        assert attributes['Source']['StringValue'] == 'microservice1'
+        assert gzip.decompress(base64.b64decode(encoded)).decode('utf-8') == body
+    
+    @patch('app.s3_client')
+    @patch('app.CLAIM_CHECK_BUCKET', 'claim-bucket')
+    @patch('app.CLAIM_CHECK_MODE', 's3')
+    def test_large_body_offloaded_to_s3(self, mock_s3):
+        import gzip
+        from app import prepare_message_body
+        body = self.large_body()
+        
+        pointer, attributes = prepare_message_body(body)
+        
+        stored = mock_s3.put_object.call_args.kwargs
+        assert stored['Bucket'] == 'claim-bucket'
+        assert stored['Key'].startswith('claim-checks/')
+        assert gzip.decompress(stored['Body']).decode('utf-8') == body
+        assert attributes['ClaimCheckBucket']['StringValue'] == 'claim-bucket'
+        assert attributes['ClaimCheckKey']['StringValue'] == stored['Key']
+        assert pointer == f"s3://claim-bucket/{stored['Key']}"
+    
+    @patch('app.s3_client')
+    @patch('app.CLAIM_CHECK_BUCKET', 'claim-bucket')
+    @patch('app.CLAIM_CHECK_MODE', 'compress')
+    def test_incompressible_body_offloaded_when_too_large_inline(self, mock_s3):
+        from app import prepare_message_body
+        body = json.dumps({**make_email(), 'email_content': os.urandom(300 * 1024).hex()})
+        
+        _, attributes = prepare_message_body(body)
+        
+        assert 'ClaimCheckKey' in attributes
+        mock_s3.put_object.assert_called_once()
+    
+    @patch('app.sqs_client')
+    @patch('app.s3_client')
+    @patch('app.CLAIM_CHECK_BUCKET', 'claim-bucket')
+    @patch('app.CLAIM_CHECK_MODE', 's3')
+    def test_s3_failure_not_sent(self, mock_s3, mock_sqs):
+        from botocore.exceptions import ClientError
+        from app import send_to_sqs
+        mock_s3.put_object.side_effect = ClientError(
+            {'Error': {'Code': 'AccessDenied', 'Message': 'Denied'}},
+            'PutObject'
+        )
+        
+        with pytest.raises(ClientError):
+            send_to_sqs(json.loads(self.large_body()))
+        
+        mock_sqs.send_message.assert_not_called()
+
+
+class TestSpillLog:
+    def throttled(self, operation='SendMessage'):
+        from botocore.exceptions import ClientError
+        return ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}, operation)
+    
+    @pytest.fixture
+    def spill_log(self, tmp_path):
+        from app import SpillLog
+        log = SpillLog(directory=str(tmp_path), fsync=False)
+        with patch('app.spill_log', log):
+            yield log
+        log.stop()
+    
+    @patch('app.sqs_client')
+    def test_replays_spooled_messages(self, mock_sqs, spill_log):
+        mock_sqs.send_message_batch.side_effect = lambda QueueUrl, Entries: {
+            'Successful': [{'Id': entry['Id'], 'MessageId': f"m-{entry['Id']}"} for entry in Entries]
+        }
+        for i in range(12):
+            spill_log.append(json.dumps({'n': i}), {'Source': {'StringValue': 'microservice1', 'DataType': 'String'}})
+        
+        assert spill_log.replay_once() == (12, False)
+        assert spill_log.replay_once() == (0, False)
+        
+        batches = sorted(
+            [json.loads(entry['MessageBody'])['n'] for entry in c.kwargs['Entries']]
+            for c in mock_sqs.send_message_batch.call_args_list
+        )
+        assert batches == [list(range(10)), [10, 11]]
+        assert spill_log.depth == 0
+        assert not spill_log.bypassing
+    
+    @patch('app.sqs_client')
+    def test_replay_batches_stay_under_byte_limit(self, mock_sqs, spill_log):
+        from app import SQS_MAX_BATCH_BYTES, message_size
+        mock_sqs.send_message_batch.side_effect = lambda QueueUrl, Entries: {
+            'Successful': [{'Id': entry['Id'], 'MessageId': f"m-{entry['Id']}"} for entry in Entries]
+        }
+        mock_sqs.send_message.return_value = {'MessageId': 'single'}
+        attributes = {'Source': {'StringValue': 'microservice1', 'DataType': 'String'}}
+        spill_log.append_many([(json.dumps({'n': i, 'content': 'x' * 30000}), attributes) for i in range(10)])
+        spill_log.append('y' * (SQS_MAX_BATCH_BYTES + 1), attributes)
+        
+        replayed = [spill_log.replay_once() for _ in range(2)]
+        
+        # Ten 30 KB records exceed 256 KiB together; the oversized one goes alone
+        assert replayed == [(11, False), (0, False)]
+        assert sorted(len(c.kwargs['Entries']) for c in mock_sqs.send_message_batch.call_args_list) == [2, 8]
+        for call in mock_sqs.send_message_batch.call_args_list:
+            assert sum(message_size(e['MessageBody'], e['MessageAttributes']) for e in call.kwargs['Entries']) <= SQS_MAX_BATCH_BYTES
+        mock_sqs.send_message.assert_called_once()
+        assert spill_log.depth == 0
+    
+    @patch('app.sqs_client')
+    def test_rejected_oversized_record_is_dropped(self, mock_sqs, spill_log):
+        from botocore.exceptions import ClientError
+        from app import SQS_MAX_BATCH_BYTES
+        mock_sqs.send_message.side_effect = ClientError(
+            {'Error': {'Code': 'InvalidParameterValue', 'Message': 'Message must be shorter than 262144 bytes'}},
+            'SendMessage'
+        )
+        spill_log.append('y' * (SQS_MAX_BATCH_BYTES + 1), {})
+        
+        assert spill_log.replay_once() == (1, False)
+        assert spill_log.depth == 0
+    
+    @patch('app.sqs_client')
+    def test_failed_replay_keeps_messages(self, mock_sqs, spill_log):
+        mock_sqs.send_message_batch.side_effect = self.throttled('SendMessageBatch')
+        spill_log.append('{"n": 1}', {})
+        
+        assert spill_log.replay_once() == (0, True)
+        assert spill_log.depth == 1
+        assert spill_log.bypassing
+    
+    @patch('app.sqs_client')
+    def test_replay_sends_batches_in_parallel(self, mock_sqs, spill_log):
+        both_sending = threading.Barrier(2, timeout=5)
+        
+        def send_message_batch(QueueUrl, Entries):
+            both_sending.wait()
+            return {'Successful': [{'Id': entry['Id'], 'MessageId': 'm'} for entry in Entries]}
+        
+        mock_sqs.send_message_batch.side_effect = send_message_batch
+        spill_log.append_many([(json.dumps({'n': i}), {}) for i in range(20)])
+        
+        assert spill_log.replay_once() == (20, False)
+        assert spill_log.depth == 0
+    
+    @patch('app.sqs_client')
+    def test_failed_batch_stops_checkpoint_and_is_read_again(self, mock_sqs, spill_log):
+        def send_message_batch(QueueUrl, Entries):
+            if any(json.loads(entry['MessageBody'])['n'] == 10 for entry in Entries):
+                raise self.throttled('SendMessageBatch')
+            return {'Successful': [{'Id': entry['Id'], 'MessageId': 'm'} for entry in Entries]}
+        
+        mock_sqs.send_message_batch.side_effect = send_message_batch
+        spill_log.append_many([(json.dumps({'n': i}), {}) for i in range(30)])
+        
+        assert spill_log.replay_once() == (10, True)
+        assert spill_log.depth == 20
+        assert json.loads(spill_log.read(1)[0][1]['body']) == {'n': 10}
+    
+    def test_read_continues_where_the_last_read_stopped(self, spill_log):
+        spill_log.append_many([(json.dumps({'n': i}), {}) for i in range(5)])
+        
+        with patch('app.json.loads', side_effect=json.loads) as mock_loads:
+            first = spill_log.read(2)
+            second = spill_log.read(2)
+        
+        assert mock_loads.call_count == 4
+        assert [json.loads(record['body'])['n'] for _, record in first] == [0, 1]
+        assert [json.loads(record['body'])['n'] for _, record in second] == [2, 3]
+        spill_log.rewind()
+        assert json.loads(spill_log.read(1)[0][1]['body']) == {'n': 0}
+    
+    @patch('app.sqs_client')
+    def test_sender_fault_entries_are_dropped(self, mock_sqs, spill_log):
+        mock_sqs.send_message_batch.return_value = {
+            'Successful': [{'Id': '0', 'MessageId': 'a'}],
+            'Failed': [{'Id': '1', 'Code': 'InvalidParameterValue', 'SenderFault': True}]
+        }
+        spill_log.append_many([('{"n": 1}', {}), ('{"n": 2}', {})])
+        
+        assert spill_log.replay_once() == (2, False)
+        assert spill_log.depth == 0
+    
+    @patch('app.sqs_client')
+    def test_recovers_after_crash(self, mock_sqs, tmp_path):
+        from app import SpillLog
+        mock_sqs.send_message_batch.return_value = {'Successful': [{'Id': '0', 'MessageId': 'a'}]}
+        crashed = SpillLog(directory=str(tmp_path), segment_bytes=1, fsync=False)
+        crashed.append('{"n": 1}', {})
+        crashed.append('{"n": 2}', {})
+        crashed.append('{"n": 3}', {})
+        (position, record), = crashed.read(1)
+        assert record['body'] == '{"n": 1}'
+        crashed.commit(position, 1)
+        with open(crashed._segment_path(2), 'ab') as f:
+            f.write(b'\x00\x00\x01\x00torn')
+        crashed.stop()
+        
+        recovered = SpillLog(directory=str(tmp_path), fsync=False)
+        recovered.open()
+        
+        assert recovered.path == crashed.path
+        assert recovered.depth == 2
+        assert not recovered.bypassing
+        assert [record['body'] for _, record in recovered.read()] == ['{"n": 2}', '{"n": 3}']
+        recovered.append('{"n": 4}', {})
+        assert [record['body'] for _, record in recovered.read()] == ['{"n": 4}']
+        recovered.rewind()
+        assert [record['body'] for _, record in recovered.read()] == ['{"n": 2}', '{"n": 3}', '{"n": 4}']
+        recovered.stop()
+    
+    def test_workers_get_separate_slots(self, tmp_path):
+        from app import SpillLog
+        first = SpillLog(directory=str(tmp_path), fsync=False)
+        second = SpillLog(directory=str(tmp_path), fsync=False)
+        first.open()
+        second.open()
+        
+        assert first.path != second.path
+        first.stop()
+        second.stop()
+    
+    def test_full_log_rejects_messages(self, tmp_path):
+        from app import SpillLog, SpillFull
+        log = SpillLog(directory=str(tmp_path), max_bytes=200, fsync=False)
+        log.append('x' * 50, {})
+        
+        with pytest.raises(SpillFull):
+            log.append('x' * 200, {})
+        assert log.depth == 1
+        log.stop()
+    
+    @patch('app.sqs_client')
+    @patch('app.validate_token')
+    def test_throttled_message_is_spooled(self, mock_validate_token, mock_sqs, spill_log, client):
+        mock_validate_token.return_value = True
+        mock_sqs.send_message.side_effect = self.throttled()
+        
+        first = client.post('/api/message', json={'token': 'valid-token', 'data': make_email()})
+        second = client.post('/api/message', json={'token': 'valid-token', 'data': make_email()})
+        
+        assert first.status_code == 202
+        assert json.loads(first.data)['status'] == 'spooled'
+        assert second.status_code == 202
+        # Within the bypass window the second message skipped SQS entirely
+        assert mock_sqs.send_message.call_count == 1
+        assert spill_log.depth == 2
+        record = spill_log.read()[0][1]
+        assert json.loads(record['body']) == make_email()
+        assert 'TraceParent' in record['attributes']
+    
+    @patch('app.sqs_client')
+    @patch('app.validate_token')
+    def test_sqs_is_tried_again_after_bypass_window_while_backlog_remains(
+            self, mock_validate_token, mock_sqs, spill_log, client):
+        mock_validate_token.return_value = True
+        mock_sqs.send_message.side_effect = self.throttled()
+        clock = [1000.0]
+        
+        with patch('app.time.monotonic', side_effect=lambda: clock[0]):
+            # A short throttling blip, then ingest that replay never catches up with
+            client.post('/api/message', json={'token': 'valid-token', 'data': make_email()})
+            mock_sqs.send_message.side_effect = None
+            mock_sqs.send_message.return_value = {'MessageId': 'sqs-id'}
+            for _ in range(3):
+                client.post('/api/message', json={'token': 'valid-token', 'data': make_email()})
+            assert spill_log.depth == 4
+            
+            clock[0] += spill_log.bypass_seconds
+            responses = [
+                client.post('/api/message', json={'token': 'valid-token', 'data': make_email()})
+                for _ in range(3)
+            ]
+            assert not spill_log.bypassing
+        
+        assert [json.loads(response.data)['message_id'] for response in responses] == ['sqs-id'] * 3
+        assert mock_sqs.send_message.call_count == 4
+        assert spill_log.depth == 4
+    
+    @patch('app.sqs_client')
+    @patch('app.validate_token')
+    def test_permanent_error_is_not_spooled(self, mock_validate_token, mock_sqs, spill_log, client):
+        from botocore.exceptions import ClientError
+        mock_validate_token.return_value = True
+        mock_sqs.send_message.side_effect = ClientError(
+            {'Error': {'Code': 'AccessDenied', 'Message': 'Denied'}, 'ResponseMetadata': {'HTTPStatusCode': 403}},
+            'SendMessage'
+        )
+        
+        response = client.post('/api/message', json={'token': 'valid-token', 'data': make_email()})
+        
+        assert response.status_code == 500
+        assert spill_log.depth == 0
+    
+    @patch('app.sqs_client')
+    @patch('app.validate_token')
+    def test_full_log_returns_503(self, mock_validate_token, mock_sqs, tmp_path, client):
+        from app import SpillLog
+        mock_validate_token.return_value = True
+        mock_sqs.send_message.side_effect = self.throttled()
+        log = SpillLog(directory=str(tmp_path), max_bytes=10, fsync=False)
+        
+        with patch('app.spill_log', log):
+            response = client.post('/api/message', json={'token': 'valid-token', 'data': make_email()})
+        
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '30'
+        log.stop()
+    
+    @patch('app.sqs_client')
+    @patch('app.validate_token')
+    def test_batch_spools_server_side_failures(self, mock_validate_token, mock_sqs, spill_log, client):
+        mock_validate_token.return_value = True
+        mock_sqs.send_message_batch.return_value = {
+            'Successful': [{'Id': '0', 'MessageId': 'id-0'}],
+            'Failed': [
+                {'Id': '1', 'Code': 'InternalError', 'SenderFault': False},
+                {'Id': '2', 'Code': 'InvalidParameterValue', 'SenderFault': True}
+            ]
+        }
+        
+        response = client.post('/api/messages', json={'token': 'valid-token', 'data': [make_email()] * 3})
+        
+        data = json.loads(response.data)
+        assert [result['status'] for result in data['results']] == ['success', 'spooled', 'error']
+        assert data['succeeded'] == 2
+        assert data['spooled'] == 1
+        assert spill_log.depth == 1
+
+
+class TestAsyncAck:
+    @pytest.fixture
+    def async_ack(self, tmp_path):
+        from app import AsyncAckQueue, AckStatusStore
+        queue = AsyncAckQueue(max_pending=5, max_delay_ms=10, store=AckStatusStore(str(tmp_path / 'acks.db')))
+        with patch('app.async_ack', queue), patch('app.ASYNC_ACK_MODE', 'prefer'):
+            yield queue
+    
+    def post(self, client, prefer=True):
+        headers = {'Prefer': 'respond-async'} if prefer else {}
+        return client.post('/api/message', json={'token': 'valid-token', 'data': make_email()}, headers=headers)
+    
+    def status(self, client, ack_id, token='valid-token'):
+        return client.get(f'/api/message/{ack_id}', headers={'Authorization': f'Bearer {token}'})
+    
+    @patch('app.send_batch_to_sqs')
+    @patch('app.validate_token')
+    def test_accepts_and_reports_message_id(self, mock_validate_token, mock_send_batch, async_ack, client):
+        mock_validate_token.return_value = True
+        mock_send_batch.side_effect = lambda items, attributes=None: [(f'sqs-{i}', None) for i in range(len(items))]
+        
+        response = self.post(client)
+        
+        assert response.status_code == 202
+        data = json.loads(response.data)
+        assert data['status'] == 'accepted'
+        assert response.headers['Location'] == f"/api/message/{data['id']}"
+        assert async_ack.drain(timeout=5)
+        status = json.loads(self.status(client, data['id']).data)
+        assert status['status'] == 'sent'
+        assert status['message_id'] == 'sqs-0'
+        items, attributes = mock_send_batch.call_args.args
+        assert items == [make_email()]
+        assert 'TraceParent' in attributes[0]
+    
+    @patch('app.send_batch_to_sqs')
+    @patch('app.validate_token')
+    def test_failed_send_is_reported(self, mock_validate_token, mock_send_batch, async_ack, client):
+        mock_validate_token.return_value = True
+        mock_send_batch.side_effect = lambda items, attributes=None: [
+            (None, 'Failed to send message to queue') for _ in items
+        ]
+        
+        ack_id = json.loads(self.post(client).data)['id']
+        assert async_ack.drain(timeout=5)
+        
+        status = json.loads(self.status(client, ack_id).data)
+        assert status['status'] == 'failed'
+        assert status['error'] == 'Failed to send message to queue'
+    
+    @patch('app.send_to_sqs')
+    @patch('app.validate_token')
+    def test_without_prefer_header_waits_for_sqs(self, mock_validate_token, mock_send_sqs, async_ack, client):
+        mock_validate_token.return_value = True
+        mock_send_sqs.return_value = 'sync-id'
+        
+        response = self.post(client, prefer=False)
+        
+        assert response.status_code == 200
+        assert json.loads(response.data)['message_id'] == 'sync-id'
+    
+    @patch('app.send_batch_to_sqs')
+    @patch('app.validate_token')
+    def test_full_queue_pushes_back(self, mock_validate_token, mock_send_batch, async_ack, client):
+        mock_validate_token.return_value = True
+        release = threading.Event()
+        
+        def slow_send(items, attributes=None):
+            release.wait(5)
+            return [('id', None) for _ in items]
+        mock_send_batch.side_effect = slow_send
+        
+        statuses = [self.post(client).status_code for _ in range(6)]
+        
+        assert statuses == [202] * 5 + [503]
+        release.set()
+        assert async_ack.drain(timeout=5)
+        assert self.post(client).status_code == 202
+    
+    @patch('app.send_batch_to_sqs')
+    @patch('app.validate_token')
+    def test_status_requires_valid_token(self, mock_validate_token, mock_send_batch, async_ack, client):
+        mock_validate_token.side_effect = lambda token: token == 'valid-token'
+        mock_send_batch.side_effect = lambda items, attributes=None: [('sqs-id', None) for _ in items]
+        ack_id = json.loads(self.post(client).data)['id']
+        assert async_ack.drain(timeout=5)
+        
+        assert client.get(f'/api/message/{ack_id}').status_code == 401
+        assert self.status(client, ack_id, token='wrong-token').status_code == 401
+        assert self.status(client, ack_id).status_code == 200
+    
+    @patch('app.send_batch_to_sqs')
+    @patch('app.validate_token')
+    def test_accept_does_not_write_status(self, mock_validate_token, mock_send_batch, async_ack, client):
+        mock_validate_token.return_value = True
+        release = threading.Event()
+        
+        def slow_send(items, attributes=None):
+            release.wait(5)
+            return [('sqs-id', None) for _ in items]
+        mock_send_batch.side_effect = slow_send
+        
+        with patch.object(async_ack.store, 'complete', wraps=async_ack.store.complete) as mock_complete:
+            ack_ids = [json.loads(self.post(client).data)['id'] for _ in range(3)]
+            assert [json.loads(self.status(client, ack_id).data)['status'] for ack_id in ack_ids] == ['pending'] * 3
+            mock_complete.assert_not_called()
+            release.set()
+            assert async_ack.drain(timeout=5)
+        
+        assert sum(len(c.args[0]) for c in mock_complete.call_args_list) == 3
+        assert [json.loads(self.status(client, ack_id).data)['status'] for ack_id in ack_ids] == ['sent'] * 3
+    
+    @patch('app.validate_token')
+    def test_unknown_id_returns_404(self, mock_validate_token, async_ack, client):
+        mock_validate_token.return_value = True
+        assert self.status(client, 'does-not-exist').status_code == 404
+    
+    @patch('app.validate_token')
+    def test_status_lookup_disabled_by_default(self, mock_validate_token, client):
+        mock_validate_token.return_value = True
+        assert self.status(client, 'anything').status_code == 404
+    
+    def test_status_store_expires_entries(self, tmp_path):
+        from app import AckStatusStore, new_ack_id
+        store = AckStatusStore(str(tmp_path / 'acks.db'), ttl_seconds=60)
+        old = new_ack_id(time.time() - 120)
+        new = new_ack_id(time.time())
+        store.complete([(old, 'sent', 'sqs-1', None), (new, 'spooled', 'spool-1', None)])
+        
+        assert store.get(old) is None
+        assert store.get(new)['spool_id'] == 'spool-1'
+        assert store.get(new_ack_id(time.time()))['status'] == 'pending'
+        assert store.get(new_ack_id(time.time() - 120)) is None
+        assert store.get('does-not-exist') is None
+
+
+class TestTokenCache:
+    def throttled(self):
+        from botocore.exceptions import ClientError
+        return ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}, 'GetParameter')
+    
+    @patch('app.get_token_from_ssm')
+    def test_token_loaded_once(self, mock_get_token):
+        mock_get_token.return_value = 'valid-token'
+        cache = TokenCache(ttl_seconds=60)
+        
+        assert cache.is_valid('valid-token') is True
+        assert cache.is_valid('valid-token') is True
+        assert cache.is_valid('wrong-token') is False
+        
+        mock_get_token.assert_called_once()
+        cache.stop()
+    
+    @patch('app.get_token_from_ssm')
+    def test_previous_token_accepted_during_grace_window(self, mock_get_token):
+        mock_get_token.side_effect = ['old-token', 'new-token']
+        cache = TokenCache(ttl_seconds=60, grace_seconds=60)
+        cache.refresh()
+        
+        cache.refresh()
+        
+        assert cache.is_valid('new-token') is True
+        assert cache.is_valid('old-token') is True
+    
+    @patch('app.time.monotonic')
+    @patch('app.get_token_from_ssm')
+    def test_previous_token_rejected_after_grace_window(self, mock_get_token, mock_monotonic):
+        mock_get_token.side_effect = ['old-token', 'new-token']
+        mock_monotonic.return_value = 1000.0
+        cache = TokenCache(ttl_seconds=60, grace_seconds=30)
+        cache.refresh()
+        cache.refresh()
+        
+        mock_monotonic.return_value = 1031.0
+        
+        assert cache.is_valid('new-token') is True
+        assert cache.is_valid('old-token') is False
+    
+    @patch('app.get_token_from_ssm')
+    def test_throttled_refresh_keeps_last_known_token(self, mock_get_token):
+        mock_get_token.side_effect = ['valid-token', self.throttled()]
+        cache = TokenCache(ttl_seconds=60)
+        cache.refresh()
+        
+        assert cache.refresh() is False
+        assert cache.is_valid('valid-token') is True
+    
+    @patch('app.get_token_from_ssm')
+    def test_first_load_failure_raises(self, mock_get_token):
+        from botocore.exceptions import ClientError
+        mock_get_token.side_effect = self.throttled()
+        cache = TokenCache(ttl_seconds=60)
+        
+        with pytest.raises(ClientError):
+            cache.is_valid('valid-token')
+        cache.stop()
+    
+    @patch('app.get_token_from_ssm')
+    def test_background_refresh_picks_up_rotation(self, mock_get_token):
+        mock_get_token.return_value = 'old-token'
+        cache = TokenCache(ttl_seconds=0.01, grace_seconds=60)
+        cache.start()
+        
+        mock_get_token.return_value = 'new-token'
+        deadline = time.monotonic() + 2
+        while cache.get() != 'new-token' and time.monotonic() < deadline:
+            time.sleep(0.01)
+        cache.stop()
+        
+        assert cache.get() == 'new-token'
+        assert cache.is_valid('old-token') is True
+    
+    @patch('app.get_token_from_ssm')
+    def test_connection_error_does_not_stop_refresh_thread(self, mock_get_token):
+        from botocore.exceptions import EndpointConnectionError
+        mock_get_token.return_value = 'old-token'
+        cache = TokenCache(ttl_seconds=0.01, retry_seconds=0.01, grace_seconds=60)
+        cache.start()
+        
+        mock_get_token.side_effect = [
+            EndpointConnectionError(endpoint_url='https://ssm.us-east-1.amazonaws.com'),
+            RuntimeError('unexpected'),
+            'new-token'
+        ]
+        deadline = time.monotonic() + 2
+        while cache.get() != 'new-token' and time.monotonic() < deadline:
+            time.sleep(0.01)
+        cache.stop()
+        
+        # The rotation arrives only if the thread outlived both failures
+        assert cache.get() == 'new-token'
+    
+    @patch('app.get_token_from_ssm')
+    def test_start_survives_connection_error(self, mock_get_token):
+        from botocore.exceptions import EndpointConnectionError
+        mock_get_token.side_effect = EndpointConnectionError(endpoint_url='https://ssm.us-east-1.amazonaws.com')
+        cache = TokenCache(ttl_seconds=60)
+        
+        cache.start()
+        
+        assert cache.loaded is False
+        cache.stop()
+    
+    @patch('app.get_token_from_ssm')
+    def test_unknown_token_triggers_early_refresh(self, mock_get_token):
+        from app import authenticate
+        mock_get_token.return_value = 'old-token'
+        cache = TokenCache(ttl_seconds=60, miss_refresh_seconds=0)
+        cache.start()
+        mock_get_token.return_value = 'new-token'
+        
+        with patch('app.token_cache', cache):
+            assert authenticate('new-token', 'client') is False
+            deadline = time.monotonic() + 2
+            while cache.get() != 'new-token' and time.monotonic() < deadline:
+                time.sleep(0.01)
+            assert authenticate('new-token', 'client') is True
+        cache.stop()
+    
+    @patch('app.get_token_from_ssm')
+    def test_rotation_clears_auth_failure_limit(self, mock_get_token):
+        from app import authenticate, check_rate_limits
+        mock_get_token.return_value = 'old-token'
+        cache = TokenCache(ttl_seconds=60)
+        cache.refresh()
+        
+        with patch('app.token_cache', cache):
+            for _ in range(10):
+                authenticate('new-token', 'client')
+            assert check_rate_limits('client') > 0
+            
+            mock_get_token.return_value = 'new-token'
+            cache.refresh()
+            
+            assert check_rate_limits('client') == 0
+            assert authenticate('new-token', 'client') is True
+    
+    def test_retry_delay_backs_off_up_to_ttl(self):
+        cache = TokenCache(ttl_seconds=60, retry_seconds=5)
+        
+        assert cache._next_delay(0) == 60
+        assert cache._next_delay(1) == 5
+        assert cache._next_delay(2) == 10
+        assert cache._next_delay(10) == 60
+
+
+class TestAsyncServingMode:
+    @pytest.fixture(autouse=True)
+    def fresh_token_cache(self):
+        with patch('app.token_cache', TokenCache()):
+            yield
+    
+    def post(self, payload, path='/api/message', headers=None):
+        import asgi
+        
+        async def request():
+            response = await asgi.app.test_client().post(path, json=payload, headers=headers)
+            return response.status_code, await response.get_json()
+        
+        return asyncio.run(request())
+    
+    def get(self, path, headers=None):
+        import asgi
+        
+        async def request():
+            response = await asgi.app.test_client().get(path, headers=headers)
+            return response.status_code, await response.get_json()
+        
+        return asyncio.run(request())
+    
+    @patch('asgi.sqs_client')
+    @patch('app.get_token_from_ssm')
+    def test_valid_message_sent_without_blocking(self, mock_get_token, mock_sqs):
+        mock_get_token.return_value = 'valid-token'
+        mock_sqs.send_message = AsyncMock(return_value={'MessageId': 'async-message-id'})
+        
+        status, data = self.post({'token': 'valid-token', 'data': make_email()})
+        
+        assert status == 200
+        assert data['status'] == 'success'
+        assert data['message_id'] == 'async-message-id'
+        mock_sqs.send_message.assert_awaited_once()
+        assert json.loads(mock_sqs.send_message.call_args.kwargs['MessageBody']) == make_email()
+        attributes = mock_sqs.send_message.call_args.kwargs['MessageAttributes']
+        assert set(attributes) == {'Source', 'IngestTimestamp', 'TraceParent'}
+    
+    @patch('asgi.sqs_client')
+    @patch('app.get_token_from_ssm')
+    def test_throttled_message_is_spooled(self, mock_get_token, mock_sqs, tmp_path):
+        from botocore.exceptions import ClientError
+        from app import SpillLog
+        mock_get_token.return_value = 'valid-token'
+        mock_sqs.send_message = AsyncMock(side_effect=ClientError(
+            {'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}},
+            'SendMessage'
+        ))
+        log = SpillLog(directory=str(tmp_path), fsync=False)
+        
+        with patch('app.spill_log', log):
+            status, data = self.post({'token': 'valid-token', 'data': make_email()})
+        
+        assert status == 202
+        assert data['status'] == 'spooled'
+        assert log.depth == 1
+        log.stop()
+    
+    @patch('asgi.sqs_client')
+    @patch('app.get_token_from_ssm')
+    def test_invalid_token_rejected(self, mock_get_token, mock_sqs):
+        mock_get_token.return_value = 'valid-token'
+        mock_sqs.send_message = AsyncMock()
+        
+        status, data = self.post({'token': 'wrong-token', 'data': make_email()})
+        
+        assert status == 401
+        assert data['error'] == 'Invalid token'
+        mock_sqs.send_message.assert_not_awaited()
+    
+    @patch('asgi.sqs_client')
+    @patch('app.get_token_from_ssm')
+    def test_missing_fields_rejected(self, mock_get_token, mock_sqs):
+        mock_get_token.return_value = 'valid-token'
+        mock_sqs.send_message = AsyncMock()
+        
+        status, data = self.post({'token': 'valid-token', 'data': {'email_subject': 'Test'}})
+        
+        assert status == 400
+        assert 'Missing required fields' in data['error']
+    
+    @patch('asgi.sqs_client')
+    @patch('app.get_token_from_ssm')
+    def test_sqs_error_returns_500(self, mock_get_token, mock_sqs):
+        from botocore.exceptions import ClientError
+        mock_get_token.return_value = 'valid-token'
+        mock_sqs.send_message = AsyncMock(side_effect=ClientError(
+            {'Error': {'Code': 'InternalError', 'Message': 'Error'}},
+            'SendMessage'
+        ))
+        
+        status, data = self.post({'token': 'valid-token', 'data': make_email()})
+        
+        assert status == 500
+        assert data['error'] == 'Internal server error'
+    
+    @patch('app.sqs_client')
+    @patch('app.get_token_from_ssm')
+    def test_batch_endpoint(self, mock_get_token, mock_sqs):
+        mock_get_token.return_value = 'valid-token'
+        mock_sqs.send_message_batch.side_effect = lambda QueueUrl, Entries: {
+            'Successful': [{'Id': e['Id'], 'MessageId': f"id-{e['Id']}"} for e in Entries]
+        }
+        
+        status, data = self.post(
+            {'token': 'valid-token', 'data': [make_email(), {'email_subject': 'Test'}, make_email()]},
+            path='/api/messages'
+        )
+        
+        assert status == 200
+        assert data['status'] == 'partial'
+        assert data['results'][0] == {'index': 0, 'status': 'success', 'message_id': 'id-0'}
+        assert data['results'][1]['status'] == 'error'
+        assert data['results'][2] == {'index': 2, 'status': 'success', 'message_id': 'id-1'}
+    
+    @patch('app.batch_aggregator')
+    @patch('app.SQS_MICRO_BATCHING', True)
+    @patch('asgi.sqs_client')
+    @patch('app.get_token_from_ssm')
+    def test_micro_batching_uses_aggregator(self, mock_get_token, mock_sqs, mock_aggregator):
+        from concurrent.futures import Future
+        mock_get_token.return_value = 'valid-token'
+        mock_sqs.send_message = AsyncMock()
+        future = Future()
+        future.set_result('batched-message-id')
+        mock_aggregator.submit.return_value = future
+        
+        status, data = self.post({'token': 'valid-token', 'data': make_email()})
+        
+        assert status == 200
+        assert data['message_id'] == 'batched-message-id'
+        mock_sqs.send_message.assert_not_awaited()
+    
+    @patch('app.send_batch_to_sqs')
+    @patch('app.get_token_from_ssm')
+    def test_respond_async_returns_202_and_status(self, mock_get_token, mock_send_batch, tmp_path):
+        from app import AsyncAckQueue, AckStatusStore
+        mock_get_token.return_value = 'valid-token'
+        mock_send_batch.side_effect = lambda items, attributes=None: [(f'sqs-{i}', None) for i in range(len(items))]
+        queue = AsyncAckQueue(max_pending=5, max_delay_ms=10, store=AckStatusStore(str(tmp_path / 'acks.db')))
+        
+        with patch('app.async_ack', queue), patch('app.ASYNC_ACK_MODE', 'prefer'):
+            status, data = self.post(
+                {'token': 'valid-token', 'data': make_email()},
+                headers={'Prefer': 'respond-async'}
+            )
+            assert status == 202
+            assert queue.drain(timeout=5)
+            assert self.get(data['status_url'])[0] == 401
+            status, message_status = self.get(data['status_url'], headers={'Authorization': 'Bearer valid-token'})
+        
+        assert status == 200
+        assert message_status['status'] == 'sent'
+        assert message_status['message_id'] == 'sqs-0'
+    
+    def test_stats(self):
+        status, data = self.get('/stats')
+        
+        assert status == 200
+        assert set(data) == {'micro_batching', 'async_ack', 'spill', 'logging'}
+
+
+class TestTracing:
+    TRACEPARENT = '00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01'
+    
+    @pytest.fixture
+    def exporter(self):
+        import tracing
+        exporter = MagicMock()
+        with patch('app.tracer', tracing.Tracer('service1', sample_rate=1.0, exporter=exporter)):
+            yield exporter
+    
+    @patch('app.sqs_client')
+    @patch('app.validate_token')
+    def test_message_carries_trace_context(self, mock_validate_token, mock_sqs, client):
+        mock_validate_token.return_value = True
+        mock_sqs.send_message.return_value = {'MessageId': 'msg-id'}
+        
+        before = int(time.time() * 1000)
+        response = client.post('/api/message', json={'token': 'valid-token', 'data': make_email()},
+                               headers={'traceparent': self.TRACEPARENT})
+        
+        assert response.status_code == 200
+        attributes = mock_sqs.send_message.call_args.kwargs['MessageAttributes']
+        assert attributes['Source']['StringValue'] == 'microservice1'
+        assert attributes['IngestTimestamp']['DataType'] == 'Number'
+        assert before <= int(attributes['IngestTimestamp']['StringValue']) <= int(time.time() * 1000)
+        trace_id, _, sampled = attributes['TraceParent']['StringValue'].split('-')[1:]
+        assert trace_id == '4bf92f3577b34da6a3ce929d0e0e4736'
+        assert sampled == '01'
+    
+    @patch('app.sqs_client')
+    @patch('app.validate_token')
+    def test_batch_entries_share_request_trace(self, mock_validate_token, mock_sqs, client):
+        mock_validate_token.return_value = True
+        mock_sqs.send_message_batch.return_value = {
+            'Successful': [{'Id': '0', 'MessageId': 'a'}, {'Id': '1', 'MessageId': 'b'}]
+        }
+        
+        response = client.post('/api/messages', json={'token': 'valid-token', 'data': [make_email(), make_email()]})
+        
+        assert response.status_code == 200
+        entries = mock_sqs.send_message_batch.call_args.kwargs['Entries']
+        traceparents = {entry['MessageAttributes']['TraceParent']['StringValue'] for entry in entries}
+        assert len(traceparents) == 1
+        assert all('IngestTimestamp' in entry['MessageAttributes'] for entry in entries)
+    
+    @patch('app.send_to_sqs')
+    @patch('app.validate_token')
+    def test_sampled_request_exports_server_and_producer_spans(self, mock_validate_token, mock_send_sqs,
+                                                                exporter, client):
+        mock_validate_token.return_value = True
+        mock_send_sqs.return_value = 'msg-id'
+        
+        client.post('/api/message', json={'token': 'valid-token', 'data': make_email()})
+        
+        spans = {span.name: span for span in (c.args[0] for c in exporter.export.call_args_list)}
+        server, producer = spans['POST /api/message'], spans['SQS SendMessage']
+        assert server.kind == 'server'
+        assert server.attributes['http.response.status_code'] == 200
+        assert producer.parent_id == server.span_id
+        assert producer.trace_id == server.trace_id
+        assert producer.attributes['messaging.message.id'] == 'msg-id'
+        traceparent = mock_send_sqs.call_args.args[2]['TraceParent']['StringValue']
+        assert traceparent == producer.traceparent
+    
+    def test_unsampled_trace_is_not_exported(self):
+        import tracing
+        exporter = MagicMock()
+        tracer = tracing.Tracer('service1', sample_rate=0.0, exporter=exporter)
+        
+        with tracer.start_span('request') as span:
+            pass
+        
+        assert span.traceparent.endswith('-00')
+        exporter.export.assert_not_called()
+    
+    def test_invalid_traceparent_starts_new_trace(self):
+        import tracing
+        tracer = tracing.Tracer('service1', sample_rate=0.0, exporter=MagicMock())
+        
+        assert tracing.parse_traceparent('not-a-traceparent') is None
+        assert tracing.parse_traceparent('00-' + '0' * 32 + '-00f067aa0ba902b7-01') is None
+        span = tracer.start_span('request', parent='garbage')
+        assert span.parent_id is None
+        assert len(span.trace_id) == 32
+    
+    def test_file_exporter_writes_otlp_json(self, tmp_path):
+        import tracing
+        path = tmp_path / 'traces.jsonl'
+        exporter = tracing.SpanExporter('service1', exporter='file', path=str(path), interval=3600)
+        tracer = tracing.Tracer('service1', sample_rate=1.0, exporter=exporter)
+        
+        with tracer.start_span('parent') as parent:
+            with pytest.raises(ValueError):
+                with tracer.start_span('child', parent=parent, kind='producer', attributes={'count': 2}):
+                    raise ValueError('boom')
+        exporter.flush()
+        
+        batch = json.loads(path.read_text().splitlines()[0])
+        resource = batch['resourceSpans'][0]
+        assert resource['resource']['attributes'][0]['value'] == {'stringValue': 'service1'}
+        child, exported_parent = resource['scopeSpans'][0]['spans']
+        assert child['parentSpanId'] == exported_parent['spanId'] == parent.span_id
+        assert child['kind'] == 4
+        assert child['status'] == {'code': 2, 'message': 'boom'}
+        assert child['attributes'] == [{'key': 'count', 'value': {'intValue': '2'}}]
+        assert int(child['endTimeUnixNano']) >= int(child['startTimeUnixNano'])
+
+
+class TestStructuredLogging:
+    @patch('structured_logging.LOG_SUCCESS_SAMPLE_RATE', 1)
+    @patch('app.sqs_client')
+    def test_send_success_is_logged_with_message_id(self, mock_sqs, caplog):
+        from app import send_to_sqs
+        mock_sqs.send_message.return_value = {'MessageId': 'msg-123'}
+        
+        with caplog.at_level(logging.INFO, logger='app'):
+            send_to_sqs({'email_subject': 'Hi'})
+        
+        record = [record for record in caplog.records if record.name == 'app'][-1]
+        assert record.getMessage() == 'Message sent to SQS'
+        assert record.fields == {'message_id': 'msg-123'}
+    
+    @patch('structured_logging.LOG_SUCCESS_SAMPLE_RATE', 0)
+    @patch('app.sqs_client')
+    def test_unsampled_success_is_not_logged(self, mock_sqs, caplog):
+        from app import send_to_sqs
+        mock_sqs.send_message.return_value = {'MessageId': 'msg-123'}
+        
+        with caplog.at_level(logging.INFO, logger='app'):
+            send_to_sqs({'email_subject': 'Hi'})
+        
+        assert not [record for record in caplog.records if record.name == 'app']
+    
+    def test_stats_reports_logging(self, client):
+        response = client.get('/stats')
+        
+        assert response.get_json()['logging'] == {
+            'success_sample_rate': 0.01,
+            'dropped': 0
+        }
+
+
 class TestRequiredFields:
     def test_all_required_fields_present(self):
         assert len(REQUIRED_FIELDS) == 4
@@ -1,56 +1,638 @@
 import os
+import gzip
 import json
+import math
+import base64
+import hashlib
 import time
+import random
 import logging
 import uuid
+import signal
+import threading
+import zlib
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
-import boto3
 from botocore.exceptions import ClientError
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+import aws_clients
+import s3_layout
+import structured_logging
+import tracing
 
-logging.basicConfig(level=logging.INFO)
+# JSON lines written by a background thread; see common/structured_logging.py
+structured_logging.configure('service2')
 logger = logging.getLogger(__name__)
 
 AWS_REGION = os.environ.get('AWS_REGION', 'us-east-1')
 SQS_QUEUE_URL = os.environ.get('SQS_QUEUE_URL')
 S3_BUCKET_NAME = os.environ.get('S3_BUCKET_NAME')
-POLL_INTERVAL = int(os.environ.get('POLL_INTERVAL', '10'))
+# Extra delay after an empty receive; the 20s long-poll already waits for messages
+POLL_INTERVAL = int(os.environ.get('POLL_INTERVAL', '0'))
+POLL_BACKOFF_BASE = float(os.environ.get('POLL_BACKOFF_BASE', '0.5'))
+POLL_BACKOFF_MAX = float(os.environ.get('POLL_BACKOFF_MAX', '30'))
+WORKER_CONCURRENCY = int(os.environ.get('WORKER_CONCURRENCY', '10'))
+MAX_IN_FLIGHT = int(os.environ.get('MAX_IN_FLIGHT', '20'))
+# Message body bytes in flight before polling pauses, whatever their count
+MAX_IN_FLIGHT_BYTES = int(os.environ.get('MAX_IN_FLIGHT_BYTES', str(32 * 1024 * 1024)))
+SQS_BATCH_DELETES = os.environ.get('SQS_BATCH_DELETES', 'true').lower() == 'true'
+SQS_DELETE_BATCH_WINDOW_MS = int(os.environ.get('SQS_DELETE_BATCH_WINDOW_MS', '50'))
+SQS_DELETE_MAX_RETRIES = int(os.environ.get('SQS_DELETE_MAX_RETRIES', '3'))
+SQS_DELETE_SENDERS = int(os.environ.get('SQS_DELETE_SENDERS', '4'))
+POLLER_COUNT = int(os.environ.get('POLLER_COUNT', '1'))
+VISIBILITY_TIMEOUT = int(os.environ.get('VISIBILITY_TIMEOUT', '30'))
+VISIBILITY_HEARTBEAT = os.environ.get('VISIBILITY_HEARTBEAT', 'true').lower() == 'true'
+# Object names under messages/: 'message_id' or 'content_hash' (SHA-256 of
+# the body, so identical resubmissions also share one object)
+S3_KEY_STRATEGY = os.environ.get('S3_KEY_STRATEGY', 'message_id')
+# 'hourly' writes every message under messages/YYYY/MM/DD/HH/; 'sharded'
+# puts S3_KEY_SHARD_CHARS hex characters of the record's SHA-256 in front
+# of the hour, spreading PUTs over 16**chars prefixes so a high message
+# rate stays under S3's per-prefix request limit
+S3_KEY_LAYOUT = os.environ.get('S3_KEY_LAYOUT', 'hourly')
+S3_KEY_SHARD_CHARS = int(os.environ.get('S3_KEY_SHARD_CHARS', '2'))
+# Per-hour manifests under MANIFEST_PREFIX mapping message ID and sender to
+# the stored key, written every MANIFEST_FLUSH_SECONDS or MANIFEST_MAX_ENTRIES
+MANIFEST_ENABLED = os.environ.get('MANIFEST_ENABLED', 'true').lower() == 'true'
+MANIFEST_PREFIX = os.environ.get('MANIFEST_PREFIX', s3_layout.MANIFEST_PREFIX)
+MANIFEST_FLUSH_SECONDS = float(os.environ.get('MANIFEST_FLUSH_SECONDS', '60'))
+MANIFEST_MAX_ENTRIES = int(os.environ.get('MANIFEST_MAX_ENTRIES', '10000'))
+# Recently written messages remembered to skip S3 writes for redeliveries
+DEDUP_CACHE_SIZE = int(os.environ.get('DEDUP_CACHE_SIZE', '100000'))
+DEDUP_CACHE_TTL_SECONDS = float(os.environ.get('DEDUP_CACHE_TTL_SECONDS', '3600'))
+# Messages that can never succeed (bad JSON or encoding, missing claim
+# check) or were received more than POISON_MAX_RECEIVES times are moved out
+# of the queue in bulk: 's3' writes them under QUARANTINE_PREFIX, 'dlq'
+# sends them to DLQ_URL and 'off' leaves them to the queue's redrive policy
+QUARANTINE_MODE = os.environ.get('QUARANTINE_MODE', 's3')
+QUARANTINE_PREFIX = os.environ.get('QUARANTINE_PREFIX', 'quarantine/')
+QUARANTINE_BATCH_WINDOW_MS = int(os.environ.get('QUARANTINE_BATCH_WINDOW_MS', '200'))
+DLQ_URL = os.environ.get('DLQ_URL')
+POISON_MAX_RECEIVES = int(os.environ.get('POISON_MAX_RECEIVES', '4'))
+# 'object' writes one JSON object per message; 'segment' batches messages
+# into newline-delimited JSON objects under segments/
+S3_WRITE_MODE = os.environ.get('S3_WRITE_MODE', 'object')
+SEGMENT_MAX_BYTES = int(os.environ.get('SEGMENT_MAX_BYTES', str(8 * 1024 * 1024)))
+SEGMENT_MAX_MESSAGES = int(os.environ.get('SEGMENT_MAX_MESSAGES', '1000'))
+SEGMENT_MAX_AGE_SECONDS = float(os.environ.get('SEGMENT_MAX_AGE_SECONDS', '10'))
+SEGMENT_GZIP = os.environ.get('SEGMENT_GZIP', 'false').lower() == 'true'
+SEGMENT_UPLOADERS = int(os.environ.get('SEGMENT_UPLOADERS', '2'))
+SEGMENT_MULTIPART = os.environ.get('SEGMENT_MULTIPART', 'false').lower() == 'true'
+SEGMENT_PART_SIZE = int(os.environ.get('SEGMENT_PART_SIZE', str(8 * 1024 * 1024)))
+SEGMENT_PART_UPLOADERS = int(os.environ.get('SEGMENT_PART_UPLOADERS', '4'))
+POLLER_AUTOSCALE = os.environ.get('POLLER_AUTOSCALE', 'false').lower() == 'true'
+MAX_POLLER_COUNT = int(os.environ.get('MAX_POLLER_COUNT', '4'))
+MESSAGES_PER_POLLER = int(os.environ.get('MESSAGES_PER_POLLER', '100'))
+AUTOSCALE_INTERVAL = int(os.environ.get('AUTOSCALE_INTERVAL', '30'))
+# Time allowed after SIGTERM to finish or hand back in-flight messages; keep
+# it under the ECS stopTimeout (30s by default) so the task is not killed
+SHUTDOWN_TIMEOUT_SECONDS = float(os.environ.get('SHUTDOWN_TIMEOUT_SECONDS', '25'))
+# Share of the shutdown budget kept back from the pipeline drain for the
+# manifest flush and the final thread joins
+SHUTDOWN_TAIL_FRACTION = 0.2
+# Port for the Prometheus metrics server; 0 disables it
+METRICS_PORT = int(os.environ.get('METRICS_PORT', '9100'))
 
-sqs_client = boto3.client('sqs', region_name=AWS_REGION)
-s3_client = boto3.client('s3', region_name=AWS_REGION)
+# SQS returns at most 10 messages per ReceiveMessage call and accepts at
+# most 10 entries per DeleteMessageBatch call
+SQS_MAX_MESSAGES = 10
+SQS_BATCH_SIZE = 10
 
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
 
-def poll_sqs():
+# All pollers and upload workers share these clients, so the connection
+# pool must fit every thread that can be talking to AWS at once (upload
+# workers, pollers, segment uploads, the delete and quarantine batchers, the
+# manifest writer and the visibility heartbeat), even if
+# AWS_MAX_POOL_CONNECTIONS is lower
+MAX_POLLERS = max(POLLER_COUNT, MAX_POLLER_COUNT) if POLLER_AUTOSCALE else POLLER_COUNT
+SEGMENT_CONNECTIONS = SEGMENT_UPLOADERS * (SEGMENT_PART_UPLOADERS if SEGMENT_MULTIPART else 1)
+AWS_CONNECTIONS = WORKER_CONCURRENCY + MAX_POLLERS + SEGMENT_CONNECTIONS + 2 * SQS_DELETE_SENDERS + 2
+
+# Latency buckets (seconds) from fast S3 PUTs up to a full 20s long-poll
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0)
+
+# Queue dwell and end-to-end times also cover backlogs, so extend to minutes
+MESSAGE_LATENCY_BUCKETS = LATENCY_BUCKETS + (60.0, 120.0, 300.0, 900.0)
+
+STAGE_LATENCY = Histogram(
+    'service2_stage_latency_seconds',
+    'Latency of hot-path stages',
+    ['stage'],
+    buckets=LATENCY_BUCKETS
+)
+MESSAGES_PER_POLL = Histogram(
+    'service2_messages_per_poll',
+    'Messages returned by each ReceiveMessage call',
+    buckets=tuple(range(0, SQS_MAX_MESSAGES + 1))
+)
+MESSAGES_IN_FLIGHT = Gauge(
+    'service2_messages_in_flight',
+    'Messages received and not yet finished'
+)
+MESSAGES_PROCESSED = Counter(
+    'service2_messages_processed_total',
+    'Messages finished, by result',
+    ['result']
+)
+AWS_ERRORS = Counter(
+    'service2_aws_errors_total',
+    'AWS errors by operation and error code',
+    ['operation', 'code']
+)
+POLL_DELAY = Histogram(
+    'service2_poll_delay_seconds',
+    'Delay chosen by the poll scheduler before the next receive',
+    buckets=(0, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+DUPLICATES_AVOIDED = Counter(
+    'service2_duplicates_avoided_total',
+    'Redelivered messages whose S3 write was skipped, by write mode',
+    ['mode']
+)
+MESSAGES_QUARANTINED = Counter(
+    'service2_messages_quarantined_total',
+    'Poison messages moved out of the queue, by reason',
+    ['reason']
+)
+POLLERS = Gauge(
+    'service2_pollers',
+    'Running SQS poller threads'
+)
+MESSAGE_LATENCY = Histogram(
+    'service2_message_latency_seconds',
+    'Time each message spent per stage between service1 ingest and S3 landing',
+    ['stage'],
+    buckets=MESSAGE_LATENCY_BUCKETS
+)
+MANIFEST_ENTRIES = Counter(
+    'service2_manifest_entries_total',
+    'Message index entries written to S3 manifests or dropped',
+    ['result']
+)
+
+# Spans continue the trace service1 starts (TraceParent attribute); only
+# sampled traces are exported
+tracer = tracing.Tracer('service2')
+
+
+def aws_error_code(error):
+    return error.response.get('Error', {}).get('Code', 'Unknown')
+
+
+sqs_client = aws_clients.LazyClient('sqs', region_name=AWS_REGION, min_pool_connections=AWS_CONNECTIONS)
+s3_client = aws_clients.LazyClient('s3', region_name=AWS_REGION, min_pool_connections=AWS_CONNECTIONS)
+
+
+@STAGE_LATENCY.labels('poll_sqs').time()
+def poll_sqs(max_messages=SQS_MAX_MESSAGES, raise_on_error=False):
     try:
         response = sqs_client.receive_message(
             QueueUrl=SQS_QUEUE_URL,
-            MaxNumberOfMessages=10,
+            MaxNumberOfMessages=max_messages,
             WaitTimeSeconds=20,
-            MessageAttributeNames=['All']
+            MessageAttributeNames=['All'],
+            AttributeNames=['SentTimestamp', 'ApproximateReceiveCount']
         )
         
         messages = response.get('Messages', [])
-        logger.info(f"Received {len(messages)} messages from SQS")
+        received_at = time.time()
+        for message in messages:
+            message['ReceivedAt'] = received_at
+        MESSAGES_PER_POLL.observe(len(messages))
+        structured_logging.log_success(logger, "Received messages from SQS", count=len(messages))
         return messages
         
     except ClientError as e:
+        AWS_ERRORS.labels('ReceiveMessage', aws_error_code(e)).inc()
         logger.error(f"Failed to poll SQS: {e}")
+        if raise_on_error:
+            raise
         return []
 
 
-def upload_to_s3(message_body, message_id):
-    try:
-        data = json.loads(message_body)
-        timestamp = datetime.utcnow().strftime('%Y/%m/%d/%H')
-        file_name = f"{message_id}_{uuid.uuid4().hex[:8]}.json"
-        s3_key = f"messages/{timestamp}/{file_name}"
-        content = {
-            'data': data,
-            'metadata': {
-                'message_id': message_id,
-                'processed_at': datetime.utcnow().isoformat(),
-                'source': 'microservice2'
+def change_visibility_batch(receipt_handles, visibility_timeout):
+    """
+    Set the visibility timeout of receipt_handles with
+    ChangeMessageVisibilityBatch, SQS_BATCH_SIZE at a time. Returns the
+    receipt handles that were changed.
+    """
+    changed = []
+    for start in range(0, len(receipt_handles), SQS_BATCH_SIZE):
+        chunk = receipt_handles[start:start + SQS_BATCH_SIZE]
+        entries = [
+            {
+                'Id': str(index),
+                'ReceiptHandle': receipt_handle,
+                'VisibilityTimeout': visibility_timeout
             }
+            for index, receipt_handle in enumerate(chunk)
+        ]
+        
+        try:
+            response = sqs_client.change_message_visibility_batch(
+                QueueUrl=SQS_QUEUE_URL,
+                Entries=entries
+            )
+        except ClientError as e:
+            AWS_ERRORS.labels('ChangeMessageVisibilityBatch', aws_error_code(e)).inc()
+            logger.error(f"Failed to change message visibility: {e}")
+            continue
+        
+        changed.extend(chunk[int(success['Id'])] for success in response.get('Successful', []))
+        for failure in response.get('Failed', []):
+            AWS_ERRORS.labels('ChangeMessageVisibilityBatch', failure.get('Code', 'Unknown')).inc()
+            logger.error(
+                f"Failed to change message visibility: {failure.get('Code')} - {failure.get('Message')}"
+            )
+    return changed
+
+
+def return_to_queue(receipt_handles):
+    """Make messages visible again now so another worker can pick them up."""
+    if not receipt_handles:
+        return []
+    returned = change_visibility_batch(receipt_handles, 0)
+    logger.info(f"Returned {len(returned)} of {len(receipt_handles)} messages to the queue")
+    return returned
+
+
+def get_queue_depth():
+    response = sqs_client.get_queue_attributes(
+        QueueUrl=SQS_QUEUE_URL,
+        AttributeNames=['ApproximateNumberOfMessages']
+    )
+    return int(response['Attributes']['ApproximateNumberOfMessages'])
+
+
+def desired_poller_count(queue_depth, min_pollers=POLLER_COUNT, max_pollers=MAX_POLLER_COUNT,
+                         messages_per_poller=MESSAGES_PER_POLLER):
+    wanted = math.ceil(queue_depth / max(messages_per_poller, 1))
+    return max(min_pollers, min(max_pollers, wanted), 1)
+
+
+def build_record(data, message_id, trace=None):
+    metadata = {
+        'message_id': message_id,
+        'processed_at': datetime.utcnow().isoformat(),
+        'source': 'microservice2'
+    }
+    if trace is not None:
+        metadata['trace'] = trace.metadata()
+    return {
+        'data': data,
+        'metadata': metadata
+    }
+
+
+@STAGE_LATENCY.labels('claim_check_download').time()
+def fetch_claim_check(bucket, key):
+    try:
+        response = s3_client.get_object(Bucket=bucket, Key=key)
+        return response['Body'].read()
+    except ClientError as e:
+        AWS_ERRORS.labels('GetObject', aws_error_code(e)).inc()
+        logger.error(f"Failed to fetch claim-checked message s3://{bucket}/{key}: {e}")
+        raise
+
+
+class PoisonMessage(Exception):
+    """A message whose payload can never be processed; reason says why."""
+    
+    def __init__(self, reason, error):
+        super().__init__(f"{reason}: {error}")
+        self.reason = reason
+
+
+def resolve_message_body(message):
+    """
+    Return the JSON text of a message, undoing service1's claim-check
+    handling: gzip+base64 bodies are decompressed and S3 pointers
+    (ClaimCheckBucket/ClaimCheckKey attributes) are fetched. Malformed
+    attributes or encodings raise PoisonMessage.
+    """
+    attributes = message.get('MessageAttributes') or {}
+    try:
+        encoding = attributes.get('ContentEncoding', {}).get('StringValue')
+        claim_check = None
+        if 'ClaimCheckKey' in attributes:
+            claim_check = (
+                attributes['ClaimCheckBucket']['StringValue'],
+                attributes['ClaimCheckKey']['StringValue']
+            )
+    except (KeyError, TypeError, AttributeError) as e:
+        raise PoisonMessage('invalid_attributes', e) from e
+    
+    if claim_check:
+        body = fetch_claim_check(*claim_check)
+    elif encoding == 'gzip+base64':
+        body = message['Body']
+    else:
+        return message['Body']
+    
+    try:
+        if not claim_check:
+            body = base64.b64decode(body)
+        if encoding in ('gzip', 'gzip+base64'):
+            body = gzip.decompress(body)
+        return body.decode('utf-8')
+    except (ValueError, EOFError, zlib.error, gzip.BadGzipFile) as e:
+        # ValueError covers bad base64 and UnicodeDecodeError
+        raise PoisonMessage('invalid_encoding', e) from e
+
+
+def parse_message_body(body):
+    try:
+        return json.loads(body)
+    except json.JSONDecodeError as e:
+        logger.error(f"Failed to parse message body as JSON: {e}")
+        raise PoisonMessage('invalid_json', e) from e
+
+
+def record_id(message_id, body):
+    if S3_KEY_STRATEGY == 'content_hash':
+        return hashlib.sha256(body.encode('utf-8')).hexdigest()
+    return message_id
+
+
+def message_sent_at(message):
+    sent_timestamp = message.get('Attributes', {}).get('SentTimestamp')
+    if sent_timestamp:
+        return datetime.utcfromtimestamp(int(sent_timestamp) / 1000)
+    return None
+
+
+def receive_count(message):
+    return int(message.get('Attributes', {}).get('ApproximateReceiveCount', '0'))
+
+
+def epoch_ms(value):
+    return int(value) / 1000 if value else None
+
+
+def isoformat(timestamp):
+    return datetime.utcfromtimestamp(timestamp).isoformat() if timestamp is not None else None
+
+
+class MessageTrace:
+    """
+    Timeline of one message from service1 ingest to S3 landing: the
+    IngestTimestamp and TraceParent attributes set by service1, SQS's
+    SentTimestamp and the time it was received here. Creating one records
+    the ingest and queue dwell stages; upload and delete are recorded as
+    they happen, each as a MESSAGE_LATENCY observation and a span under the
+    message's process span.
+    """
+    
+    def __init__(self, message):
+        attributes = message.get('MessageAttributes') or {}
+        traceparent = attributes.get('TraceParent', {}).get('StringValue')
+        self.ingested_at = epoch_ms(attributes.get('IngestTimestamp', {}).get('StringValue'))
+        self.sent_at = epoch_ms(message.get('Attributes', {}).get('SentTimestamp'))
+        self.received_at = message.get('ReceivedAt') or time.time()
+        self.landed_at = None
+        self.span = tracer.start_span(
+            'SQS process',
+            parent=traceparent,
+            kind='consumer',
+            start_time=self.received_at,
+            attributes={'messaging.message.id': message.get('MessageId', '')}
+        )
+        self.trace_id = self.span.trace_id if traceparent else None
+        
+        if self.ingested_at and self.sent_at:
+            MESSAGE_LATENCY.labels('ingest').observe(max(self.sent_at - self.ingested_at, 0))
+        if self.sent_at:
+            self.record_stage('queue_dwell', self.sent_at, self.received_at, span_name='SQS queue')
+    
+    def record_stage(self, stage, start, end, span_name=None, kind='internal'):
+        """Record a stage that ran from start to end (epoch seconds)."""
+        MESSAGE_LATENCY.labels(stage).observe(max(end - start, 0))
+        if span_name:
+            self.span.tracer.start_span(span_name, parent=self.span, kind=kind, start_time=start).end(end)
+    
+    def landed(self, upload_start, upload_end):
+        self.landed_at = upload_end
+        self.record_stage('upload', upload_start, upload_end, span_name='S3 PutObject', kind='client')
+        if self.ingested_at:
+            MESSAGE_LATENCY.labels('end_to_end').observe(max(upload_end - self.ingested_at, 0))
+    
+    def deleted(self, delete_start, delete_end):
+        self.record_stage('delete', delete_start, delete_end, span_name='SQS DeleteMessage', kind='client')
+    
+    def finish(self, result, error=None):
+        self.span.set_attribute('service2.result', result)
+        if error is not None:
+            self.span.error = str(error)
+        self.span.end()
+    
+    def metadata(self):
+        """Trace block for the stored record; upload and delete are not known yet when it is written."""
+        return {
+            'trace_id': self.trace_id,
+            'ingested_at': isoformat(self.ingested_at),
+            'sent_at': isoformat(self.sent_at),
+            'received_at': isoformat(self.received_at),
+            'queue_dwell_ms': round((self.received_at - self.sent_at) * 1000, 1) if self.sent_at else None
         }
+
+
+def permanent_failure_reason(error):
+    """
+    Return why error means the message can never be processed, or None if
+    the message should be retried. Only PoisonMessage, raised where the
+    payload is decoded and parsed, and a missing claim check are
+    permanent; anything else, including an unexpected KeyError or
+    ValueError from a bug or bad config, goes through the retry and
+    receive-count path.
+    """
+    if isinstance(error, PoisonMessage):
+        return error.reason
+    if isinstance(error, ClientError) and aws_error_code(error) == 'NoSuchKey':
+        return 'missing_claim_check'
+    return None
+
+
+def s3_object_key(record, sent_at=None):
+    # Partitioned by send time so a redelivery maps to the same key
+    return s3_layout.object_key(record, sent_at or datetime.utcnow(), S3_KEY_LAYOUT, S3_KEY_SHARD_CHARS)
+
+
+def message_sender(data):
+    return data.get('email_sender') if isinstance(data, dict) else None
+
+
+class ProcessedMessageCache:
+    """
+    Bounded LRU of record IDs written to S3 in the last ttl_seconds, used to
+    skip the write when SQS redelivers a message that was already stored.
+    """
+    
+    def __init__(self, max_entries=DEDUP_CACHE_SIZE, ttl_seconds=DEDUP_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def seen(self, record):
+        with self._lock:
+            expires_at = self._entries.get(record)
+            if expires_at is None:
+                return False
+            if expires_at <= time.monotonic():
+                del self._entries[record]
+                return False
+            self._entries.move_to_end(record)
+            return True
+    
+    def add(self, record):
+        with self._lock:
+            self._entries[record] = time.monotonic() + self.ttl
+            self._entries.move_to_end(record)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+processed_messages = ProcessedMessageCache()
+
+
+@STAGE_LATENCY.labels('manifest_write').time()
+def write_manifest(hour, entries, prefix=MANIFEST_PREFIX):
+    """Write index entries for the hour partition hour ('YYYY/MM/DD/HH') as one manifest object."""
+    s3_key = s3_layout.manifest_key(hour, prefix)
+    try:
+        s3_client.put_object(
+            Bucket=S3_BUCKET_NAME,
+            Key=s3_key,
+            Body=s3_layout.encode_manifest(entries),
+            ContentType='application/x-ndjson',
+            ContentEncoding='gzip'
+        )
+    except ClientError as e:
+        AWS_ERRORS.labels('PutObject', aws_error_code(e)).inc()
+        logger.error(f"Failed to write manifest for {hour}: {e}")
+        raise
+    
+    logger.info(f"Indexed {len(entries)} messages in s3://{S3_BUCKET_NAME}/{s3_key}")
+    return s3_key
+
+
+class ManifestWriter:
+    """
+    Buffers index entries (message ID, sender, S3 key) by the hour partition
+    of the key and writes each hour's entries as one manifest every
+    flush_seconds, or sooner once max_entries are buffered. Entries whose
+    manifest write fails are kept for the next flush, up to max_buffered;
+    past that they are dropped and counted. The index is best-effort and
+    never holds up a message.
+    """
+    
+    def __init__(self, flush_seconds=MANIFEST_FLUSH_SECONDS, max_entries=MANIFEST_MAX_ENTRIES,
+                 prefix=MANIFEST_PREFIX, max_buffered=None):
+        self.flush_seconds = flush_seconds
+        self.max_entries = max_entries
+        self.max_buffered = max_buffered or max_entries * 10
+        self.prefix = prefix
+        self._hours = {}
+        self._count = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = threading.Event()
+        self._thread = None
+    
+    def _ensure_started(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='manifest-writer', daemon=True)
+            self._thread.start()
+    
+    def add(self, message_id, key, partitioned_at, sender=None, line=None):
+        """Index key for message_id; partitioned_at is the time whose hour appears in key."""
+        entry = {'id': message_id, 'key': key}
+        if sender is not None:
+            entry['sender'] = sender
+        if line is not None:
+            entry['line'] = line
+        
+        with self._lock:
+            self._ensure_started()
+            if self._count >= self.max_buffered:
+                MANIFEST_ENTRIES.labels('dropped').inc()
+                return
+            self._hours.setdefault(s3_layout.hour_path(partitioned_at), []).append(entry)
+            self._count += 1
+            if self._count >= self.max_entries:
+                self._wake.set()
+    
+    def pending(self):
+        with self._lock:
+            return self._count
+    
+    def _run(self):
+        while not self._closed.is_set():
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            self.flush()
+        self.flush()
+    
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                hours = self._hours
+                self._hours = {}
+                self._count = 0
+            
+            for hour, entries in hours.items():
+                try:
+                    write_manifest(hour, entries, self.prefix)
+                except Exception:
+                    self._requeue(hour, entries)
+                    continue
+                MANIFEST_ENTRIES.labels('written').inc(len(entries))
+    
+    def _requeue(self, hour, entries):
+        with self._lock:
+            room = max(self.max_buffered - self._count, 0)
+            if len(entries) > room:
+                MANIFEST_ENTRIES.labels('dropped').inc(len(entries) - room)
+                logger.error(f"Dropped {len(entries) - room} index entries for {hour}")
+                entries = entries[:room]
+            if entries:
+                self._hours.setdefault(hour, [])[:0] = entries
+                self._count += len(entries)
+    
+    def close(self, timeout=None):
+        """
+        Stop the flush thread and write everything still buffered, waiting
+        at most timeout seconds. Returns False if the final write was still
+        running when the timeout expired.
+        """
+        self._closed.set()
+        self._wake.set()
+        with self._lock:
+            thread = self._thread
+        if thread is None:
+            self.flush()
+            return True
+        thread.join(timeout)
+        return not thread.is_alive()
+
+
+manifest_writer = ManifestWriter() if MANIFEST_ENABLED else None
+
+
+@STAGE_LATENCY.labels('upload_to_s3').time()
+def upload_to_s3(message_body, message_id, sent_at=None, record=None, trace=None):
+    try:
+        data = parse_message_body(message_body)
+        sent_at = sent_at or datetime.utcnow()
+        s3_key = s3_object_key(record or message_id, sent_at)
+        content = build_record(data, message_id, trace)
         s3_client.put_object(
             Bucket=S3_BUCKET_NAME,
             Key=s3_key,
@@ -58,81 +640,1147 @@ def upload_to_s3(message_body, message_id):
             ContentType='application/json'
         )
         
-        logger.info(f"Uploaded message to S3: s3://{S3_BUCKET_NAME}/{s3_key}")
+        structured_logging.log_success(
+            logger, "Uploaded message to S3", message_id, uri=f"s3://{S3_BUCKET_NAME}/{s3_key}"
+        )
+        if manifest_writer:
+            manifest_writer.add(message_id, s3_key, sent_at, sender=message_sender(data))
         return s3_key
         
-    except json.JSONDecodeError as e:
-        logger.error(f"Failed to parse message body as JSON: {e}")
-        raise
     except ClientError as e:
+        AWS_ERRORS.labels('PutObject', aws_error_code(e)).inc()
         logger.error(f"Failed to upload to S3: {e}")
         raise
 
 
+@STAGE_LATENCY.labels('delete_message').time()
 def delete_message(receipt_handle):
     try:
         sqs_client.delete_message(
             QueueUrl=SQS_QUEUE_URL,
             ReceiptHandle=receipt_handle
         )
-        logger.info("Message deleted from SQS")
+        structured_logging.log_success(logger, "Message deleted from SQS")
     except ClientError as e:
+        AWS_ERRORS.labels('DeleteMessage', aws_error_code(e)).inc()
         logger.error(f"Failed to delete message from SQS: {e}")
         raise
 
 
+@STAGE_LATENCY.labels('delete_message_batch').time()
+def delete_message_batch(receipt_handles, max_retries=SQS_DELETE_MAX_RETRIES):
+    """
+    Delete receipt handles with DeleteMessageBatch. Entries that fail with a
+    server-side error are retried up to max_retries times; handles that were
+    already deleted are never sent again. Returns a dict mapping each
+    receipt handle to None on success or an error message on failure.
+    """
+    results = {}
+    pending = list(dict.fromkeys(receipt_handles))
+    
+    for attempt in range(max_retries + 1):
+        retry = {}
+        
+        for start in range(0, len(pending), SQS_BATCH_SIZE):
+            chunk = pending[start:start + SQS_BATCH_SIZE]
+            entries = [
+                {'Id': str(index), 'ReceiptHandle': receipt_handle}
+                for index, receipt_handle in enumerate(chunk)
+            ]
+            
+            try:
+                response = sqs_client.delete_message_batch(
+                    QueueUrl=SQS_QUEUE_URL,
+                    Entries=entries
+                )
+            except ClientError as e:
+                AWS_ERRORS.labels('DeleteMessageBatch', aws_error_code(e)).inc()
+                logger.error(f"Failed to delete message batch from SQS: {e}")
+                retry.update((receipt_handle, str(e)) for receipt_handle in chunk)
+                continue
+            
+            for success in response.get('Successful', []):
+                results[chunk[int(success['Id'])]] = None
+            
+            for failure in response.get('Failed', []):
+                receipt_handle = chunk[int(failure['Id'])]
+                error_message = f"{failure.get('Code')}: {failure.get('Message')}"
+                AWS_ERRORS.labels('DeleteMessageBatch', failure.get('Code', 'Unknown')).inc()
+                logger.error(f"Failed to delete message from SQS: {error_message}")
+                if failure.get('SenderFault'):
+                    # e.g. an expired receipt handle; retrying will not help
+                    results[receipt_handle] = error_message
+                else:
+                    retry[receipt_handle] = error_message
+        
+        if not retry:
+            break
+        
+        if attempt < max_retries:
+            logger.warning(f"Retrying delete for {len(retry)} messages (attempt {attempt + 2})")
+            time.sleep(0.1 * (2 ** attempt))
+            pending = list(retry)
+        else:
+            results.update(retry)
+    
+    deleted = sum(1 for error in results.values() if error is None)
+    structured_logging.log_success(logger, "Deleted messages from SQS", deleted=deleted, total=len(results))
+    return results
+
+
+class DeleteBatcher:
+    """
+    Collects receipt handles from concurrent workers and deletes them with
+    delete_message_batch once SQS_BATCH_SIZE handles are queued or the
+    oldest has waited window_ms. Batches are sent by up to senders threads,
+    so one slow or retrying batch does not hold up the ones behind it.
+    delete() blocks until the caller's own handle has been deleted and
+    raises if that entry failed.
+    """
+    
+    def __init__(self, window_ms=SQS_DELETE_BATCH_WINDOW_MS, max_batch_size=SQS_BATCH_SIZE,
+                 senders=SQS_DELETE_SENDERS):
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self.senders = max(senders, 1)
+        self._pending = []
+        self._condition = threading.Condition()
+        self._thread = None
+        self._executor = None
+        self._draining = False
+    
+    thread_name = 'sqs-delete-batcher'
+    
+    def _ensure_started(self):
+        if self._thread is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.senders,
+                thread_name_prefix=f'{self.thread_name}-sender'
+            )
+            self._thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+            self._thread.start()
+    
+    def submit(self, receipt_handle):
+        future = Future()
+        with self._condition:
+            self._ensure_started()
+            self._pending.append((receipt_handle, future, time.monotonic()))
+            if len(self._pending) == 1 or len(self._pending) >= self.max_batch_size:
+                self._condition.notify()
+        return future
+    
+    def delete(self, receipt_handle):
+        self.submit(receipt_handle).result()
+    
+    def drain(self):
+        """Send queued deletes straight away from now on instead of waiting out the window."""
+        with self._condition:
+            self._draining = True
+            self._condition.notify()
+    
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                
+                deadline = self._pending[0][2] + self.window
+                while len(self._pending) < self.max_batch_size and not self._draining:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                
+                batch = self._pending[:self.max_batch_size]
+                del self._pending[:self.max_batch_size]
+            
+            self._executor.submit(self._flush, batch)
+    
+    def _flush(self, batch):
+        try:
+            results = delete_message_batch([receipt_handle for receipt_handle, _, _ in batch])
+        except Exception as e:
+            logger.error(f"Failed to flush delete batch: {e}")
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        
+        for receipt_handle, future, _ in batch:
+            error_message = results.get(receipt_handle, 'No result returned for entry')
+            if error_message is None:
+                future.set_result(None)
+            else:
+                future.set_exception(ClientError(
+                    {'Error': {'Code': 'BatchEntryFailed', 'Message': error_message}},
+                    'DeleteMessageBatch'
+                ))
+
+
+delete_batcher = DeleteBatcher()
+
+
+def quarantine_record(message, reason):
+    return {
+        'message_id': message['MessageId'],
+        'reason': reason,
+        'receive_count': receive_count(message),
+        'quarantined_at': datetime.utcnow().isoformat(),
+        'attributes': message.get('MessageAttributes') or {},
+        'body': message['Body']
+    }
+
+
+@STAGE_LATENCY.labels('quarantine_write').time()
+def write_quarantine_object(items):
+    """
+    Write (message, reason) pairs as one newline-delimited JSON object under
+    QUARANTINE_PREFIX. Returns the receipt handles written.
+    """
+    timestamp = datetime.utcnow().strftime('%Y/%m/%d/%H')
+    s3_key = f"{QUARANTINE_PREFIX}{timestamp}/{uuid.uuid4().hex}.ndjson"
+    body = ''.join(
+        json.dumps(quarantine_record(message, reason), separators=(',', ':')) + '\n'
+        for message, reason in items
+    )
+    
+    try:
+        s3_client.put_object(
+            Bucket=S3_BUCKET_NAME,
+            Key=s3_key,
+            Body=body.encode('utf-8'),
+            ContentType='application/x-ndjson'
+        )
+    except ClientError as e:
+        AWS_ERRORS.labels('PutObject', aws_error_code(e)).inc()
+        logger.error(f"Failed to write quarantine object: {e}")
+        raise
+    
+    logger.warning(f"Quarantined {len(items)} messages to s3://{S3_BUCKET_NAME}/{s3_key}")
+    return [message['ReceiptHandle'] for message, _ in items]
+
+
+@STAGE_LATENCY.labels('quarantine_write').time()
+def send_to_dlq(items):
+    """
+    Send (message, reason) pairs to DLQ_URL with SendMessageBatch, keeping
+    the original body and attributes and adding QuarantineReason. Returns
+    the receipt handles sent.
+    """
+    sent = []
+    for start in range(0, len(items), SQS_BATCH_SIZE):
+        chunk = items[start:start + SQS_BATCH_SIZE]
+        entries = []
+        for index, (message, reason) in enumerate(chunk):
+            attributes = {
+                name: {key: value for key, value in attribute.items()
+                       if key in ('DataType', 'StringValue', 'BinaryValue')}
+                for name, attribute in (message.get('MessageAttributes') or {}).items()
+            }
+            attributes['QuarantineReason'] = {'DataType': 'String', 'StringValue': reason}
+            entries.append({
+                'Id': str(index),
+                'MessageBody': message['Body'],
+                'MessageAttributes': attributes
+            })
+        
+        try:
+            response = sqs_client.send_message_batch(
+                QueueUrl=DLQ_URL,
+                Entries=entries
+            )
+        except ClientError as e:
+            AWS_ERRORS.labels('SendMessageBatch', aws_error_code(e)).inc()
+            logger.error(f"Failed to send messages to the DLQ: {e}")
+            continue
+        
+        sent.extend(chunk[int(success['Id'])][0]['ReceiptHandle'] for success in response.get('Successful', []))
+        for failure in response.get('Failed', []):
+            AWS_ERRORS.labels('SendMessageBatch', failure.get('Code', 'Unknown')).inc()
+            logger.error(f"Failed to send message to the DLQ: {failure.get('Code')} - {failure.get('Message')}")
+    
+    if sent:
+        logger.warning(f"Quarantined {len(sent)} messages to {DLQ_URL}")
+    return sent
+
+
+class QuarantineBatcher(DeleteBatcher):
+    """
+    Moves poison messages out of the queue in bulk. Messages from concurrent
+    workers are collected like DeleteBatcher's receipt handles; each batch is
+    written to S3 (or sent to the DLQ) in one call and the originals are then
+    deleted. quarantine() blocks until the caller's message is handled and
+    returns True if it was stored and deleted.
+    """
+    
+    thread_name = 'sqs-quarantine-batcher'
+    
+    def __init__(self, mode=QUARANTINE_MODE, window_ms=QUARANTINE_BATCH_WINDOW_MS, senders=SQS_DELETE_SENDERS):
+        super().__init__(window_ms=window_ms, senders=senders)
+        self.mode = mode
+    
+    def quarantine(self, message, reason):
+        return self.submit((message, reason)).result()
+    
+    def _flush(self, batch):
+        items = [item for item, _, _ in batch]
+        try:
+            stored = send_to_dlq(items) if self.mode == 'dlq' else write_quarantine_object(items)
+            results = delete_message_batch(stored) if stored else {}
+        except Exception as e:
+            logger.error(f"Failed to quarantine {len(items)} messages: {e}")
+            results = {}
+        
+        for (message, reason), future, _ in batch:
+            quarantined = results.get(message['ReceiptHandle'], 'Not stored') is None
+            if quarantined:
+                MESSAGES_QUARANTINED.labels(reason).inc()
+            future.set_result(quarantined)
+
+
+quarantine_batcher = QuarantineBatcher()
+
+
+def quarantine_message(message, reason):
+    """
+    Move a poison message out of the queue. Returns True if it was; if
+    quarantine is off or fails the message stays for SQS to redeliver.
+    """
+    if QUARANTINE_MODE == 'off':
+        return False
+    logger.warning(f"Quarantining message {message.get('MessageId')}: {reason}")
+    return quarantine_batcher.quarantine(message, reason)
+
+
+def poison_reason(message):
+    """Fast-path check before any work: has this message already failed too often?"""
+    if POISON_MAX_RECEIVES and receive_count(message) > POISON_MAX_RECEIVES:
+        return 'max_receives'
+    return None
+
+
+@STAGE_LATENCY.labels('process_message').time()
 def process_message(message):
     message_id = message['MessageId']
     receipt_handle = message['ReceiptHandle']
-    body = message['Body']
     
-    logger.info(f"Processing message: {message_id}")
+    structured_logging.log_success(logger, "Processing message", message_id)
     
+    reason = poison_reason(message)
+    if reason:
+        quarantine_message(message, reason)
+        return False
+    
+    trace = MessageTrace(message)
     try:
-        # Upload to S3
-        s3_key = upload_to_s3(body, message_id)
+        body = resolve_message_body(message)
+        record = record_id(message_id, body)
+        
+        if processed_messages.seen(record):
+            DUPLICATES_AVOIDED.labels('object').inc()
+            structured_logging.log_success(logger, "Message already stored; skipping S3 write", message_id)
+        else:
+            # Upload to S3
+            start = time.time()
+            upload_to_s3(body, message_id, message_sent_at(message), record, trace=trace)
+            trace.landed(start, time.time())
+            processed_messages.add(record)
         
         # Delete from SQS
-        delete_message(receipt_handle)
+        start = time.time()
+        if SQS_BATCH_DELETES:
+            delete_batcher.delete(receipt_handle)
+        else:
+            delete_message(receipt_handle)
+        trace.deleted(start, time.time())
         
-        logger.info(f"Successfully processed message {message_id}")
+        structured_logging.log_success(logger, "Processed message", message_id)
+        trace.finish('success')
         return True
         
     except Exception as e:
-        logger.error(f"Failed to process message {message_id}: {e}")
+        logger.error(f"Failed to process message {message_id}: {e}", extra={'fields': {'message_id': message_id}})
+        reason = permanent_failure_reason(e)
+        if reason:
+            quarantine_message(message, reason)
+        trace.finish('quarantined' if reason else 'error', e)
         return False
 
 
-def run_worker():
-    logger.info("Starting SQS Worker")
-    logger.info(f"SQS Queue: {SQS_QUEUE_URL}")
-    logger.info(f"S3 Bucket: {S3_BUCKET_NAME}")
-    logger.info(f"Poll Interval: {POLL_INTERVAL}s")
+def segment_key(compress=SEGMENT_GZIP, opened_at=None):
+    opened_at = opened_at or datetime.utcnow()
+    timestamp = s3_layout.hour_path(opened_at)
+    file_name = f"segment_{opened_at.strftime('%Y%m%dT%H%M%S')}_{uuid.uuid4().hex[:8]}.ndjson"
+    if compress:
+        file_name += '.gz'
+    return f"segments/{timestamp}/{file_name}"
+
+
+class SegmentStream:
+    """
+    The body of one segment object. Records are written (and optionally
+    gzip-compressed) incrementally. With multipart enabled, every part_size
+    bytes are sent to S3 as a multipart upload part on a background thread,
+    with at most max_pending_parts parts buffered at once, so memory stays
+    bounded however large the segment grows. Segments that never fill a
+    part are written with a single put_object.
+    """
+    
+    def __init__(self, compress=SEGMENT_GZIP, multipart=SEGMENT_MULTIPART, part_size=SEGMENT_PART_SIZE,
+                 max_pending_parts=SEGMENT_PART_UPLOADERS):
+        self.opened_at = datetime.utcnow()
+        self.key = segment_key(compress, self.opened_at)
+        self.compress = compress
+        self.multipart = multipart
+        # S3 requires every part except the last to be at least 5 MiB
+        self.part_size = max(part_size, S3_MIN_PART_SIZE)
+        self.records = 0
+        self.raw_bytes = 0
+        self.upload_id = None
+        self._compressor = zlib.compressobj(wbits=31) if compress else None
+        self._buffer = bytearray()
+        self._part_number = 0
+        self._part_futures = []
+        self._slots = threading.BoundedSemaphore(max(max_pending_parts, 1))
+        self._executor = None
+        self._max_pending_parts = max(max_pending_parts, 1)
     
-    processed_count = 0
-    error_count = 0
+    def _object_args(self):
+        args = {'ContentType': 'application/x-ndjson'}
+        if self.compress:
+            args['ContentEncoding'] = 'gzip'
+        return args
     
-    while True:
+    def write(self, line):
+        self.records += 1
+        self.raw_bytes += len(line)
+        self._buffer += self._compressor.compress(line) if self._compressor else line
+        
+        if self.multipart and len(self._buffer) >= self.part_size:
+            self._send_part()
+    
+    def _send_part(self):
+        if self.upload_id is None:
+            response = s3_client.create_multipart_upload(
+                Bucket=S3_BUCKET_NAME,
+                Key=self.key,
+                **self._object_args()
+            )
+            self.upload_id = response['UploadId']
+            self._executor = ThreadPoolExecutor(
+                max_workers=self._max_pending_parts,
+                thread_name_prefix='segment-part'
+            )
+        
+        self._part_number += 1
+        body = bytes(self._buffer)
+        self._buffer = bytearray()
+        # Blocks while max_pending_parts parts are still uploading
+        self._slots.acquire()
+        self._part_futures.append(self._executor.submit(self._upload_part, self._part_number, body))
+    
+    def _upload_part(self, part_number, body):
         try:
-            messages = poll_sqs()
-            for message in messages:
-                if process_message(message):
-                    processed_count += 1
-                else:
-                    error_count += 1
-            
-            if processed_count > 0 or error_count > 0:
-                logger.info(f"Stats - Processed: {processed_count}, Errors: {error_count}")
+            response = s3_client.upload_part(
+                Bucket=S3_BUCKET_NAME,
+                Key=self.key,
+                UploadId=self.upload_id,
+                PartNumber=part_number,
+                Body=body
+            )
+            return {'PartNumber': part_number, 'ETag': response['ETag']}
+        finally:
+            self._slots.release()
+    
+    @STAGE_LATENCY.labels('segment_upload').time()
+    def finish(self):
+        """Write the remaining bytes and complete the object. Returns its S3 key."""
+        if self._compressor:
+            self._buffer += self._compressor.flush()
+        
+        try:
+            if self.upload_id is None:
+                s3_client.put_object(
+                    Bucket=S3_BUCKET_NAME,
+                    Key=self.key,
+                    Body=bytes(self._buffer),
+                    **self._object_args()
+                )
+            else:
+                if self._buffer:
+                    self._send_part()
+                parts = [future.result() for future in self._part_futures]
+                s3_client.complete_multipart_upload(
+                    Bucket=S3_BUCKET_NAME,
+                    Key=self.key,
+                    UploadId=self.upload_id,
+                    MultipartUpload={'Parts': parts}
+                )
+        except Exception as e:
+            if isinstance(e, ClientError):
+                AWS_ERRORS.labels('UploadSegment', aws_error_code(e)).inc()
+            logger.error(f"Failed to upload segment to S3: {e}")
+            self.abort()
+            raise
+        finally:
+            self._buffer = bytearray()
+            if self._executor:
+                self._executor.shutdown(wait=True)
+        
+        logger.info(f"Uploaded segment with {self.records} messages to S3: s3://{S3_BUCKET_NAME}/{self.key}")
+        return self.key
+    
+    def abort(self):
+        if self.upload_id is None:
+            return
+        try:
+            s3_client.abort_multipart_upload(
+                Bucket=S3_BUCKET_NAME,
+                Key=self.key,
+                UploadId=self.upload_id
+            )
+            logger.warning(f"Aborted multipart upload for segment s3://{S3_BUCKET_NAME}/{self.key}")
+        except ClientError as e:
+            logger.error(f"Failed to abort multipart upload {self.upload_id}: {e}")
+        self.upload_id = None
+
+
+class SegmentWriter:
+    """
+    Buffers messages as newline-delimited JSON records and writes them to S3
+    as one object per segment. A segment is flushed when it reaches
+    max_bytes or max_messages, or when its oldest message is max_age
+    seconds old. The segment's messages are deleted from SQS only after
+    the object has been written; add() returns a Future that resolves to
+    True once the message's delete succeeded.
+    """
+    
+    def __init__(self, max_bytes=SEGMENT_MAX_BYTES, max_messages=SEGMENT_MAX_MESSAGES,
+                 max_age=SEGMENT_MAX_AGE_SECONDS, compress=SEGMENT_GZIP, uploaders=SEGMENT_UPLOADERS,
+                 multipart=SEGMENT_MULTIPART):
+        self.max_bytes = max_bytes
+        self.max_messages = max_messages
+        self.max_age = max_age
+        self.compress = compress
+        self.multipart = multipart
+        self._lock = threading.Lock()
+        self._stream = None
+        self._entries = []
+        self._opened_at = None
+        self._executor = ThreadPoolExecutor(max_workers=uploaders, thread_name_prefix='segment-uploader')
+        self._closed = threading.Event()
+        self._timer = threading.Thread(target=self._run_timer, name='segment-timer', daemon=True)
+        self._timer.start()
+    
+    def add(self, message):
+        future = Future()
+        message_id = message['MessageId']
+        
+        reason = poison_reason(message)
+        if reason:
+            quarantine_message(message, reason)
+            future.set_result(False)
+            return future
+        
+        try:
+            body = resolve_message_body(message)
+            data = parse_message_body(body)
+        except (PoisonMessage, ClientError, OSError, EOFError, KeyError, ValueError, zlib.error) as e:
+            logger.error(f"Failed to read message {message_id}: {e}")
+            reason = permanent_failure_reason(e)
+            if reason:
+                quarantine_message(message, reason)
+            future.set_result(False)
+            return future
+        
+        trace = MessageTrace(message)
+        record = record_id(message_id, body)
+        if processed_messages.seen(record):
+            DUPLICATES_AVOIDED.labels('segment').inc()
+            structured_logging.log_success(logger, "Message already stored; skipping segment write", message_id)
+            receipt_handle = message['ReceiptHandle']
+            start = time.time()
+            deleted = delete_message_batch([receipt_handle]).get(receipt_handle) is None
+            trace.deleted(start, time.time())
+            trace.finish('success' if deleted else 'error')
+            future.set_result(deleted)
+            return future
+        
+        line = (json.dumps(build_record(data, message_id, trace), separators=(',', ':')) + '\n').encode('utf-8')
+        
+        with self._lock:
+            if self._stream is None:
+                self._stream = SegmentStream(compress=self.compress, multipart=self.multipart)
+                self._opened_at = time.monotonic()
+            try:
+                self._stream.write(line)
+            except Exception as e:
+                logger.error(f"Failed to write message {message_id} to segment: {e}")
+                trace.finish('error')
+                future.set_result(False)
+                return future
+            index = (message_id, message_sender(data), self._stream.records - 1)
+            self._entries.append((message['ReceiptHandle'], future, record, trace, index))
             
-            if not messages:
-                time.sleep(POLL_INTERVAL)
-                
-        except KeyboardInterrupt:
-            logger.info("Shutting down worker...")
-            break
+            segment = None
+            if self._stream.raw_bytes >= self.max_bytes or self._stream.records >= self.max_messages:
+                segment = self._rotate()
+        
+        if segment:
+            self._executor.submit(self._flush, *segment)
+        return future
+    
+    def _rotate(self):
+        segment = (self._stream, self._entries)
+        self._stream = None
+        self._entries = []
+        self._opened_at = None
+        return segment
+    
+    def _run_timer(self):
+        while not self._closed.wait(min(1.0, self.max_age)):
+            with self._lock:
+                segment = None
+                if self._stream and time.monotonic() - self._opened_at >= self.max_age:
+                    segment = self._rotate()
+            if segment:
+                self._executor.submit(self._flush, *segment)
+    
+    def _flush(self, stream, entries):
+        start = time.time()
+        try:
+            stream.finish()
+        except Exception as e:
+            logger.error(f"Failed to write segment of {len(entries)} messages: {e}")
+            for _, future, _, trace, _ in entries:
+                trace.finish('error')
+                future.set_result(False)
+            return
+        uploaded = time.time()
+        
+        for _, _, record, trace, (message_id, sender, line) in entries:
+            processed_messages.add(record)
+            trace.landed(start, uploaded)
+            if manifest_writer:
+                manifest_writer.add(message_id, stream.key, stream.opened_at, sender=sender, line=line)
+        
+        results = delete_message_batch([receipt_handle for receipt_handle, _, _, _, _ in entries])
+        deleted = time.time()
+        for receipt_handle, future, _, trace, _ in entries:
+            success = results.get(receipt_handle, 'No result returned for entry') is None
+            trace.deleted(uploaded, deleted)
+            trace.finish('success' if success else 'error')
+            future.set_result(success)
+    
+    def close(self, wait=True):
+        """Flush the open segment and, if wait, block until all pending uploads finish."""
+        self._closed.set()
+        with self._lock:
+            segment = self._rotate() if self._stream else None
+        if segment:
+            self._executor.submit(self._flush, *segment)
+        self._executor.shutdown(wait=wait)
+
+
+class VisibilityHeartbeat:
+    """
+    Extends the visibility timeout of messages that are still being
+    processed, so a slow upload does not let SQS redeliver the message to
+    another poller. Messages are extended in batches with
+    ChangeMessageVisibilityBatch every interval seconds.
+    """
+    
+    def __init__(self, visibility_timeout=VISIBILITY_TIMEOUT, interval=None):
+        self.visibility_timeout = visibility_timeout
+        self.interval = interval or max(visibility_timeout / 3, 1)
+        self._messages = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+    
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='visibility-heartbeat', daemon=True)
+        self._thread.start()
+    
+    def stop(self, timeout=None):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+    
+    def track(self, receipt_handle):
+        with self._lock:
+            self._messages[receipt_handle] = time.monotonic()
+    
+    def untrack(self, receipt_handle):
+        with self._lock:
+            self._messages.pop(receipt_handle, None)
+    
+    def _run(self):
+        while not self._stop_event.wait(self.interval / 2):
+            try:
+                self.extend_due()
+            except Exception as e:
+                logger.error(f"Unexpected error extending message visibility: {e}")
+    
+    def extend_due(self):
+        now = time.monotonic()
+        with self._lock:
+            due = [
+                receipt_handle for receipt_handle, extended_at in self._messages.items()
+                if now - extended_at >= self.interval
+            ]
+        
+        extended = change_visibility_batch(due, self.visibility_timeout)
+        with self._lock:
+            for receipt_handle in extended:
+                if receipt_handle in self._messages:
+                    self._messages[receipt_handle] = now
+        
+        if due:
+            logger.info(f"Extended visibility of {len(due)} in-flight messages")
+
+
+class MessagePipeline:
+    """
+    Runs process_message on a bounded thread pool so one slow S3 upload does
+    not hold up the rest of a poll. At most max_in_flight messages, with
+    bodies totalling max_in_flight_bytes, are being processed at any time;
+    wait_for_capacity blocks the poller until there is room for more.
+    drain() is the shutdown path: it stops taking work and returns whatever
+    cannot finish in time to the queue.
+    
+    With a segment_writer, messages stay in flight until their segment is
+    written, so both limits are raised to two full segments: one filling
+    while the previous one uploads. A lower limit would cap every segment
+    at max_in_flight messages and leave it to be flushed by age. Only the
+    MessageId and ReceiptHandle are kept while a message waits for its
+    segment, so the bodies are held once, in the segment itself.
+    """
+    
+    def __init__(self, concurrency=WORKER_CONCURRENCY, max_in_flight=MAX_IN_FLIGHT, heartbeat=None,
+                 segment_writer=None, max_in_flight_bytes=MAX_IN_FLIGHT_BYTES):
+        if segment_writer:
+            max_in_flight = max(max_in_flight, 2 * segment_writer.max_messages)
+            max_in_flight_bytes = max(max_in_flight_bytes, 2 * segment_writer.max_bytes)
+        self.max_in_flight = max(max_in_flight, 1)
+        self.max_in_flight_bytes = max_in_flight_bytes
+        self.heartbeat = heartbeat
+        self.segment_writer = segment_writer
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='message-worker')
+        self._condition = threading.Condition()
+        self._in_progress = {}
+        self._returning = []
+        self.in_flight = 0
+        self.in_flight_bytes = 0
+        self.reserved = 0
+        self.processed_count = 0
+        self.error_count = 0
+    
+    def wait_for_capacity(self, timeout=None):
+        """Block until at least one slot is free and return the number of free slots."""
+        with self._condition:
+            self._condition.wait_for(lambda: self._free_slots() > 0, timeout)
+            return self._free_slots()
+    
+    def reserve(self, count, timeout=None):
+        """
+        Reserve up to count slots for messages that are about to be polled,
+        waiting up to timeout for one to become free. Returns the number of
+        slots reserved; unused ones must be handed back with release().
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._free_slots() > 0, timeout):
+                return 0
+            reserved = min(count, self._free_slots())
+            self.reserved += reserved
+            return reserved
+    
+    def release(self, count):
+        if count <= 0:
+            return
+        with self._condition:
+            self.reserved -= count
+            self._condition.notify_all()
+    
+    def _free_slots(self):
+        if self.in_flight_bytes >= self.max_in_flight_bytes:
+            return 0
+        return self.max_in_flight - self.in_flight - self.reserved
+    
+    def submit(self, message, reserved=False):
+        # What stays referenced until the message finishes; the body is not
+        handle = {'MessageId': message.get('MessageId'), 'ReceiptHandle': message.get('ReceiptHandle')}
+        size = len(message.get('Body') or '')
+        with self._condition:
+            if reserved:
+                self.reserved -= 1
+            self.in_flight += 1
+            self.in_flight_bytes += size
+            self._in_progress[id(handle)] = (handle, size)
+        MESSAGES_IN_FLIGHT.inc()
+        if self.heartbeat:
+            self.heartbeat.track(handle['ReceiptHandle'])
+        try:
+            future = self._executor.submit(self._process, message, handle)
+        except RuntimeError:
+            # A poller raced drain(); hand the message straight back
+            if self._finish(handle, 'returned'):
+                return_to_queue([handle['ReceiptHandle']])
+            return
+        future.add_done_callback(lambda done: self._handle_cancelled(handle, done))
+    
+    def _handle_cancelled(self, message, future):
+        # drain() cancelled the message before a worker picked it up
+        if future.cancelled() and self._finish(message, 'returned'):
+            with self._condition:
+                self._returning.append(message['ReceiptHandle'])
+    
+    def _process(self, message, handle):
+        if self.segment_writer:
+            # The message stays in flight until its segment is written and deleted
+            try:
+                future = self.segment_writer.add(message)
+            except Exception as e:
+                logger.error(f"Unexpected error buffering message {handle['MessageId']}: {e}")
+                self._complete(handle, False)
+                return
+            future.add_done_callback(lambda done: self._complete(handle, done.result()))
+            return
+        
+        try:
+            success = process_message(message)
+        except Exception as e:
+            logger.error(f"Unexpected error processing message {handle['MessageId']}: {e}")
+            success = False
+        
+        self._complete(handle, success)
+    
+    def _complete(self, message, success):
+        self._finish(message, 'success' if success else 'error')
+    
+    def _finish(self, message, result):
+        """
+        Take message out of flight with result 'success', 'error' or
+        'returned'. Returns False if it was already finished, e.g. returned
+        to the queue by drain() while still processing.
+        """
+        if self.heartbeat:
+            self.heartbeat.untrack(message['ReceiptHandle'])
+        
+        with self._condition:
+            entry = self._in_progress.pop(id(message), None)
+            if entry is None:
+                return False
+            self.in_flight -= 1
+            self.in_flight_bytes -= entry[1]
+            if result == 'success':
+                self.processed_count += 1
+            elif result == 'error':
+                self.error_count += 1
+            self._condition.notify_all()
+        MESSAGES_IN_FLIGHT.dec()
+        MESSAGES_PROCESSED.labels(result).inc()
+        return True
+    
+    def stats(self):
+        with self._condition:
+            return self.processed_count, self.error_count
+    
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+        if self.segment_writer:
+            self.segment_writer.close()
+    
+    def drain(self, timeout):
+        """
+        Stop taking new work and give in-flight messages up to timeout
+        seconds to finish, flushing the open segment. Messages that never
+        started, and any still running at the deadline, are returned to the
+        queue with visibility 0. Returns the number of messages returned.
+        """
+        deadline = time.monotonic() + timeout
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        if self.segment_writer:
+            self.segment_writer.close(wait=False)
+        
+        with self._condition:
+            self._condition.wait_for(lambda: self.in_flight == 0, max(0, deadline - time.monotonic()))
+            stragglers = [handle for handle, _ in self._in_progress.values()]
+        stragglers = [message for message in stragglers if self._finish(message, 'returned')]
+        if stragglers:
+            logger.warning(f"{len(stragglers)} messages still processing at the shutdown deadline")
+        
+        with self._condition:
+            receipt_handles = self._returning + [message['ReceiptHandle'] for message in stragglers]
+            self._returning = []
+        return len(return_to_queue(receipt_handles))
+
+
+class PollScheduler:
+    """
+    Chooses the delay before a poller's next receive: none while messages
+    are arriving, POLL_INTERVAL after an empty long-poll, and exponential
+    backoff with full jitter after consecutive errors.
+    """
+    
+    def __init__(self, idle_delay=POLL_INTERVAL, backoff_base=POLL_BACKOFF_BASE,
+                 backoff_max=POLL_BACKOFF_MAX):
+        self.idle_delay = idle_delay
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.consecutive_errors = 0
+        self.last_delay = 0.0
+        self.polls = 0
+        self.empty_polls = 0
+        self.error_polls = 0
+        self.total_delay = 0.0
+    
+    def next_delay(self, received, error=False):
+        self.polls += 1
+        if error:
+            self.error_polls += 1
+            self.consecutive_errors += 1
+            ceiling = min(self.backoff_max, self.backoff_base * (2 ** (self.consecutive_errors - 1)))
+            delay = random.uniform(0, ceiling)
+        else:
+            self.consecutive_errors = 0
+            if received:
+                delay = 0.0
+            else:
+                self.empty_polls += 1
+                delay = float(self.idle_delay)
+        
+        self.last_delay = delay
+        self.total_delay += delay
+        POLL_DELAY.observe(delay)
+        return delay
+    
+    def stats(self):
+        return {
+            'polls': self.polls,
+            'empty_polls': self.empty_polls,
+            'error_polls': self.error_polls,
+            'last_delay': self.last_delay,
+            'total_delay': self.total_delay
+        }
+
+
+shutdown_requested = threading.Event()
+
+
+def request_shutdown(signum, frame):
+    logger.info(f"Received {signal.Signals(signum).name}, shutting down worker...")
+    shutdown_requested.set()
+
+
+def run_poller(pipeline, stop_event, scheduler=None):
+    scheduler = scheduler or PollScheduler()
+    
+    while not stop_event.is_set():
+        # Reserve slots before polling so concurrent pollers cannot
+        # receive more messages than MAX_IN_FLIGHT between them
+        reserved = pipeline.reserve(SQS_MAX_MESSAGES, timeout=1)
+        if not reserved:
+            continue
+        
+        messages = []
+        error = False
+        try:
+            messages = poll_sqs(reserved, raise_on_error=True)
+            if shutdown_requested.is_set():
+                # Received after SIGTERM: hand back rather than start work that may not finish
+                return_to_queue([message['ReceiptHandle'] for message in messages])
+                messages = []
+            for message in messages:
+                pipeline.submit(message, reserved=True)
+        except ClientError:
+            error = True
         except Exception as e:
             logger.error(f"Unexpected error in worker loop: {e}")
-            time.sleep(POLL_INTERVAL)
+            error = True
+        finally:
+            pipeline.release(reserved - len(messages))
+        
+        delay = scheduler.next_delay(len(messages), error)
+        
+        processed_count, error_count = pipeline.stats()
+        if processed_count > 0 or error_count > 0:
+            logger.info(
+                f"Stats - Processed: {processed_count}, Errors: {error_count}, "
+                f"In-Flight: {pipeline.in_flight}, Next Poll In: {delay:.2f}s"
+            )
+        
+        if delay > 0:
+            stop_event.wait(delay)
+
+
+class PollerGroup:
+    """
+    Owns the poller threads feeding a MessagePipeline. Each poller has its
+    own stop event and PollScheduler so the group can be resized while
+    running.
+    """
+    
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self._pollers = []
+        self._retired = []
+        self._next_index = 0
+        self._lock = threading.Lock()
+    
+    def size(self):
+        with self._lock:
+            return len(self._pollers)
+    
+    def scale_to(self, count):
+        with self._lock:
+            if count == len(self._pollers):
+                return
+            logger.info(f"Scaling pollers from {len(self._pollers)} to {count}")
+            
+            while len(self._pollers) < count:
+                stop_event = threading.Event()
+                scheduler = PollScheduler()
+                thread = threading.Thread(
+                    target=run_poller,
+                    args=(self.pipeline, stop_event, scheduler),
+                    name=f'sqs-poller-{self._next_index}',
+                    # A poller blocked in a long-poll must not hold the process past the shutdown deadline
+                    daemon=True
+                )
+                self._next_index += 1
+                thread.start()
+                self._pollers.append((thread, stop_event, scheduler))
+            
+            while len(self._pollers) > count:
+                thread, stop_event, scheduler = self._pollers.pop()
+                stop_event.set()
+                self._retired.append(thread)
+            
+            POLLERS.set(len(self._pollers))
+    
+    def is_alive(self):
+        with self._lock:
+            return any(thread.is_alive() for thread, _, _ in self._pollers)
+    
+    def stop(self, timeout=None):
+        """
+        Stop every poller and wait up to timeout seconds (forever if None)
+        for them to exit. Returns True if they all did.
+        """
+        with self._lock:
+            for _, stop_event, _ in self._pollers:
+                stop_event.set()
+            threads = [thread for thread, _, _ in self._pollers] + self._retired
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in threads:
+            thread.join(None if deadline is None else max(0, deadline - time.monotonic()))
+        return not any(thread.is_alive() for thread in threads)
+    
+    def stats(self):
+        with self._lock:
+            poller_stats = [scheduler.stats() for _, _, scheduler in self._pollers]
+        return {
+            'pollers': len(poller_stats),
+            'polls': sum(stats['polls'] for stats in poller_stats),
+            'empty_polls': sum(stats['empty_polls'] for stats in poller_stats),
+            'error_polls': sum(stats['error_polls'] for stats in poller_stats),
+            'poll_delays': [round(stats['last_delay'], 3) for stats in poller_stats]
+        }
+
+
+def autoscale_pollers(pollers):
+    try:
+        queue_depth = get_queue_depth()
+    except (ClientError, KeyError, ValueError) as e:
+        if isinstance(e, ClientError):
+            AWS_ERRORS.labels('GetQueueAttributes', aws_error_code(e)).inc()
+        logger.error(f"Failed to get queue depth: {e}")
+        return
+    
+    pollers.scale_to(desired_poller_count(queue_depth))
+
+
+def shutdown_worker(pollers, pipeline, heartbeat, timeout=SHUTDOWN_TIMEOUT_SECONDS):
+    """
+    Stop the worker within timeout seconds. Polling stops first and queued
+    deletes are sent at once; in-flight messages then get most of the
+    budget to finish, and anything left is made visible again so another
+    worker picks it up now rather than after its visibility timeout. The
+    manifest flush and thread joins after that share whatever time is left
+    before the one deadline.
+    """
+    deadline = time.monotonic() + timeout
+    
+    def remaining(reserve=0):
+        return max(0, deadline - reserve - time.monotonic())
+    
+    shutdown_requested.set()
+    pollers.stop(timeout=0)
+    delete_batcher.drain()
+    
+    # Leave part of the budget for the manifest flush and the thread joins
+    # below so a slow drain cannot push them past the deadline
+    returned = pipeline.drain(remaining(reserve=timeout * SHUTDOWN_TAIL_FRACTION))
+    if manifest_writer and not manifest_writer.close(timeout=remaining()):
+        logger.warning("Manifest flush did not finish before the shutdown deadline")
+    
+    # Pollers still in a long-poll return anything they receive themselves
+    if not pollers.stop(timeout=remaining()):
+        logger.warning("Pollers did not stop before the shutdown deadline")
+    if heartbeat:
+        heartbeat.stop(timeout=remaining())
+    return returned
+
+
+def run_worker():
+    logger.info("Starting SQS Worker")
+    logger.info(f"SQS Queue: {SQS_QUEUE_URL}")
+    logger.info(f"S3 Bucket: {S3_BUCKET_NAME}")
+    logger.info(f"Poll Interval: {POLL_INTERVAL}s, Backoff: {POLL_BACKOFF_BASE}s-{POLL_BACKOFF_MAX}s")
+    logger.info(f"Concurrency: {WORKER_CONCURRENCY}, Max In-Flight: {MAX_IN_FLIGHT}, Pollers: {POLLER_COUNT}")
+    if POLLER_AUTOSCALE:
+        logger.info(f"Poller autoscaling: up to {MAX_POLLER_COUNT} pollers, {MESSAGES_PER_POLLER} messages each")
+    
+    if METRICS_PORT:
+        start_http_server(METRICS_PORT)
+        logger.info(f"Metrics server listening on port {METRICS_PORT}")
+    
+    heartbeat = VisibilityHeartbeat() if VISIBILITY_HEARTBEAT else None
+    if heartbeat:
+        heartbeat.start()
+    
+    segment_writer = None
+    if S3_WRITE_MODE == 'segment':
+        logger.info(
+            f"Segment mode: up to {SEGMENT_MAX_MESSAGES} messages, {SEGMENT_MAX_BYTES} bytes "
+            f"or {SEGMENT_MAX_AGE_SECONDS}s per segment, gzip={SEGMENT_GZIP}"
+        )
+        segment_writer = SegmentWriter()
+    
+    signal.signal(signal.SIGTERM, request_shutdown)
+    signal.signal(signal.SIGINT, request_shutdown)
+    
+    pipeline = MessagePipeline(heartbeat=heartbeat, segment_writer=segment_writer)
+    if pipeline.max_in_flight > MAX_IN_FLIGHT:
+        logger.info(f"Max In-Flight raised to {pipeline.max_in_flight} to fill segments")
+    pollers = PollerGroup(pipeline)
+    pollers.scale_to(max(POLLER_COUNT, 1))
+    last_autoscale = time.monotonic()
+    
+    try:
+        while pollers.is_alive() and not shutdown_requested.wait(1):
+            if POLLER_AUTOSCALE and time.monotonic() - last_autoscale >= AUTOSCALE_INTERVAL:
+                autoscale_pollers(pollers)
+                logger.info(f"Poller stats: {pollers.stats()}")
+                last_autoscale = time.monotonic()
+    finally:
+        returned = shutdown_worker(pollers, pipeline, heartbeat)
+        
+        processed_count, error_count = pipeline.stats()
+        logger.info(
+            f"Worker stopped - Processed: {processed_count}, Errors: {error_count}, "
+            f"Returned to queue: {returned}, Log records dropped: {structured_logging.dropped_records()}"
+        )
 
 
 if __name__ == '__main__':
@@ -140,5 +1788,22 @@ if __name__ == '__main__':
         raise ValueError("SQS_QUEUE_URL environment variable is required")
     if not S3_BUCKET_NAME:
         raise ValueError("S3_BUCKET_NAME environment variable is required")
+    if QUARANTINE_MODE == 'dlq' and not DLQ_URL:
+        raise ValueError("DLQ_URL environment variable is required when QUARANTINE_MODE=dlq")
+    if S3_KEY_LAYOUT not in s3_layout.LAYOUTS:
+        raise ValueError(f"S3_KEY_LAYOUT must be one of {', '.join(s3_layout.LAYOUTS)}")
+    
+    exit_code = 0
+    try:
+        run_worker()
+    except Exception as e:
+        logger.error(f"Worker failed: {e}", exc_info=True)
+        exit_code = 1
     
-    run_worker()
+    # Uploads still running past the drain deadline are on non-daemon pool
+    # threads that interpreter exit would join, long after the stop timeout.
+    # Their messages are already back in the queue, so flush spans and logs
+    # and end the process without waiting for them.
+    tracer.exporter.close()
+    structured_logging.shutdown()
+    os._exit(exit_code)
@@ -0,0 +1,385 @@
+"""
+Compact the per-message JSON objects under messages/ into hourly Parquet
+files for analytics.
+
+For each hour partition in the range, every message object is listed (all
+shard prefixes with S3_KEY_LAYOUT=sharded) and downloaded by a pool of
+threads. Rows are written to Parquet as they arrive:
+
+    {output-prefix}dt=YYYY-MM-DD/hour=HH/part-00000.parquet
+
+Each file has one column per REQUIRED_FIELDS entry, an extra_data column
+for any other fields (as JSON), the metadata service2 adds (message ID,
+processing and trace timestamps) and the source key. Memory stays
+bounded: at most --workers * 4 objects are being downloaded or waiting,
+rows are buffered one row group at a time, a row group is cut at
+--row-group-size rows or --row-group-bytes of field data, whichever comes
+first, and each file is built in a temporary file before it is uploaded.
+
+Progress is checkpointed per hour under {output-prefix}_checkpoints/.
+The checkpoint records the last source key in each uploaded file. An
+interrupted run continues after that key, and part numbers are fixed, so
+a re-run overwrites a half-written file rather than duplicating its rows.
+A completed hour is skipped by later runs, so running this on a schedule
+only compacts new hours. By default the range is the --lookback-hours
+before the last --settle-hours. Messages that land in an hour after it was
+compacted need --force, which rebuilds the hour and removes parts left
+over from the previous run.
+
+Examples:
+    python compact.py --bucket my-bucket
+    python compact.py --bucket my-bucket --start 2025-01-02T00 --end 2025-01-03T00 --workers 32
+    python compact.py --bucket test --endpoint-url http://localhost:9000 --layout sharded --force
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import pyarrow as pa
+import pyarrow.parquet as pq
+from botocore.exceptions import ClientError
+
+# The shared modules sit next to this file in the image and in ../common in the repo
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'common'))
+
+import aws_clients
+import s3_layout
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# The fields service1 requires in every message
+REQUIRED_FIELDS = ['email_subject', 'email_sender', 'email_timestream', 'email_content']
+
+SCHEMA = pa.schema(
+    [pa.field(name, pa.string()) for name in REQUIRED_FIELDS] + [
+        pa.field('extra_data', pa.string()),
+        pa.field('message_id', pa.string()),
+        pa.field('processed_at', pa.timestamp('us')),
+        pa.field('source', pa.string()),
+        pa.field('trace_id', pa.string()),
+        pa.field('ingested_at', pa.timestamp('us')),
+        pa.field('sent_at', pa.timestamp('us')),
+        pa.field('received_at', pa.timestamp('us')),
+        pa.field('queue_dwell_ms', pa.float64()),
+        pa.field('s3_key', pa.string())
+    ]
+)
+
+OUTPUT_PREFIX = 'parquet/messages/'
+ROW_GROUP_BYTES = 64 * 1024 * 1024
+CHECKPOINT_DIR = '_checkpoints/'
+
+
+def parse_timestamp(value):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def field_value(value):
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value, separators=(',', ':'))
+
+
+def to_row(document, key):
+    """Flatten one stored record ({'data', 'metadata'}) into a SCHEMA row."""
+    data = document.get('data')
+    data = data if isinstance(data, dict) else {'data': data}
+    metadata = document.get('metadata') or {}
+    trace = metadata.get('trace') or {}
+    extra = {name: value for name, value in data.items() if name not in REQUIRED_FIELDS}
+
+    row = {name: field_value(data.get(name)) for name in REQUIRED_FIELDS}
+    row.update({
+        'extra_data': json.dumps(extra, separators=(',', ':')) if extra else None,
+        'message_id': metadata.get('message_id'),
+        'processed_at': parse_timestamp(metadata.get('processed_at')),
+        'source': metadata.get('source'),
+        'trace_id': trace.get('trace_id'),
+        'ingested_at': parse_timestamp(trace.get('ingested_at')),
+        'sent_at': parse_timestamp(trace.get('sent_at')),
+        'received_at': parse_timestamp(trace.get('received_at')),
+        'queue_dwell_ms': trace.get('queue_dwell_ms'),
+        's3_key': key
+    })
+    return row
+
+
+def row_size(row):
+    """Approximate bytes of field data in a row: string lengths, 8 bytes for anything else."""
+    return sum(len(value) if isinstance(value, str) else 8 for value in row.values() if value is not None)
+
+
+def hour_keys(client, bucket, prefixes, start_after=None):
+    """Yield the keys under prefixes in key order, starting after start_after."""
+    for prefix in prefixes:
+        if start_after and prefix < start_after and not start_after.startswith(prefix):
+            continue
+        after = start_after if start_after and start_after.startswith(prefix) else None
+        yield from s3_layout.list_keys(client, bucket, prefix, after)
+
+
+def fetch(client, bucket, key):
+    """Return the parsed object at key, or None if it is gone or not valid JSON."""
+    try:
+        body = client.get_object(Bucket=bucket, Key=key)['Body'].read()
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+            logger.warning(f"Skipping {key}: deleted since it was listed")
+            return None
+        raise
+    try:
+        document = json.loads(body)
+    except ValueError as e:
+        logger.warning(f"Skipping {key}: not valid JSON ({e})")
+        return None
+    return document if isinstance(document, dict) else None
+
+
+def fetch_in_order(executor, client, bucket, keys, window):
+    """
+    Yield (key, document) for keys in order, with up to window downloads
+    running or finished but not yet consumed.
+    """
+    pending = deque()
+    for key in keys:
+        pending.append((key, executor.submit(fetch, client, bucket, key)))
+        if len(pending) >= window:
+            key, future = pending.popleft()
+            yield key, future.result()
+    while pending:
+        key, future = pending.popleft()
+        yield key, future.result()
+
+
+class CheckpointStore:
+    """Per-hour progress records, one small JSON object per hour partition."""
+
+    def __init__(self, client, bucket, output_prefix=OUTPUT_PREFIX):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = f'{output_prefix}{CHECKPOINT_DIR}'
+
+    def key(self, hour):
+        return f'{self.prefix}{hour}.json'
+
+    def load(self, hour):
+        try:
+            body = self.client.get_object(Bucket=self.bucket, Key=self.key(hour))['Body'].read()
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                return None
+            raise
+        return json.loads(body)
+
+    def save(self, hour, state):
+        state['updated_at'] = datetime.utcnow().isoformat()
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=self.key(hour),
+            Body=json.dumps(state, indent=2).encode('utf-8'),
+            ContentType='application/json'
+        )
+
+
+class HourCompactor:
+    """
+    Writes one hour partition's messages as Parquet parts of up to
+    rows_per_file rows, each made of row groups of at most row_group_size
+    rows and row_group_bytes of field data. A part is uploaded and
+    checkpointed before the next one starts.
+    """
+
+    def __init__(self, client, bucket, hour, checkpoints, executor, output_prefix=OUTPUT_PREFIX,
+                 layout='hourly', shard_chars=2, window=64, rows_per_file=1000000, row_group_size=50000,
+                 row_group_bytes=ROW_GROUP_BYTES, compression='snappy'):
+        self.client = client
+        self.bucket = bucket
+        self.hour = hour
+        self.checkpoints = checkpoints
+        self.executor = executor
+        self.output_prefix = output_prefix
+        self.prefixes = s3_layout.hour_prefixes(hour, layout, shard_chars)
+        self.window = window
+        self.rows_per_file = rows_per_file
+        self.row_group_size = max(1, min(row_group_size, rows_per_file))
+        self.row_group_bytes = row_group_bytes
+        self.compression = compression
+        year, month, day, hour_of_day = hour.split('/')
+        self.partition = f'{output_prefix}dt={year}-{month}-{day}/hour={hour_of_day}/'
+
+    def part_key(self, number):
+        return f'{self.partition}part-{number:05d}.parquet'
+
+    def run(self, force=False):
+        """Compact the hour, resuming from its checkpoint. Returns the final checkpoint state."""
+        state = self.checkpoints.load(self.hour)
+        if state and state.get('status') == 'complete' and not force:
+            logger.info(f"{self.hour}: already compacted ({state['rows']} rows), skipping")
+            return state
+        previous_parts = [part['key'] for part in state['parts']] if state and force else []
+        if force or not state:
+            state = {'hour': self.hour, 'status': 'in_progress', 'last_key': None, 'rows': 0, 'skipped': 0,
+                     'parts': []}
+        elif state['parts']:
+            logger.info(f"{self.hour}: resuming after {state['last_key']} ({state['rows']} rows done)")
+
+        keys = hour_keys(self.client, self.bucket, self.prefixes, state['last_key'])
+        documents = fetch_in_order(self.executor, self.client, self.bucket, keys, self.window)
+        while self._write_part(state, documents):
+            pass
+
+        state['status'] = 'complete'
+        self.checkpoints.save(self.hour, state)
+        current = {part['key'] for part in state['parts']}
+        for key in previous_parts:
+            if key in current:
+                continue
+            try:
+                self.client.delete_object(Bucket=self.bucket, Key=key)
+            except ClientError as e:
+                logger.warning(f"{self.hour}: could not remove stale part {key}: {e}")
+        logger.info(f"{self.hour}: {state['rows']} rows in {len(state['parts'])} files, {state['skipped']} skipped")
+        return state
+
+    def _write_part(self, state, documents):
+        """Write the next part from documents. Returns False once documents is exhausted."""
+        rows = 0
+        skipped = 0
+        last_key = None
+        exhausted = True
+        buffer = {name: [] for name in SCHEMA.names}
+        buffered_bytes = 0
+
+        with tempfile.TemporaryFile() as output:
+            with pq.ParquetWriter(output, SCHEMA, compression=self.compression) as writer:
+                for key, document in documents:
+                    last_key = key
+                    if document is None:
+                        skipped += 1
+                    else:
+                        row = to_row(document, key)
+                        for name, value in row.items():
+                            buffer[name].append(value)
+                        buffered_bytes += row_size(row)
+                        rows += 1
+                        if len(buffer['s3_key']) >= self.row_group_size or buffered_bytes >= self.row_group_bytes:
+                            writer.write_table(pa.table(buffer, schema=SCHEMA))
+                            buffer = {name: [] for name in SCHEMA.names}
+                            buffered_bytes = 0
+                    if rows >= self.rows_per_file:
+                        exhausted = False
+                        break
+                if buffer['s3_key']:
+                    writer.write_table(pa.table(buffer, schema=SCHEMA))
+
+            if last_key is None:
+                return False
+            if rows:
+                key = self.part_key(len(state['parts']))
+                output.seek(0)
+                self.client.put_object(Bucket=self.bucket, Key=key, Body=output,
+                                       ContentType='application/vnd.apache.parquet')
+                state['parts'].append({'key': key, 'rows': rows})
+
+        state['rows'] += rows
+        state['skipped'] += skipped
+        state['last_key'] = last_key
+        self.checkpoints.save(self.hour, state)
+        return not exhausted
+
+
+def hour_range(start, end):
+    """Hour partitions from start up to, not including, end."""
+    hour = start.replace(minute=0, second=0, microsecond=0)
+    hours = []
+    while hour < end:
+        hours.append(s3_layout.hour_path(hour))
+        hour += timedelta(hours=1)
+    return hours
+
+
+def compact(client, bucket, hours, output_prefix=OUTPUT_PREFIX, workers=16, force=False, **options):
+    """Compact each hour in turn with one shared download pool. Returns the checkpoint state per hour."""
+    checkpoints = CheckpointStore(client, bucket, output_prefix)
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='compact-download') as executor:
+        for hour in hours:
+            compactor = HourCompactor(client, bucket, hour, checkpoints, executor, output_prefix,
+                                      window=workers * 4, **options)
+            results[hour] = compactor.run(force=force)
+    return results
+
+
+def parse_hour(value):
+    return datetime.strptime(value, '%Y-%m-%dT%H')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bucket', default=os.environ.get('S3_BUCKET_NAME'), help='Bucket (default: $S3_BUCKET_NAME)')
+    parser.add_argument('--start', type=parse_hour, help='First hour to compact, YYYY-MM-DDTHH in UTC')
+    parser.add_argument('--end', type=parse_hour, help='Hour to stop before, YYYY-MM-DDTHH in UTC')
+    parser.add_argument('--settle-hours', type=int, default=1,
+                        help='Without --end, leave this many finished hours for late messages')
+    parser.add_argument('--lookback-hours', type=int, default=24, help='Without --start, hours before --end to cover')
+    parser.add_argument('--output-prefix', default=OUTPUT_PREFIX, help='Where Parquet files and checkpoints go')
+    parser.add_argument('--layout', choices=s3_layout.LAYOUTS, default=os.environ.get('S3_KEY_LAYOUT', 'hourly'),
+                        help='S3_KEY_LAYOUT the worker writes with')
+    parser.add_argument('--shard-chars', type=int, default=int(os.environ.get('S3_KEY_SHARD_CHARS', '2')))
+    parser.add_argument('--workers', type=int, default=16, help='Parallel downloads')
+    parser.add_argument('--rows-per-file', type=int, default=1000000)
+    parser.add_argument('--row-group-size', type=int, default=50000)
+    parser.add_argument('--row-group-bytes', type=int, default=ROW_GROUP_BYTES,
+                        help='Cut a row group once its rows hold this many bytes of field data')
+    parser.add_argument('--compression', default='snappy', help='Parquet codec: snappy, zstd, gzip or none')
+    parser.add_argument('--force', action='store_true', help='Rebuild hours that are already compacted')
+    parser.add_argument('--endpoint-url', help='S3-compatible endpoint, e.g. a local MinIO or LocalStack')
+    args = parser.parse_args(argv)
+    if not args.bucket:
+        parser.error('--bucket or S3_BUCKET_NAME is required')
+    if args.end is None:
+        args.end = datetime.utcnow().replace(minute=0, second=0, microsecond=0) - timedelta(hours=args.settle_hours)
+    if args.start is None:
+        args.start = args.end - timedelta(hours=args.lookback_hours)
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    client = aws_clients.create_client(
+        's3',
+        config=aws_clients.client_config(min_pool_connections=args.workers + 2),
+        endpoint_url=args.endpoint_url
+    )
+    results = compact(
+        client,
+        args.bucket,
+        hour_range(args.start, args.end),
+        output_prefix=args.output_prefix,
+        workers=args.workers,
+        force=args.force,
+        layout=args.layout,
+        shard_chars=args.shard_chars,
+        rows_per_file=args.rows_per_file,
+        row_group_size=args.row_group_size,
+        row_group_bytes=args.row_group_bytes,
+        compression=args.compression
+    )
+    print(json.dumps({hour: {'rows': state['rows'], 'files': len(state['parts']), 'skipped': state['skipped']}
+                      for hour, state in results.items()}, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
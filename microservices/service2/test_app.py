@@ -1,4 +1,9 @@
+import gzip
 import json
+import base64
+import logging
+import threading
+import time
 import pytest
 from unittest.mock import patch, MagicMock
 from datetime import datetime
@@ -6,13 +11,69 @@ import sys
 import os
 
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'common'))
 
 os.environ['SQS_QUEUE_URL'] = 'https://sqs.us-east-1.amazonaws.com/123456789/test-queue'
 os.environ['S3_BUCKET_NAME'] = 'test-bucket'
 os.environ['AWS_REGION'] = 'us-east-1'
 os.environ['POLL_INTERVAL'] = '1'
+os.environ['SQS_BATCH_DELETES'] = 'false'
 
-from app import upload_to_s3, process_message, poll_sqs, delete_message
+from app import (
+    upload_to_s3, process_message, poll_sqs, delete_message, delete_message_batch,
+    MessagePipeline, DeleteBatcher, VisibilityHeartbeat, run_poller,
+    PollScheduler, PollerGroup, desired_poller_count, SegmentWriter, SegmentStream, resolve_message_body,
+    ProcessedMessageCache, change_visibility_batch, return_to_queue, shutdown_worker,
+    QuarantineBatcher, permanent_failure_reason, send_to_dlq, ManifestWriter, PoisonMessage,
+    resolve_message_body
+)
+
+
+@pytest.fixture(autouse=True)
+def fresh_dedup_cache():
+    with patch('app.processed_messages', ProcessedMessageCache()):
+        yield
+
+
+@pytest.fixture(autouse=True)
+def mock_quarantine():
+    with patch('app.quarantine_batcher') as batcher:
+        batcher.quarantine.return_value = True
+        yield batcher
+
+
+@pytest.fixture(autouse=True)
+def mock_manifest():
+    with patch('app.manifest_writer') as writer:
+        yield writer
+
+
+class TestClientFactory:
+    def test_clients_are_created_on_first_use(self):
+        import aws_clients
+        with patch.dict(aws_clients._clients, clear=True), patch('aws_clients.boto3') as mock_boto3:
+            lazy = aws_clients.LazyClient('sqs', region_name='us-east-1')
+            mock_boto3.client.assert_not_called()
+            
+            lazy.send_message
+            aws_clients.LazyClient('sqs', region_name='us-east-1').delete_message
+            
+            mock_boto3.client.assert_called_once()
+            assert mock_boto3.client.call_args.args == ('sqs',)
+    
+    def test_config_comes_from_environment_and_pool_minimum(self):
+        import aws_clients
+        options = aws_clients.config_options(min_pool_connections=1000)
+        
+        assert options['max_pool_connections'] == 1000
+        assert aws_clients.config_options()['max_pool_connections'] == aws_clients.AWS_MAX_POOL_CONNECTIONS
+        assert options['retries'] == {'mode': 'adaptive', 'total_max_attempts': aws_clients.AWS_MAX_ATTEMPTS}
+        assert options['tcp_keepalive'] is True
+        assert options['read_timeout'] > 20
+    
+    def test_worker_pool_fits_every_aws_thread(self):
+        import app
+        assert app.sqs_client.min_pool_connections >= app.WORKER_CONCURRENCY + app.MAX_POLLERS
 
 
 class TestPollSQS:
@@ -47,6 +108,36 @@ class TestPollSQS:
         assert messages == []
 
 
+class TestMetrics:
+    @patch('app.sqs_client')
+    def test_poll_records_messages_per_poll(self, mock_sqs):
+        from prometheus_client import REGISTRY
+        before = REGISTRY.get_sample_value('service2_messages_per_poll_count') or 0
+        mock_sqs.receive_message.return_value = {
+            'Messages': [{'MessageId': '1', 'Body': '{}', 'ReceiptHandle': 'a'}]
+        }
+        
+        poll_sqs()
+        
+        assert REGISTRY.get_sample_value('service2_messages_per_poll_count') == before + 1
+        assert REGISTRY.get_sample_value('service2_stage_latency_seconds_count', {'stage': 'poll_sqs'}) >= 1
+    
+    @patch('app.sqs_client')
+    def test_aws_errors_are_counted_by_code(self, mock_sqs):
+        from botocore.exceptions import ClientError
+        from prometheus_client import REGISTRY
+        labels = {'operation': 'ReceiveMessage', 'code': 'ThrottlingException'}
+        before = REGISTRY.get_sample_value('service2_aws_errors_total', labels) or 0
+        mock_sqs.receive_message.side_effect = ClientError(
+            {'Error': {'Code': 'ThrottlingException', 'Message': 'Error'}},
+            'ReceiveMessage'
+        )
+        
+        poll_sqs()
+        
+        assert REGISTRY.get_sample_value('service2_aws_errors_total', labels) == before + 1
+
+
 class TestUploadToS3:
     @patch('app.s3_client')
     def test_upload_success(self, mock_s3):
@@ -79,8 +170,9 @@ class TestUploadToS3:
         assert body['metadata']['source'] == 'microservice2'
     
     def test_upload_invalid_json(self):
-        with pytest.raises(json.JSONDecodeError):
+        with pytest.raises(PoisonMessage) as excinfo:
             upload_to_s3('not valid json', 'msg-123')
+        assert excinfo.value.reason == 'invalid_json'
     
     @patch('app.s3_client')
     def test_upload_s3_error(self, mock_s3):
@@ -115,6 +207,109 @@ class TestDeleteMessage:
             delete_message('receipt-handle-123')
 
 
+class TestDeleteMessageBatch:
+    @patch('app.sqs_client')
+    def test_deletes_in_chunks_of_ten(self, mock_sqs):
+        mock_sqs.delete_message_batch.side_effect = lambda QueueUrl, Entries: {
+            'Successful': [{'Id': e['Id']} for e in Entries]
+        }
+        handles = [f'rh-{i}' for i in range(15)]
+        
+        results = delete_message_batch(handles)
+        
+        assert mock_sqs.delete_message_batch.call_count == 2
+        assert results == {handle: None for handle in handles}
+    
+    @patch('app.time.sleep')
+    @patch('app.sqs_client')
+    def test_retries_only_failed_entries(self, mock_sqs, mock_sleep):
+        mock_sqs.delete_message_batch.side_effect = [
+            {
+                'Successful': [{'Id': '0'}],
+                'Failed': [{'Id': '1', 'Code': 'InternalError', 'Message': 'Error', 'SenderFault': False}]
+            },
+            {'Successful': [{'Id': '0'}]}
+        ]
+        
+        results = delete_message_batch(['rh-0', 'rh-1'])
+        
+        assert results == {'rh-0': None, 'rh-1': None}
+        retry_entries = mock_sqs.delete_message_batch.call_args_list[1].kwargs['Entries']
+        assert retry_entries == [{'Id': '0', 'ReceiptHandle': 'rh-1'}]
+    
+    @patch('app.time.sleep')
+    @patch('app.sqs_client')
+    def test_sender_fault_is_not_retried(self, mock_sqs, mock_sleep):
+        mock_sqs.delete_message_batch.return_value = {
+            'Failed': [{'Id': '0', 'Code': 'ReceiptHandleIsInvalid', 'Message': 'Error', 'SenderFault': True}]
+        }
+        
+        results = delete_message_batch(['rh-0'])
+        
+        assert mock_sqs.delete_message_batch.call_count == 1
+        assert 'ReceiptHandleIsInvalid' in results['rh-0']
+    
+    @patch('app.time.sleep')
+    @patch('app.sqs_client')
+    def test_gives_up_after_max_retries(self, mock_sqs, mock_sleep):
+        from botocore.exceptions import ClientError
+        mock_sqs.delete_message_batch.side_effect = ClientError(
+            {'Error': {'Code': '500', 'Message': 'Error'}},
+            'DeleteMessageBatch'
+        )
+        
+        results = delete_message_batch(['rh-0'], max_retries=2)
+        
+        assert mock_sqs.delete_message_batch.call_count == 3
+        assert results['rh-0'] is not None
+
+
+class TestDeleteBatcher:
+    @patch('app.delete_message_batch')
+    def test_batches_concurrent_deletes(self, mock_delete_batch):
+        mock_delete_batch.side_effect = lambda handles: {handle: None for handle in handles}
+        batcher = DeleteBatcher(window_ms=60000, max_batch_size=3)
+        
+        futures = [batcher.submit(f'rh-{i}') for i in range(3)]
+        
+        for future in futures:
+            future.result(timeout=5)
+        mock_delete_batch.assert_called_once_with(['rh-0', 'rh-1', 'rh-2'])
+    
+    @patch('app.delete_message_batch')
+    def test_failed_entry_raises_for_its_caller(self, mock_delete_batch):
+        from botocore.exceptions import ClientError
+        mock_delete_batch.return_value = {'rh-0': None, 'rh-1': 'InternalError: Error'}
+        batcher = DeleteBatcher(window_ms=60000, max_batch_size=2)
+        
+        first = batcher.submit('rh-0')
+        second = batcher.submit('rh-1')
+        
+        assert first.result(timeout=5) is None
+        with pytest.raises(ClientError):
+            second.result(timeout=5)
+    
+    @patch('app.delete_message_batch')
+    def test_slow_batch_does_not_stall_the_next(self, mock_delete_batch):
+        release = threading.Event()
+        
+        def delete_batch(handles):
+            if handles == ['rh-slow']:
+                release.wait(5)
+            return {handle: None for handle in handles}
+        
+        mock_delete_batch.side_effect = delete_batch
+        batcher = DeleteBatcher(window_ms=60000, max_batch_size=1, senders=2)
+        
+        slow = batcher.submit('rh-slow')
+        fast = batcher.submit('rh-fast')
+        
+        assert fast.result(timeout=5) is None
+        assert not slow.done()
+        release.set()
+        assert slow.result(timeout=5) is None
+
+
 class TestProcessMessage:
     @patch('app.delete_message')
     @patch('app.upload_to_s3')
@@ -166,6 +361,1386 @@ class TestProcessMessage:
         assert result is False
 
 
+class TestResolveMessageBody:
+    def attribute(self, value):
+        return {'StringValue': value, 'DataType': 'String'}
+    
+    def test_plain_body_returned_as_is(self):
+        message = {'Body': '{"test": "data"}', 'MessageAttributes': {'Source': self.attribute('microservice1')}}
+        
+        assert resolve_message_body(message) == '{"test": "data"}'
+    
+    def test_compressed_body_decoded(self):
+        body = base64.b64encode(gzip.compress(b'{"test": "data"}')).decode('ascii')
+        message = {'Body': body, 'MessageAttributes': {'ContentEncoding': self.attribute('gzip+base64')}}
+        
+        assert resolve_message_body(message) == '{"test": "data"}'
+    
+    @patch('app.s3_client')
+    def test_claim_check_fetched_from_s3(self, mock_s3):
+        import io
+        mock_s3.get_object.return_value = {'Body': io.BytesIO(gzip.compress(b'{"test": "data"}'))}
+        message = {
+            'Body': 's3://claim-bucket/claim-checks/abc.json.gz',
+            'MessageAttributes': {
+                'ContentEncoding': self.attribute('gzip'),
+                'ClaimCheckBucket': self.attribute('claim-bucket'),
+                'ClaimCheckKey': self.attribute('claim-checks/abc.json.gz')
+            }
+        }
+        
+        assert resolve_message_body(message) == '{"test": "data"}'
+        mock_s3.get_object.assert_called_once_with(Bucket='claim-bucket', Key='claim-checks/abc.json.gz')
+    
+    @patch('app.delete_message')
+    @patch('app.upload_to_s3')
+    @patch('app.s3_client')
+    def test_missing_claim_check_fails_message(self, mock_s3, mock_upload, mock_delete):
+        from botocore.exceptions import ClientError
+        mock_s3.get_object.side_effect = ClientError(
+            {'Error': {'Code': 'NoSuchKey', 'Message': 'Not found'}},
+            'GetObject'
+        )
+        message = {
+            'MessageId': 'msg-123',
+            'Body': 's3://claim-bucket/missing.json.gz',
+            'ReceiptHandle': 'receipt-123',
+            'MessageAttributes': {
+                'ClaimCheckBucket': self.attribute('claim-bucket'),
+                'ClaimCheckKey': self.attribute('missing.json.gz')
+            }
+        }
+        
+        assert process_message(message) is False
+        mock_upload.assert_not_called()
+        mock_delete.assert_not_called()
+    
+    @patch('app.delete_message')
+    @patch('app.upload_to_s3')
+    def test_process_message_decodes_compressed_body(self, mock_upload, mock_delete):
+        message = {
+            'MessageId': 'msg-123',
+            'Body': base64.b64encode(gzip.compress(b'{"test": "data"}')).decode('ascii'),
+            'ReceiptHandle': 'receipt-123',
+            'MessageAttributes': {'ContentEncoding': self.attribute('gzip+base64')}
+        }
+        
+        assert process_message(message) is True
+        assert mock_upload.call_args.args[:2] == ('{"test": "data"}', 'msg-123')
+
+
+class TestProcessMessageBatchedDeletes:
+    @patch('app.SQS_BATCH_DELETES', True)
+    @patch('app.delete_message')
+    @patch('app.delete_batcher')
+    @patch('app.upload_to_s3')
+    def test_uses_delete_batcher(self, mock_upload, mock_batcher, mock_delete):
+        message = {
+            'MessageId': 'msg-123',
+            'Body': json.dumps({'test': 'data'}),
+            'ReceiptHandle': 'receipt-123'
+        }
+        
+        assert process_message(message) is True
+        mock_batcher.delete.assert_called_once_with('receipt-123')
+        mock_delete.assert_not_called()
+    
+    @patch('app.SQS_BATCH_DELETES', True)
+    @patch('app.delete_batcher')
+    @patch('app.upload_to_s3')
+    def test_failed_batch_delete_counts_as_error(self, mock_upload, mock_batcher):
+        from botocore.exceptions import ClientError
+        mock_batcher.delete.side_effect = ClientError(
+            {'Error': {'Code': 'BatchEntryFailed', 'Message': 'Error'}},
+            'DeleteMessageBatch'
+        )
+        message = {
+            'MessageId': 'msg-123',
+            'Body': json.dumps({'test': 'data'}),
+            'ReceiptHandle': 'receipt-123'
+        }
+        
+        assert process_message(message) is False
+
+
+class TestPoisonMessages:
+    @patch('app.upload_to_s3')
+    def test_invalid_json_is_quarantined_not_retried(self, mock_upload, mock_quarantine):
+        mock_upload.side_effect = PoisonMessage('invalid_json', 'Expecting value')
+        message = {'MessageId': 'a', 'Body': 'not json', 'ReceiptHandle': 'rh-a'}
+        
+        assert process_message(message) is False
+        mock_quarantine.quarantine.assert_called_once_with(message, 'invalid_json')
+    
+    @patch('app.upload_to_s3')
+    def test_transient_s3_error_is_left_for_redelivery(self, mock_upload, mock_quarantine):
+        from botocore.exceptions import ClientError
+        mock_upload.side_effect = ClientError({'Error': {'Code': 'SlowDown', 'Message': 'Slow'}}, 'PutObject')
+        
+        assert process_message({'MessageId': 'a', 'Body': '{}', 'ReceiptHandle': 'rh-a'}) is False
+        mock_quarantine.quarantine.assert_not_called()
+    
+    @patch('app.upload_to_s3')
+    @patch('app.POISON_MAX_RECEIVES', 4)
+    def test_too_many_receives_skips_processing(self, mock_upload, mock_quarantine):
+        message = {
+            'MessageId': 'a', 'Body': '{}', 'ReceiptHandle': 'rh-a',
+            'Attributes': {'ApproximateReceiveCount': '5'}
+        }
+        
+        assert process_message(message) is False
+        mock_upload.assert_not_called()
+        mock_quarantine.quarantine.assert_called_once_with(message, 'max_receives')
+    
+    @patch('app.QUARANTINE_MODE', 'off')
+    @patch('app.upload_to_s3')
+    def test_quarantine_off_leaves_message_to_redrive(self, mock_upload, mock_quarantine):
+        mock_upload.side_effect = PoisonMessage('invalid_json', 'Expecting value')
+        
+        assert process_message({'MessageId': 'a', 'Body': 'not json', 'ReceiptHandle': 'rh-a'}) is False
+        mock_quarantine.quarantine.assert_not_called()
+    
+    def test_classifies_permanent_and_transient_errors(self):
+        from botocore.exceptions import ClientError
+        
+        def client_error(code):
+            return ClientError({'Error': {'Code': code, 'Message': code}}, 'GetObject')
+        
+        assert permanent_failure_reason(PoisonMessage('invalid_json', 'x')) == 'invalid_json'
+        assert permanent_failure_reason(client_error('NoSuchKey')) == 'missing_claim_check'
+        assert permanent_failure_reason(client_error('InternalError')) is None
+        assert permanent_failure_reason(OSError('connection reset')) is None
+        assert permanent_failure_reason(KeyError('S3_BUCKET_NAME')) is None
+        assert permanent_failure_reason(ValueError('bad config')) is None
+    
+    def test_decoding_errors_raise_poison_message(self):
+        def reason(message):
+            with pytest.raises(PoisonMessage) as excinfo:
+                resolve_message_body(message)
+            return excinfo.value.reason
+        
+        gzipped = {'ContentEncoding': {'DataType': 'String', 'StringValue': 'gzip+base64'}}
+        assert reason({'Body': 'not base64!', 'MessageAttributes': gzipped}) == 'invalid_encoding'
+        assert reason({'Body': base64.b64encode(b'not gzip').decode(), 'MessageAttributes': gzipped}) == 'invalid_encoding'
+        assert reason({
+            'Body': base64.b64encode(gzip.compress(b'\xff')).decode(), 'MessageAttributes': gzipped
+        }) == 'invalid_encoding'
+        assert reason({
+            'Body': '', 'MessageAttributes': {'ClaimCheckKey': {'DataType': 'String', 'StringValue': 'k'}}
+        }) == 'invalid_attributes'
+    
+    @patch('app.upload_to_s3')
+    def test_unexpected_key_error_is_retried_not_quarantined(self, mock_upload, mock_quarantine):
+        mock_upload.side_effect = KeyError('S3_BUCKET_NAME')
+        
+        assert process_message({'MessageId': 'a', 'Body': '{}', 'ReceiptHandle': 'rh-a'}) is False
+        mock_quarantine.quarantine.assert_not_called()
+    
+    @patch('app.delete_message_batch')
+    @patch('app.s3_client')
+    def test_batcher_writes_one_object_per_batch(self, mock_s3, mock_delete_batch):
+        mock_delete_batch.side_effect = lambda handles: {handle: None for handle in handles}
+        batcher = QuarantineBatcher(mode='s3', window_ms=200)
+        messages = [
+            {'MessageId': message_id, 'Body': 'bad', 'ReceiptHandle': f'rh-{message_id}'}
+            for message_id in ['a', 'b', 'c']
+        ]
+        
+        results = []
+        threads = [
+            threading.Thread(target=lambda m=m: results.append(batcher.quarantine(m, 'invalid_json')))
+            for m in messages
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        
+        assert results == [True, True, True]
+        mock_s3.put_object.assert_called_once()
+        kwargs = mock_s3.put_object.call_args.kwargs
+        assert kwargs['Key'].startswith('quarantine/')
+        records = [json.loads(line) for line in kwargs['Body'].decode('utf-8').splitlines()]
+        assert sorted(record['message_id'] for record in records) == ['a', 'b', 'c']
+        assert {record['reason'] for record in records} == {'invalid_json'}
+        assert sorted(mock_delete_batch.call_args.args[0]) == ['rh-a', 'rh-b', 'rh-c']
+    
+    @patch('app.delete_message_batch')
+    @patch('app.s3_client')
+    def test_batcher_keeps_messages_when_write_fails(self, mock_s3, mock_delete_batch):
+        from botocore.exceptions import ClientError
+        mock_s3.put_object.side_effect = ClientError({'Error': {'Code': '500', 'Message': 'Error'}}, 'PutObject')
+        batcher = QuarantineBatcher(mode='s3', window_ms=0)
+        
+        assert batcher.quarantine({'MessageId': 'a', 'Body': 'bad', 'ReceiptHandle': 'rh-a'}, 'invalid_json') is False
+        mock_delete_batch.assert_not_called()
+    
+    @patch('app.DLQ_URL', 'https://sqs.us-east-1.amazonaws.com/123456789/test-dlq')
+    @patch('app.sqs_client')
+    def test_send_to_dlq_keeps_body_and_adds_reason(self, mock_sqs):
+        mock_sqs.send_message_batch.return_value = {'Successful': [{'Id': '0'}]}
+        message = {
+            'MessageId': 'a', 'Body': 'bad', 'ReceiptHandle': 'rh-a',
+            'MessageAttributes': {'ContentEncoding': {'DataType': 'String', 'StringValue': 'gzip',
+                                                      'StringListValues': []}}
+        }
+        
+        assert send_to_dlq([(message, 'invalid_encoding')]) == ['rh-a']
+        
+        kwargs = mock_sqs.send_message_batch.call_args.kwargs
+        assert kwargs['QueueUrl'].endswith('test-dlq')
+        assert kwargs['Entries'] == [{
+            'Id': '0',
+            'MessageBody': 'bad',
+            'MessageAttributes': {
+                'ContentEncoding': {'DataType': 'String', 'StringValue': 'gzip'},
+                'QuarantineReason': {'DataType': 'String', 'StringValue': 'invalid_encoding'}
+            }
+        }]
+
+
+class TestMessagePipeline:
+    @patch('app.process_message')
+    def test_stats_count_successes_and_errors(self, mock_process):
+        mock_process.side_effect = lambda message: message['MessageId'] != 'bad'
+        pipeline = MessagePipeline(concurrency=4, max_in_flight=8)
+        
+        for message_id in ['a', 'b', 'bad', 'c']:
+            pipeline.submit({'MessageId': message_id})
+        pipeline.shutdown(wait=True)
+        
+        assert pipeline.stats() == (3, 1)
+        assert pipeline.in_flight == 0
+    
+    @patch('app.process_message')
+    def test_unexpected_exception_counts_as_error(self, mock_process):
+        mock_process.side_effect = RuntimeError('boom')
+        pipeline = MessagePipeline(concurrency=1, max_in_flight=1)
+        
+        pipeline.submit({'MessageId': 'a'})
+        pipeline.shutdown(wait=True)
+        
+        assert pipeline.stats() == (0, 1)
+    
+    @patch('app.process_message')
+    def test_processes_messages_concurrently(self, mock_process):
+        barrier = threading.Barrier(3, timeout=5)
+        mock_process.side_effect = lambda message: barrier.wait() is not None
+        pipeline = MessagePipeline(concurrency=3, max_in_flight=3)
+        
+        for message_id in ['a', 'b', 'c']:
+            pipeline.submit({'MessageId': message_id})
+        pipeline.shutdown(wait=True)
+        
+        assert pipeline.stats() == (3, 0)
+    
+    @patch('app.process_message')
+    def test_backpressure_when_in_flight_limit_reached(self, mock_process):
+        release = threading.Event()
+        mock_process.side_effect = lambda message: release.wait(5)
+        pipeline = MessagePipeline(concurrency=2, max_in_flight=2)
+        
+        assert pipeline.wait_for_capacity(timeout=0.1) == 2
+        pipeline.submit({'MessageId': 'a'})
+        pipeline.submit({'MessageId': 'b'})
+        assert pipeline.wait_for_capacity(timeout=0.1) == 0
+        
+        release.set()
+        assert pipeline.wait_for_capacity(timeout=5) >= 1
+        pipeline.shutdown(wait=True)
+    
+    @patch('app.process_message')
+    def test_backpressure_when_in_flight_bytes_reached(self, mock_process):
+        release = threading.Event()
+        mock_process.side_effect = lambda message: release.wait(5)
+        pipeline = MessagePipeline(concurrency=2, max_in_flight=10, max_in_flight_bytes=100)
+        
+        pipeline.submit(make_message('a', body='x' * 150))
+        assert pipeline.in_flight_bytes == 150
+        assert pipeline.wait_for_capacity(timeout=0.1) == 0
+        
+        release.set()
+        assert pipeline.wait_for_capacity(timeout=5) == 10
+        assert pipeline.in_flight_bytes == 0
+        pipeline.shutdown(wait=True)
+    
+    @patch('app.delete_message_batch')
+    @patch('app.s3_client')
+    def test_segment_mode_keeps_only_ids_of_buffered_messages(self, mock_s3, mock_delete_batch):
+        mock_delete_batch.side_effect = lambda handles: {handle: None for handle in handles}
+        writer = SegmentWriter(max_messages=100, max_bytes=1024 * 1024, max_age=60)
+        pipeline = MessagePipeline(concurrency=1, max_in_flight=5, max_in_flight_bytes=100, segment_writer=writer)
+        
+        assert pipeline.max_in_flight_bytes == 2 * 1024 * 1024
+        pipeline.submit(make_message('a'))
+        for _ in range(500):
+            if len(writer._entries) == 1:
+                break
+            time.sleep(0.01)
+        
+        assert [handle for handle, _ in pipeline._in_progress.values()] == [{'MessageId': 'a', 'ReceiptHandle': 'rh-a'}]
+        pipeline.shutdown(wait=True)
+        assert pipeline.stats() == (1, 0)
+
+
+class TestPipelineReservations:
+    def test_reserve_limits_slots_across_pollers(self):
+        pipeline = MessagePipeline(concurrency=1, max_in_flight=12)
+        
+        assert pipeline.reserve(10) == 10
+        assert pipeline.reserve(10) == 2
+        assert pipeline.reserve(10, timeout=0.1) == 0
+        
+        pipeline.release(5)
+        assert pipeline.wait_for_capacity(timeout=0.1) == 5
+        pipeline.shutdown()
+    
+    @patch('app.process_message')
+    def test_heartbeat_tracks_in_flight_messages(self, mock_process):
+        heartbeat = MagicMock()
+        mock_process.return_value = True
+        pipeline = MessagePipeline(concurrency=1, max_in_flight=1, heartbeat=heartbeat)
+        
+        pipeline.submit({'MessageId': 'a', 'ReceiptHandle': 'rh-a'})
+        pipeline.shutdown(wait=True)
+        
+        heartbeat.track.assert_called_once_with('rh-a')
+        heartbeat.untrack.assert_called_once_with('rh-a')
+
+
+class TestVisibilityHeartbeat:
+    @patch('app.sqs_client')
+    def test_extends_only_messages_due(self, mock_sqs):
+        mock_sqs.change_message_visibility_batch.return_value = {'Successful': [{'Id': '0'}]}
+        heartbeat = VisibilityHeartbeat(visibility_timeout=30, interval=10)
+        heartbeat.track('rh-old')
+        heartbeat.track('rh-new')
+        heartbeat._messages['rh-old'] -= 11
+        
+        heartbeat.extend_due()
+        
+        entries = mock_sqs.change_message_visibility_batch.call_args.kwargs['Entries']
+        assert entries == [{'Id': '0', 'ReceiptHandle': 'rh-old', 'VisibilityTimeout': 30}]
+    
+    @patch('app.sqs_client')
+    def test_untracked_messages_are_not_extended(self, mock_sqs):
+        heartbeat = VisibilityHeartbeat(visibility_timeout=30, interval=10)
+        heartbeat.track('rh-a')
+        heartbeat._messages['rh-a'] -= 11
+        heartbeat.untrack('rh-a')
+        
+        heartbeat.extend_due()
+        
+        mock_sqs.change_message_visibility_batch.assert_not_called()
+
+
+class TestRunPoller:
+    @patch('app.poll_sqs')
+    def test_submits_polled_messages_until_stopped(self, mock_poll):
+        stop_event = threading.Event()
+        pipeline = MagicMock()
+        pipeline.reserve.return_value = 10
+        pipeline.stats.return_value = (0, 0)
+        
+        def poll(max_messages, raise_on_error=False):
+            stop_event.set()
+            return [{'MessageId': 'a', 'ReceiptHandle': 'rh-a'}]
+        mock_poll.side_effect = poll
+        
+        run_poller(pipeline, stop_event)
+        
+        mock_poll.assert_called_once_with(10, raise_on_error=True)
+        pipeline.submit.assert_called_once_with({'MessageId': 'a', 'ReceiptHandle': 'rh-a'}, reserved=True)
+        pipeline.release.assert_called_once_with(9)
+    
+    @patch('app.poll_sqs')
+    def test_backs_off_after_poll_error(self, mock_poll):
+        from botocore.exceptions import ClientError
+        stop_event = threading.Event()
+        pipeline = MagicMock()
+        pipeline.reserve.return_value = 10
+        pipeline.stats.return_value = (0, 0)
+        scheduler = MagicMock()
+        scheduler.next_delay.side_effect = lambda received, error: stop_event.set() or 0
+        mock_poll.side_effect = ClientError(
+            {'Error': {'Code': '500', 'Message': 'Error'}},
+            'ReceiveMessage'
+        )
+        
+        run_poller(pipeline, stop_event, scheduler)
+        
+        scheduler.next_delay.assert_called_once_with(0, True)
+        pipeline.release.assert_called_once_with(10)
+
+
+class TestGracefulShutdown:
+    @patch('app.sqs_client')
+    def test_return_to_queue_sets_visibility_to_zero_in_batches(self, mock_sqs):
+        mock_sqs.change_message_visibility_batch.side_effect = lambda QueueUrl, Entries: {
+            'Successful': [{'Id': entry['Id']} for entry in Entries]
+        }
+        handles = [f'rh-{i}' for i in range(12)]
+        
+        assert return_to_queue(handles) == handles
+        
+        calls = mock_sqs.change_message_visibility_batch.call_args_list
+        assert [len(call.kwargs['Entries']) for call in calls] == [10, 2]
+        assert all(entry['VisibilityTimeout'] == 0 for call in calls for entry in call.kwargs['Entries'])
+    
+    @patch('app.sqs_client')
+    def test_change_visibility_skips_failed_entries(self, mock_sqs):
+        mock_sqs.change_message_visibility_batch.return_value = {
+            'Successful': [{'Id': '1'}],
+            'Failed': [{'Id': '0', 'Code': 'ReceiptHandleIsInvalid', 'Message': 'Gone'}]
+        }
+        
+        assert change_visibility_batch(['rh-a', 'rh-b'], 0) == ['rh-b']
+    
+    @patch('app.return_to_queue')
+    @patch('app.process_message')
+    def test_drain_returns_messages_that_never_started(self, mock_process, mock_return):
+        started = threading.Event()
+        release = threading.Event()
+        mock_process.side_effect = lambda message: started.set() or release.wait(5)
+        mock_return.side_effect = lambda handles: handles
+        pipeline = MessagePipeline(concurrency=1, max_in_flight=3)
+        
+        for message_id in ['a', 'b', 'c']:
+            pipeline.submit({'MessageId': message_id, 'ReceiptHandle': f'rh-{message_id}'})
+        started.wait(5)
+        threading.Timer(0.1, release.set).start()
+        
+        assert pipeline.drain(timeout=5) == 2
+        mock_return.assert_called_once_with(['rh-b', 'rh-c'])
+        assert pipeline.stats() == (1, 0)
+        assert pipeline.in_flight == 0
+    
+    @patch('app.return_to_queue')
+    @patch('app.process_message')
+    def test_drain_returns_messages_still_running_at_deadline(self, mock_process, mock_return):
+        release = threading.Event()
+        mock_process.side_effect = lambda message: release.wait(5)
+        mock_return.side_effect = lambda handles: handles
+        pipeline = MessagePipeline(concurrency=1, max_in_flight=1)
+        
+        pipeline.submit({'MessageId': 'a', 'ReceiptHandle': 'rh-a'})
+        
+        assert pipeline.drain(timeout=0.1) == 1
+        mock_return.assert_called_once_with(['rh-a'])
+        assert pipeline.in_flight == 0
+        
+        # Finishing after being returned must not be counted again
+        release.set()
+        pipeline.shutdown(wait=True)
+        assert pipeline.stats() == (0, 0)
+        assert pipeline.in_flight == 0
+    
+    @patch('app.return_to_queue')
+    @patch('app.delete_message_batch')
+    @patch('app.s3_client')
+    def test_drain_flushes_buffered_segment(self, mock_s3, mock_delete_batch, mock_return):
+        mock_delete_batch.side_effect = lambda handles: {handle: None for handle in handles}
+        mock_return.side_effect = lambda handles: handles
+        writer = SegmentWriter(max_messages=100, max_age=60)
+        pipeline = MessagePipeline(concurrency=2, max_in_flight=10, segment_writer=writer)
+        
+        for message_id in ['a', 'b']:
+            pipeline.submit(make_message(message_id))
+        for _ in range(500):
+            if len(writer._entries) == 2:
+                break
+            time.sleep(0.01)
+        
+        assert pipeline.drain(timeout=5) == 0
+        assert pipeline.stats() == (2, 0)
+        mock_s3.put_object.assert_called_once()
+        mock_delete_batch.assert_called_once_with(['rh-a', 'rh-b'])
+    
+    @patch('app.shutdown_requested')
+    @patch('app.return_to_queue')
+    @patch('app.poll_sqs')
+    def test_poller_returns_messages_received_after_sigterm(self, mock_poll, mock_return, mock_shutdown):
+        stop_event = threading.Event()
+        mock_shutdown.is_set.return_value = True
+        pipeline = MagicMock()
+        pipeline.reserve.return_value = 10
+        pipeline.stats.return_value = (0, 0)
+        
+        def poll(max_messages, raise_on_error=False):
+            stop_event.set()
+            return [{'MessageId': 'a', 'ReceiptHandle': 'rh-a'}]
+        mock_poll.side_effect = poll
+        
+        run_poller(pipeline, stop_event)
+        
+        mock_return.assert_called_once_with(['rh-a'])
+        pipeline.submit.assert_not_called()
+        pipeline.release.assert_called_once_with(10)
+    
+    def test_delete_batcher_drain_skips_the_window(self):
+        batcher = DeleteBatcher(window_ms=60000)
+        batcher.drain()
+        
+        with patch('app.delete_message_batch', return_value={'rh-a': None}) as mock_delete_batch:
+            batcher.submit('rh-a').result(timeout=5)
+        
+        mock_delete_batch.assert_called_once_with(['rh-a'])
+    
+    @patch('app.delete_batcher')
+    @patch('app.shutdown_requested')
+    def test_shutdown_worker_stops_polling_then_drains(self, mock_shutdown, mock_batcher):
+        pollers = MagicMock()
+        pollers.stop.return_value = True
+        pipeline = MagicMock()
+        pipeline.drain.return_value = 3
+        heartbeat = MagicMock()
+        
+        assert shutdown_worker(pollers, pipeline, heartbeat, timeout=10) == 3
+        
+        mock_shutdown.set.assert_called_once()
+        mock_batcher.drain.assert_called_once()
+        assert pollers.stop.call_args_list[0].kwargs == {'timeout': 0}
+        assert 7 < pipeline.drain.call_args.args[0] <= 8
+        heartbeat.stop.assert_called_once()
+    
+    @patch('app.delete_batcher')
+    @patch('app.shutdown_requested')
+    def test_shutdown_worker_gives_later_steps_only_the_time_left(self, mock_shutdown, mock_batcher):
+        clock = [100.0]
+        pollers = MagicMock()
+        pollers.stop.return_value = True
+        pipeline = MagicMock()
+        pipeline.drain.side_effect = lambda timeout: clock.__setitem__(0, clock[0] + timeout) or 0
+        writer = MagicMock()
+        writer.close.side_effect = lambda timeout: clock.__setitem__(0, clock[0] + timeout) or False
+        heartbeat = MagicMock()
+        
+        with patch('app.time.monotonic', side_effect=lambda: clock[0]), \
+             patch('app.manifest_writer', writer):
+            shutdown_worker(pollers, pipeline, heartbeat, timeout=10)
+        
+        pipeline.drain.assert_called_once_with(8)
+        writer.close.assert_called_once_with(timeout=2)
+        assert pollers.stop.call_args.kwargs == {'timeout': 0}
+        heartbeat.stop.assert_called_once_with(timeout=0)
+        assert clock[0] == 110
+
+
+class TestPollScheduler:
+    def test_no_delay_while_messages_arrive(self):
+        scheduler = PollScheduler(idle_delay=5)
+        assert scheduler.next_delay(received=10) == 0
+    
+    def test_idle_delay_after_empty_receive(self):
+        scheduler = PollScheduler(idle_delay=5)
+        assert scheduler.next_delay(received=0) == 5
+        assert scheduler.empty_polls == 1
+    
+    @patch('app.random.uniform', side_effect=lambda low, high: high)
+    def test_exponential_backoff_on_errors(self, mock_uniform):
+        scheduler = PollScheduler(backoff_base=1, backoff_max=5)
+        
+        delays = [scheduler.next_delay(received=0, error=True) for _ in range(5)]
+        
+        assert delays == [1, 2, 4, 5, 5]
+    
+    def test_success_resets_backoff(self):
+        scheduler = PollScheduler(backoff_base=1, backoff_max=5)
+        scheduler.next_delay(received=0, error=True)
+        scheduler.next_delay(received=0, error=True)
+        
+        scheduler.next_delay(received=3)
+        
+        assert scheduler.consecutive_errors == 0
+        assert scheduler.next_delay(received=0, error=True) <= 1
+
+
+class TestPollerScaling:
+    def test_desired_poller_count_is_bounded(self):
+        assert desired_poller_count(0, min_pollers=1, max_pollers=4, messages_per_poller=100) == 1
+        assert desired_poller_count(250, min_pollers=1, max_pollers=4, messages_per_poller=100) == 3
+        assert desired_poller_count(10000, min_pollers=1, max_pollers=4, messages_per_poller=100) == 4
+    
+    @patch('app.run_poller')
+    def test_scale_up_and_down(self, mock_run_poller):
+        stop_events = []
+        mock_run_poller.side_effect = lambda pipeline, stop_event, scheduler: (
+            stop_events.append(stop_event) or stop_event.wait(5)
+        )
+        group = PollerGroup(MagicMock())
+        
+        group.scale_to(3)
+        assert group.size() == 3
+        
+        group.scale_to(1)
+        assert group.size() == 1
+        assert sum(event.is_set() for event in stop_events) == 2
+        
+        group.stop()
+        assert all(event.is_set() for event in stop_events)
+        assert not group.is_alive()
+
+
+def make_message(message_id, body=None):
+    return {
+        'MessageId': message_id,
+        'Body': body if body is not None else json.dumps({'email_subject': message_id}),
+        'ReceiptHandle': f'rh-{message_id}'
+    }
+
+
+class TestSegmentWriter:
+    @patch('app.delete_message_batch')
+    @patch('app.s3_client')
+    def test_flushes_ndjson_segment_when_full(self, mock_s3, mock_delete_batch):
+        mock_delete_batch.side_effect = lambda handles: {handle: None for handle in handles}
+        writer = SegmentWriter(max_messages=3, max_age=60)
+        
+        futures = [writer.add(make_message(str(i))) for i in range(3)]
+        
+        assert [future.result(timeout=5) for future in futures] == [True, True, True]
+        call_args = mock_s3.put_object.call_args.kwargs
+        assert call_args['Key'].startswith('segments/')
+        assert call_args['Key'].endswith('.ndjson')
+        lines = call_args['Body'].decode('utf-8').splitlines()
+        assert [json.loads(line)['metadata']['message_id'] for line in lines] == ['0', '1', '2']
+        mock_delete_batch.assert_called_once_with(['rh-0', 'rh-1', 'rh-2'])
+        writer.close()
+    
+    @patch('app.delete_message_batch')
+    @patch('app.s3_client')
+    def test_gzip_segment(self, mock_s3, mock_delete_batch):
+        mock_delete_batch.side_effect = lambda handles: {handle: None for handle in handles}
+        writer = SegmentWriter(max_messages=1, max_age=60, compress=True)
+        
+        assert writer.add(make_message('a')).result(timeout=5) is True
+        
+        call_args = mock_s3.put_object.call_args.kwargs
+        assert call_args['Key'].endswith('.ndjson.gz')
+        assert call_args['ContentEncoding'] == 'gzip'
+        assert json.loads(gzip.decompress(call_args['Body']))['data'] == {'email_subject': 'a'}
+        writer.close()
+    
+    @patch('app.delete_message_batch')
+    @patch('app.s3_client')
+    def test_flushes_by_age(self, mock_s3, mock_delete_batch):
+        mock_delete_batch.side_effect = lambda handles: {handle: None for handle in handles}
+        writer = SegmentWriter(max_messages=100, max_age=0.1)
+        
+        assert writer.add(make_message('a')).result(timeout=5) is True
+        mock_s3.put_object.assert_called_once()
+        writer.close()
+    
+    @patch('app.delete_message_batch')
+    @patch('app.s3_client')
+    def test_close_flushes_open_segment(self, mock_s3, mock_delete_batch):
+        mock_delete_batch.side_effect = lambda handles: {handle: None for handle in handles}
+        writer = SegmentWriter(max_messages=100, max_age=60)
+        future = writer.add(make_message('a'))
+        
+        writer.close()
+        
+        assert future.result(timeout=0) is True
+    
+    @patch('app.delete_message_batch')
+    @patch('app.s3_client')
+    def test_messages_not_deleted_when_upload_fails(self, mock_s3, mock_delete_batch):
+        from botocore.exceptions import ClientError
+        mock_s3.put_object.side_effect = ClientError(
+            {'Error': {'Code': '500', 'Message': 'Error'}},
+            'PutObject'
+        )
+        writer = SegmentWriter(max_messages=1, max_age=60)
+        
+        assert writer.add(make_message('a')).result(timeout=5) is False
+        mock_delete_batch.assert_not_called()
+        writer.close()
+    
+    @patch('app.s3_client')
+    def test_invalid_json_is_quarantined_immediately(self, mock_s3, mock_quarantine):
+        writer = SegmentWriter(max_messages=1, max_age=60)
+        message = make_message('a', body='not valid json')
+        
+        assert writer.add(message).result(timeout=0) is False
+        writer.close()
+        mock_s3.put_object.assert_not_called()
+        mock_quarantine.quarantine.assert_called_once_with(message, 'invalid_json')
+    
+    @patch('app.delete_message_batch')
+    @patch('app.s3_client')
+    def test_pipeline_counts_segment_results(self, mock_s3, mock_delete_batch):
+        mock_delete_batch.side_effect = lambda handles: {
+            handle: (None if handle != 'rh-b' else 'InternalError: Error') for handle in handles
+        }
+        writer = SegmentWriter(max_messages=100, max_age=60)
+        pipeline = MessagePipeline(concurrency=2, max_in_flight=10, segment_writer=writer)
+        
+        for message_id in ['a', 'b', 'c']:
+            pipeline.submit(make_message(message_id))
+        pipeline.shutdown(wait=True)
+        
+        assert pipeline.stats() == (2, 1)
+        assert pipeline.in_flight == 0
+    
+    @patch('app.delete_message_batch')
+    @patch('app.s3_client')
+    def test_segment_mode_fills_segments_beyond_max_in_flight(self, mock_s3, mock_delete_batch):
+        mock_delete_batch.side_effect = lambda handles: {handle: None for handle in handles}
+        writer = SegmentWriter(max_messages=50, max_age=60)
+        pipeline = MessagePipeline(concurrency=2, max_in_flight=5, segment_writer=writer)
+        
+        assert pipeline.max_in_flight == 100
+        for index in range(50):
+            assert pipeline.wait_for_capacity(timeout=5) > 0
+            pipeline.submit(make_message(str(index)))
+        for _ in range(500):
+            if pipeline.stats() == (50, 0):
+                break
+            time.sleep(0.01)
+        
+        # Filled by size, not flushed by age with max_in_flight messages
+        assert pipeline.stats() == (50, 0)
+        mock_s3.put_object.assert_called_once()
+        pipeline.shutdown(wait=True)
+
+
+class TestSegmentStream:
+    @patch('app.S3_MIN_PART_SIZE', 1)
+    @patch('app.s3_client')
+    def test_small_segment_uses_put_object(self, mock_s3):
+        stream = SegmentStream(compress=False, multipart=True, part_size=1024)
+        stream.write(b'{"a":1}\n')
+        
+        stream.finish()
+        
+        mock_s3.put_object.assert_called_once()
+        mock_s3.create_multipart_upload.assert_not_called()
+    
+    @patch('app.S3_MIN_PART_SIZE', 1)
+    @patch('app.s3_client')
+    def test_large_segment_streams_parts(self, mock_s3):
+        mock_s3.create_multipart_upload.return_value = {'UploadId': 'upload-1'}
+        mock_s3.upload_part.side_effect = lambda **kwargs: {'ETag': f"etag-{kwargs['PartNumber']}"}
+        stream = SegmentStream(compress=False, multipart=True, part_size=10, max_pending_parts=2)
+        
+        for _ in range(5):
+            stream.write(b'0123456789\n')
+        stream.finish()
+        
+        assert mock_s3.upload_part.call_count == 5
+        body = b''.join(
+            c.kwargs['Body'] for c in sorted(mock_s3.upload_part.call_args_list, key=lambda c: c.kwargs['PartNumber'])
+        )
+        assert body == b'0123456789\n' * 5
+        parts = mock_s3.complete_multipart_upload.call_args.kwargs['MultipartUpload']['Parts']
+        assert [part['PartNumber'] for part in parts] == [1, 2, 3, 4, 5]
+        mock_s3.put_object.assert_not_called()
+    
+    @patch('app.S3_MIN_PART_SIZE', 1)
+    @patch('app.s3_client')
+    def test_gzip_parts_form_one_gzip_stream(self, mock_s3):
+        mock_s3.create_multipart_upload.return_value = {'UploadId': 'upload-1'}
+        mock_s3.upload_part.side_effect = lambda **kwargs: {'ETag': 'etag'}
+        stream = SegmentStream(compress=True, multipart=True, part_size=1024)
+        lines = [json.dumps({'n': os.urandom(16).hex()}).encode() + b'\n' for _ in range(2000)]
+        
+        for line in lines:
+            stream.write(line)
+        stream.finish()
+        
+        body = b''.join(
+            c.kwargs['Body'] for c in sorted(mock_s3.upload_part.call_args_list, key=lambda c: c.kwargs['PartNumber'])
+        )
+        assert mock_s3.upload_part.call_count > 1
+        assert gzip.decompress(body) == b''.join(lines)
+    
+    @patch('app.S3_MIN_PART_SIZE', 1)
+    @patch('app.s3_client')
+    def test_failed_part_aborts_upload(self, mock_s3):
+        from botocore.exceptions import ClientError
+        mock_s3.create_multipart_upload.return_value = {'UploadId': 'upload-1'}
+        mock_s3.upload_part.side_effect = ClientError(
+            {'Error': {'Code': '500', 'Message': 'Error'}},
+            'UploadPart'
+        )
+        stream = SegmentStream(compress=False, multipart=True, part_size=4)
+        stream.write(b'0123456789\n')
+        
+        with pytest.raises(ClientError):
+            stream.finish()
+        
+        mock_s3.abort_multipart_upload.assert_called_once_with(
+            Bucket='test-bucket', Key=stream.key, UploadId='upload-1'
+        )
+        mock_s3.complete_multipart_upload.assert_not_called()
+
+
+class TestIdempotentWrites:
+    def duplicates_avoided(self, mode):
+        from prometheus_client import REGISTRY
+        return REGISTRY.get_sample_value('service2_duplicates_avoided_total', {'mode': mode}) or 0
+    
+    @patch('app.s3_client')
+    def test_redelivered_message_gets_same_key(self, mock_s3):
+        sent_at = datetime(2025, 1, 2, 3, 4, 5)
+        
+        first = upload_to_s3('{"test": "data"}', 'msg-123', sent_at)
+        second = upload_to_s3('{"test": "data"}', 'msg-123', sent_at)
+        
+        assert first == second == 'messages/2025/01/02/03/msg-123.json'
+    
+    def test_sent_timestamp_used_for_partition(self):
+        from app import message_sent_at
+        message = {'Attributes': {'SentTimestamp': '1735787045000'}}
+        
+        assert message_sent_at(message) == datetime(2025, 1, 2, 3, 4, 5)
+        assert message_sent_at({}) is None
+    
+    @patch('app.S3_KEY_STRATEGY', 'content_hash')
+    def test_content_hash_record_id(self):
+        from app import record_id
+        
+        assert record_id('msg-1', '{"a": 1}') == record_id('msg-2', '{"a": 1}')
+        assert record_id('msg-1', '{"a": 1}') != record_id('msg-1', '{"a": 2}')
+    
+    @patch('app.delete_message')
+    @patch('app.upload_to_s3')
+    def test_duplicate_skips_upload_but_deletes(self, mock_upload, mock_delete):
+        before = self.duplicates_avoided('object')
+        message = make_message('msg-123')
+        
+        assert process_message(message) is True
+        assert process_message(message) is True
+        
+        mock_upload.assert_called_once()
+        assert mock_delete.call_count == 2
+        assert self.duplicates_avoided('object') == before + 1
+    
+    @patch('app.delete_message')
+    @patch('app.upload_to_s3')
+    def test_failed_upload_not_remembered(self, mock_upload, mock_delete):
+        mock_upload.side_effect = [Exception('Upload failed'), 'messages/key.json']
+        message = make_message('msg-123')
+        
+        assert process_message(message) is False
+        assert process_message(message) is True
+        
+        assert mock_upload.call_count == 2
+    
+    @patch('app.delete_message_batch')
+    @patch('app.s3_client')
+    def test_segment_duplicate_deleted_without_write(self, mock_s3, mock_delete_batch):
+        mock_delete_batch.side_effect = lambda handles: {handle: None for handle in handles}
+        before = self.duplicates_avoided('segment')
+        writer = SegmentWriter(max_messages=1, max_age=60)
+        
+        assert writer.add(make_message('a')).result(timeout=5) is True
+        assert writer.add(make_message('a')).result(timeout=5) is True
+        
+        mock_s3.put_object.assert_called_once()
+        assert mock_delete_batch.call_count == 2
+        assert self.duplicates_avoided('segment') == before + 1
+        writer.close()
+    
+    @patch('app.time.monotonic')
+    def test_cache_expires_and_is_bounded(self, mock_monotonic):
+        mock_monotonic.return_value = 100.0
+        cache = ProcessedMessageCache(max_entries=2, ttl_seconds=10)
+        cache.add('a')
+        cache.add('b')
+        cache.add('c')
+        
+        assert len(cache) == 2
+        assert cache.seen('a') is False
+        assert cache.seen('c') is True
+        
+        mock_monotonic.return_value = 111.0
+        
+        assert cache.seen('c') is False
+
+
+class TestMessageTrace:
+    TRACE_ID = '4bf92f3577b34da6a3ce929d0e0e4736'
+    
+    def traced_message(self, message_id='msg-123', ingested_at=1700000000.0, dwell=2.5):
+        message = make_message(message_id)
+        message['MessageAttributes'] = {
+            'Source': {'StringValue': 'microservice1', 'DataType': 'String'},
+            'IngestTimestamp': {'StringValue': str(int(ingested_at * 1000)), 'DataType': 'Number'},
+            'TraceParent': {'StringValue': f'00-{self.TRACE_ID}-00f067aa0ba902b7-01', 'DataType': 'String'}
+        }
+        message['Attributes'] = {'SentTimestamp': str(int((ingested_at + 0.1) * 1000))}
+        message['ReceivedAt'] = ingested_at + 0.1 + dwell
+        return message
+    
+    @pytest.fixture
+    def exporter(self):
+        import tracing
+        exporter = MagicMock()
+        with patch('app.tracer', tracing.Tracer('service2', sample_rate=0.0, exporter=exporter)):
+            yield exporter
+    
+    def exported(self, exporter):
+        return {span.name: span for span in (c.args[0] for c in exporter.export.call_args_list)}
+    
+    @patch('app.sqs_client')
+    def test_poll_stamps_receive_time(self, mock_sqs):
+        mock_sqs.receive_message.return_value = {
+            'Messages': [{'MessageId': '1', 'Body': '{}', 'ReceiptHandle': 'a'}]
+        }
+        
+        before = time.time()
+        messages = poll_sqs()
+        
+        assert before <= messages[0]['ReceivedAt'] <= time.time()
+    
+    @patch('app.delete_message')
+    @patch('app.s3_client')
+    def test_record_metadata_carries_trace(self, mock_s3, mock_delete, exporter):
+        assert process_message(self.traced_message()) is True
+        
+        trace = json.loads(mock_s3.put_object.call_args.kwargs['Body'])['metadata']['trace']
+        assert trace['trace_id'] == self.TRACE_ID
+        assert trace['ingested_at'] == '2023-11-14T22:13:20'
+        assert trace['sent_at'] == '2023-11-14T22:13:20.100000'
+        assert trace['queue_dwell_ms'] == 2500.0
+    
+    @patch('app.delete_message')
+    @patch('app.s3_client')
+    def test_stages_recorded_as_metrics(self, mock_s3, mock_delete, exporter):
+        from prometheus_client import REGISTRY
+        stages = ('ingest', 'queue_dwell', 'upload', 'delete', 'end_to_end')
+        
+        def counts():
+            return {
+                stage: REGISTRY.get_sample_value('service2_message_latency_seconds_count', {'stage': stage}) or 0
+                for stage in stages
+            }
+        before = counts()
+        dwell_before = REGISTRY.get_sample_value(
+            'service2_message_latency_seconds_sum', {'stage': 'queue_dwell'}
+        ) or 0
+        
+        process_message(self.traced_message())
+        
+        assert counts() == {stage: count + 1 for stage, count in before.items()}
+        dwell = REGISTRY.get_sample_value('service2_message_latency_seconds_sum', {'stage': 'queue_dwell'})
+        assert dwell - dwell_before == pytest.approx(2.5, abs=0.01)
+    
+    @patch('app.delete_message')
+    @patch('app.s3_client')
+    def test_sampled_trace_exports_stage_spans(self, mock_s3, mock_delete, exporter):
+        process_message(self.traced_message())
+        
+        spans = self.exported(exporter)
+        assert set(spans) == {'SQS process', 'SQS queue', 'S3 PutObject', 'SQS DeleteMessage'}
+        process = spans['SQS process']
+        assert process.trace_id == self.TRACE_ID
+        assert process.parent_id == '00f067aa0ba902b7'
+        assert process.attributes['service2.result'] == 'success'
+        assert all(span.parent_id == process.span_id for name, span in spans.items() if name != 'SQS process')
+        assert spans['SQS queue'].end_time - spans['SQS queue'].start_time == pytest.approx(2.5)
+    
+    @patch('app.delete_message')
+    @patch('app.s3_client')
+    def test_untraced_message_is_processed_without_trace_id(self, mock_s3, mock_delete, exporter):
+        assert process_message(make_message('plain')) is True
+        
+        trace = json.loads(mock_s3.put_object.call_args.kwargs['Body'])['metadata']['trace']
+        assert trace['trace_id'] is None
+        assert trace['queue_dwell_ms'] is None
+        exporter.export.assert_not_called()
+    
+    @patch('app.delete_message_batch')
+    @patch('app.s3_client')
+    def test_segment_records_carry_trace(self, mock_s3, mock_delete_batch, exporter):
+        mock_delete_batch.side_effect = lambda handles: {handle: None for handle in handles}
+        writer = SegmentWriter(max_messages=2, max_age=60)
+        
+        futures = [writer.add(self.traced_message(str(i))) for i in range(2)]
+        
+        assert [future.result(timeout=5) for future in futures] == [True, True]
+        lines = mock_s3.put_object.call_args.kwargs['Body'].decode('utf-8').splitlines()
+        assert [json.loads(line)['metadata']['trace']['trace_id'] for line in lines] == [self.TRACE_ID] * 2
+        processes = [c.args[0] for c in exporter.export.call_args_list if c.args[0].name == 'SQS process']
+        assert [span.attributes['service2.result'] for span in processes] == ['success', 'success']
+        writer.close()
+
+
+class TestMessageIndex:
+    def test_sharded_layout_puts_hash_shard_before_hour(self):
+        import s3_layout
+        sent_at = datetime(2025, 1, 2, 3, 4, 5)
+        
+        key = s3_layout.object_key('msg-123', sent_at, layout='sharded', shard_chars=2)
+        
+        shard = s3_layout.key_shard('msg-123', 2)
+        assert len(shard) == 2
+        assert key == f'messages/{shard}/2025/01/02/03/msg-123.json'
+        assert s3_layout.object_key('msg-123', sent_at, layout='sharded', shard_chars=2) == key
+    
+    def test_sharded_layout_spreads_records_over_prefixes(self):
+        import s3_layout
+        shards = {s3_layout.key_shard(f'msg-{i}', 1) for i in range(500)}
+        
+        assert len(shards) == 16
+    
+    @patch('app.S3_KEY_LAYOUT', 'sharded')
+    @patch('app.s3_client')
+    def test_upload_uses_configured_layout_and_indexes_sender(self, mock_s3, mock_manifest):
+        sent_at = datetime(2025, 1, 2, 3, 4, 5)
+        
+        key = upload_to_s3(json.dumps({'email_sender': 'john@example.com'}), 'msg-123', sent_at)
+        
+        assert len(key.split('/')) == 7
+        assert mock_s3.put_object.call_args.kwargs['Key'] == key
+        mock_manifest.add.assert_called_once_with('msg-123', key, sent_at, sender='john@example.com')
+    
+    @patch('app.s3_client')
+    def test_failed_upload_is_not_indexed(self, mock_s3, mock_manifest):
+        from botocore.exceptions import ClientError
+        mock_s3.put_object.side_effect = ClientError({'Error': {'Code': '500', 'Message': 'Error'}}, 'PutObject')
+        
+        with pytest.raises(ClientError):
+            upload_to_s3('{"email_sender": "john"}', 'msg-123')
+        mock_manifest.add.assert_not_called()
+    
+    @patch('app.s3_client')
+    def test_flush_writes_one_sorted_manifest_per_hour(self, mock_s3):
+        import s3_layout
+        writer = ManifestWriter(flush_seconds=60, max_entries=100)
+        writer.add('b', 'messages/2025/01/02/03/b.json', datetime(2025, 1, 2, 3, 10), sender='bob')
+        writer.add('a', 'messages/2025/01/02/03/a.json', datetime(2025, 1, 2, 3, 50), sender='alice')
+        writer.add('c', 'messages/2025/01/02/04/c.json', datetime(2025, 1, 2, 4, 0))
+        
+        writer.close()
+        
+        assert mock_s3.put_object.call_count == 2
+        manifests = {
+            call.kwargs['Key'].rsplit('/', 1)[0]: s3_layout.decode_manifest(call.kwargs['Body'])
+            for call in mock_s3.put_object.call_args_list
+        }
+        assert manifests['index/2025/01/02/03'] == [
+            {'id': 'a', 'key': 'messages/2025/01/02/03/a.json', 'sender': 'alice'},
+            {'id': 'b', 'key': 'messages/2025/01/02/03/b.json', 'sender': 'bob'}
+        ]
+        assert manifests['index/2025/01/02/04'] == [{'id': 'c', 'key': 'messages/2025/01/02/04/c.json'}]
+        assert writer.pending() == 0
+    
+    @patch('app.s3_client')
+    def test_flushes_early_when_max_entries_buffered(self, mock_s3):
+        writer = ManifestWriter(flush_seconds=60, max_entries=2)
+        writer.add('a', 'messages/a.json', datetime(2025, 1, 2, 3))
+        writer.add('b', 'messages/b.json', datetime(2025, 1, 2, 3))
+        
+        deadline = time.monotonic() + 5
+        while writer.pending() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        
+        mock_s3.put_object.assert_called_once()
+        writer.close()
+    
+    @patch('app.write_manifest')
+    def test_close_returns_after_timeout_when_write_hangs(self, mock_write):
+        release = threading.Event()
+        mock_write.side_effect = lambda *args: release.wait(5)
+        writer = ManifestWriter(flush_seconds=60, max_entries=100)
+        writer.add('a', 'messages/a.json', datetime(2025, 1, 2, 3))
+        
+        started = time.monotonic()
+        assert writer.close(timeout=0.2) is False
+        assert time.monotonic() - started < 2
+        release.set()
+    
+    @patch('app.write_manifest')
+    def test_failed_manifest_is_retried_and_overflow_dropped(self, mock_write):
+        mock_write.side_effect = Exception('S3 down')
+        writer = ManifestWriter(flush_seconds=60, max_entries=10, max_buffered=3)
+        for message_id in ['a', 'b']:
+            writer.add(message_id, f'messages/{message_id}.json', datetime(2025, 1, 2, 3))
+        
+        writer.flush()
+        assert writer.pending() == 2
+        writer.add('c', 'messages/c.json', datetime(2025, 1, 2, 3))
+        writer.add('d', 'messages/d.json', datetime(2025, 1, 2, 3))
+        assert writer.pending() == 3
+        
+        mock_write.side_effect = None
+        writer.close()
+        entries = mock_write.call_args.args[1]
+        assert [entry['id'] for entry in entries] == ['a', 'b', 'c']
+    
+    @patch('app.delete_message_batch')
+    @patch('app.s3_client')
+    def test_segment_entries_point_at_segment_line(self, mock_s3, mock_delete_batch, mock_manifest):
+        mock_delete_batch.side_effect = lambda handles: {handle: None for handle in handles}
+        writer = SegmentWriter(max_messages=2, max_age=60)
+        
+        futures = [writer.add(make_message(message_id)) for message_id in ['a', 'b']]
+        
+        assert [future.result(timeout=5) for future in futures] == [True, True]
+        key = mock_s3.put_object.call_args.kwargs['Key']
+        calls = [(call.args[0], call.args[1], call.kwargs['line']) for call in mock_manifest.add.call_args_list]
+        assert calls == [('a', key, 0), ('b', key, 1)]
+        assert key.startswith(f"segments/{mock_manifest.add.call_args.args[2].strftime('%Y/%m/%d/%H')}/")
+        writer.close()
+    
+    def test_search_reads_only_manifests_for_the_hours_given(self):
+        import s3_layout
+        s3 = MagicMock()
+        manifest = s3_layout.encode_manifest([
+            {'id': 'a', 'key': 'messages/ab/2025/01/02/03/a.json', 'sender': 'alice'},
+            {'id': 'b', 'key': 'messages/cd/2025/01/02/03/b.json', 'sender': 'bob'}
+        ])
+        s3.list_objects_v2.return_value = {'Contents': [{'Key': 'index/2025/01/02/03/manifest_1.ndjson.gz'}]}
+        s3.get_object.return_value = {'Body': MagicMock(read=MagicMock(return_value=manifest))}
+        
+        found = list(s3_layout.search_manifests(s3, 'bucket', ['2025/01/02/03'], message_id='b'))
+        by_sender = list(s3_layout.search_manifests(s3, 'bucket', ['2025/01/02/03'], sender='alice'))
+        
+        assert found == [{'id': 'b', 'key': 'messages/cd/2025/01/02/03/b.json', 'sender': 'bob'}]
+        assert [entry['id'] for entry in by_sender] == ['a']
+        assert s3.list_objects_v2.call_args.kwargs['Prefix'] == 'index/2025/01/02/03/'
+    
+    def test_hours_back_lists_newest_first(self):
+        import s3_layout
+        
+        assert s3_layout.hours_back(datetime(2025, 1, 2, 1, 30), 3) == ['2025/01/02/01', '2025/01/02/00', '2025/01/01/23']
+
+
+def stored_record(message_id, sent_at, **data):
+    return json.dumps({
+        'data': {'email_subject': 'Hi', 'email_sender': 'john', 'email_timestream': '1', 'email_content': 'x', **data},
+        'metadata': {
+            'message_id': message_id,
+            'processed_at': sent_at.isoformat(),
+            'source': 'microservice2',
+            'trace': {'trace_id': 'abc', 'sent_at': sent_at.isoformat(), 'queue_dwell_ms': 2.5}
+        }
+    }, indent=2)
+
+
+class TestCompaction:
+    @pytest.fixture
+    def s3(self):
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+        from fake_aws import FakeS3
+        return FakeS3()
+    
+    def store(self, s3, count, start=datetime(2025, 1, 2, 3), layout='hourly'):
+        import s3_layout
+        for i in range(count):
+            sent_at = start.replace(second=i % 60, minute=(i // 60) % 60)
+            key = s3_layout.object_key(f'msg-{i:04d}', sent_at, layout, 1)
+            s3.put_object(Bucket='bucket', Key=key, Body=stored_record(f'msg-{i:04d}', sent_at, priority=i))
+    
+    def read_rows(self, s3, prefix='parquet/messages/'):
+        import io
+        import pyarrow.parquet as pq
+        rows = []
+        for key in sorted(key for key in s3.objects if key.startswith(prefix) and key.endswith('.parquet')):
+            rows.extend(pq.read_table(io.BytesIO(s3.objects[key]['Body'])).to_pylist())
+        return rows
+    
+    def test_writes_hour_partition_with_required_and_metadata_columns(self, s3):
+        import compact
+        self.store(s3, 3)
+        s3.put_object(Bucket='bucket', Key='messages/2025/01/02/03/broken.json', Body='not json')
+        
+        results = compact.compact(s3, 'bucket', ['2025/01/02/03'], workers=2)
+        
+        assert [key for key in s3.objects if key.endswith('.parquet')] == [
+            'parquet/messages/dt=2025-01-02/hour=03/part-00000.parquet'
+        ]
+        rows = self.read_rows(s3)
+        assert [row['message_id'] for row in rows] == ['msg-0000', 'msg-0001', 'msg-0002']
+        assert rows[1]['email_sender'] == 'john'
+        assert rows[1]['extra_data'] == '{"priority":1}'
+        assert rows[1]['sent_at'] == datetime(2025, 1, 2, 3, 0, 1)
+        assert rows[1]['queue_dwell_ms'] == 2.5
+        assert rows[1]['s3_key'] == 'messages/2025/01/02/03/msg-0001.json'
+        assert results['2025/01/02/03']['status'] == 'complete'
+        assert results['2025/01/02/03']['skipped'] == 1
+    
+    def test_splits_files_and_row_groups(self, s3):
+        import io
+        import compact
+        import pyarrow.parquet as pq
+        self.store(s3, 25)
+        
+        state = compact.compact(s3, 'bucket', ['2025/01/02/03'], rows_per_file=10, row_group_size=4)['2025/01/02/03']
+        
+        assert [part['rows'] for part in state['parts']] == [10, 10, 5]
+        first = pq.ParquetFile(io.BytesIO(s3.objects[state['parts'][0]['key']]['Body']))
+        assert first.metadata.num_row_groups == 3
+        assert len(self.read_rows(s3)) == 25
+    
+    def test_row_groups_are_bounded_by_bytes(self, s3):
+        import io
+        import compact
+        import pyarrow.parquet as pq
+        for i in range(6):
+            s3.put_object(Bucket='bucket', Key=f'messages/2025/01/02/03/msg-{i}.json',
+                          Body=stored_record(f'msg-{i}', datetime(2025, 1, 2, 3), email_body='x' * 10000))
+        
+        state = compact.compact(s3, 'bucket', ['2025/01/02/03'], row_group_bytes=25000)['2025/01/02/03']
+        
+        part = pq.ParquetFile(io.BytesIO(s3.objects[state['parts'][0]['key']]['Body']))
+        assert [part.metadata.row_group(i).num_rows for i in range(part.metadata.num_row_groups)] == [3, 3]
+        assert len(self.read_rows(s3)) == 6
+    
+    def test_runs_from_the_repository_checkout(self):
+        import subprocess
+        service_dir = os.path.dirname(os.path.abspath(__file__))
+        
+        result = subprocess.run([sys.executable, 'compact.py', '--help'], cwd=service_dir,
+                                capture_output=True, text=True, timeout=60)
+        
+        assert result.returncode == 0, result.stderr
+        assert '--row-group-bytes' in result.stdout
+    
+    def test_reads_every_shard_of_sharded_layout(self, s3):
+        import compact
+        self.store(s3, 40, layout='sharded')
+        
+        compact.compact(s3, 'bucket', ['2025/01/02/03'], layout='sharded', shard_chars=1)
+        
+        assert sorted(row['message_id'] for row in self.read_rows(s3)) == [f'msg-{i:04d}' for i in range(40)]
+    
+    def test_resumes_after_interruption_without_duplicates(self, s3):
+        import compact
+        from botocore.exceptions import ClientError
+        self.store(s3, 30)
+        get_object = s3.get_object
+        calls = []
+        
+        def failing_get_object(**kwargs):
+            calls.append(kwargs['Key'])
+            if len(calls) == 25:
+                raise ClientError({'Error': {'Code': 'InternalError', 'Message': 'Error'}}, 'GetObject')
+            return get_object(**kwargs)
+        
+        with patch.object(s3, 'get_object', side_effect=failing_get_object):
+            with pytest.raises(ClientError):
+                compact.compact(s3, 'bucket', ['2025/01/02/03'], workers=1, rows_per_file=10)
+        
+        checkpoint = compact.CheckpointStore(s3, 'bucket').load('2025/01/02/03')
+        assert checkpoint['status'] == 'in_progress'
+        assert checkpoint['rows'] == 20
+        
+        compact.compact(s3, 'bucket', ['2025/01/02/03'], workers=1, rows_per_file=10)
+        
+        assert [row['message_id'] for row in self.read_rows(s3)] == [f'msg-{i:04d}' for i in range(30)]
+    
+    def test_completed_hour_is_skipped_unless_forced(self, s3):
+        import compact
+        self.store(s3, 12)
+        compact.compact(s3, 'bucket', ['2025/01/02/03'], rows_per_file=5)
+        self.store(s3, 15)
+        
+        compact.compact(s3, 'bucket', ['2025/01/02/03'], rows_per_file=5)
+        assert len(self.read_rows(s3)) == 12
+        
+        state = compact.compact(s3, 'bucket', ['2025/01/02/03'], rows_per_file=20, force=True)['2025/01/02/03']
+        assert [part['rows'] for part in state['parts']] == [15]
+        assert len([key for key in s3.objects if key.endswith('.parquet')]) == 1
+        assert len(self.read_rows(s3)) == 15
+    
+    def test_default_range_leaves_settle_hours(self):
+        import compact
+        with patch('compact.datetime') as mock_datetime:
+            mock_datetime.utcnow.return_value = datetime(2025, 1, 2, 10, 30)
+            args = compact.parse_args(['--bucket', 'bucket', '--lookback-hours', '3'])
+        
+        assert compact.hour_range(args.start, args.end) == ['2025/01/02/06', '2025/01/02/07', '2025/01/02/08']
+
+
+class TestStructuredLogging:
+    def make_record(self, level=logging.INFO, message='Uploaded message to S3', fields=None):
+        record = logging.LogRecord('app', level, __file__, 1, message, None, None)
+        if fields:
+            record.fields = fields
+        return record
+    
+    def test_json_lines_carry_fields(self):
+        import structured_logging
+        formatter = structured_logging.JsonFormatter('service2')
+        
+        entry = json.loads(formatter.format(self.make_record(fields={'message_id': 'msg-1', 'count': 3})))
+        
+        assert entry['service'] == 'service2'
+        assert entry['level'] == 'INFO'
+        assert entry['message'] == 'Uploaded message to S3'
+        assert entry['message_id'] == 'msg-1'
+        assert entry['count'] == 3
+        assert entry['timestamp'].endswith('+00:00')
+    
+    def test_sampling_is_consistent_per_message(self):
+        import structured_logging
+        
+        sampled = [f'msg-{i}' for i in range(10000) if structured_logging.should_sample(f'msg-{i}', rate=0.1)]
+        
+        assert 800 < len(sampled) < 1200
+        assert all(structured_logging.should_sample(message_id, rate=0.1) for message_id in sampled)
+        assert structured_logging.should_sample('msg-1', rate=1)
+        assert not structured_logging.should_sample('msg-1', rate=0)
+    
+    @patch('structured_logging.LOG_SUCCESS_SAMPLE_RATE', 0)
+    @patch('app.sqs_client')
+    @patch('app.s3_client')
+    def test_success_logs_are_sampled_but_errors_are_not(self, mock_s3, mock_sqs, caplog):
+        with caplog.at_level(logging.INFO, logger='app'):
+            assert process_message(make_message('a')) is True
+            process_message(make_message('b', body='not valid json'))
+        
+        levels = [record.levelname for record in caplog.records if record.name == 'app']
+        assert 'INFO' not in levels
+        assert levels.count('ERROR') == 2
+    
+    @patch('structured_logging.LOG_SUCCESS_SAMPLE_RATE', 1)
+    @patch('app.sqs_client')
+    @patch('app.s3_client')
+    def test_sampled_message_is_logged_at_every_stage(self, mock_s3, mock_sqs, caplog):
+        with caplog.at_level(logging.INFO, logger='app'):
+            process_message(make_message('a'))
+        
+        records = [record for record in caplog.records if record.name == 'app']
+        assert [record.getMessage() for record in records] == [
+            'Processing message', 'Uploaded message to S3', 'Message deleted from SQS', 'Processed message'
+        ]
+        assert all(record.fields.get('message_id', 'a') == 'a' for record in records)
+    
+    def test_full_queue_drops_info_but_not_errors(self):
+        import queue
+        import structured_logging
+        fallback = MagicMock()
+        handler = structured_logging.NonBlockingQueueHandler(queue.Queue(maxsize=1), fallback)
+        
+        handler.handle(self.make_record())
+        handler.handle(self.make_record())
+        error = self.make_record(level=logging.ERROR, message='Failed')
+        handler.handle(error)
+        
+        assert handler.dropped == 1
+        fallback.handle.assert_called_once_with(error)
+    
+    def test_queued_records_are_written_by_listener(self):
+        import io
+        import structured_logging
+        stream = io.StringIO()
+        try:
+            structured_logging.configure('service2', stream=stream)
+            logging.getLogger('app').info('Worker started', extra={'fields': {'pollers': 2}})
+            structured_logging.shutdown()
+        finally:
+            structured_logging.configure('service2')
+        
+        entry = json.loads(stream.getvalue())
+        assert entry['message'] == 'Worker started'
+        assert entry['pollers'] == 2
+        assert entry['service'] == 'service2'
+
+
 class TestS3KeyFormat:
     @patch('app.s3_client')
     def test_s3_key_has_correct_structure(self, mock_s3):
@@ -0,0 +1,94 @@
+"""
+Find where service2 stored a message, from the hourly manifests under
+index/ rather than by listing messages/.
+
+Looks up a message ID (or every message from a sender) in the manifests
+for --hours hour partitions ending at --at (default: now), newest first,
+and prints one JSON line per match with its s3:// URI. A message stored
+within the last MANIFEST_FLUSH_SECONDS may not be indexed yet; with
+--probe a message ID that is not in the manifests is looked for with
+HeadObject at the key S3_KEY_LAYOUT would give it in each hour (this only
+works with S3_KEY_STRATEGY=message_id and S3_WRITE_MODE=object).
+
+Examples:
+    python lookup_message.py --bucket my-bucket 2f1c7d9e-5b1a-4c1e-9a57-0b6f6a3f1e2d
+    python lookup_message.py --bucket my-bucket --at 2025-01-02T03 --hours 1 --sender john@example.com
+    python lookup_message.py --bucket my-bucket --layout sharded --probe 2f1c7d9e-5b1a-4c1e-9a57-0b6f6a3f1e2d
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import datetime
+from botocore.exceptions import ClientError
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'common'))
+
+import aws_clients
+import s3_layout
+
+
+def probe(client, bucket, message_id, hours, layout, shard_chars):
+    """Return the first key that exists for message_id in hours, or None."""
+    for hour in hours:
+        key = s3_layout.object_key(message_id, datetime.strptime(hour, '%Y/%m/%d/%H'), layout, shard_chars)
+        try:
+            client.head_object(Bucket=bucket, Key=key)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                continue
+            raise
+        return key
+    return None
+
+
+def lookup(client, args):
+    hours = s3_layout.hours_back(args.at, args.hours)
+    found = 0
+    for entry in s3_layout.search_manifests(client, args.bucket, hours, args.message_id, args.sender,
+                                            args.manifest_prefix):
+        print(json.dumps({**entry, 'uri': f"s3://{args.bucket}/{entry['key']}"}))
+        found += 1
+        if args.message_id:
+            break
+
+    if not found and args.message_id and args.probe:
+        key = probe(client, args.bucket, args.message_id, hours, args.layout, args.shard_chars)
+        if key:
+            print(json.dumps({'id': args.message_id, 'key': key, 'uri': f's3://{args.bucket}/{key}'}))
+            found += 1
+    return found
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('message_id', nargs='?', help='SQS message ID to find')
+    parser.add_argument('--sender', help='List messages from this email_sender instead (or as well)')
+    parser.add_argument('--bucket', default=os.environ.get('S3_BUCKET_NAME'), help='Bucket (default: $S3_BUCKET_NAME)')
+    parser.add_argument('--at', type=lambda value: datetime.strptime(value, '%Y-%m-%dT%H'), default=datetime.utcnow(),
+                        help='Newest hour to search, YYYY-MM-DDTHH in UTC (default: now)')
+    parser.add_argument('--hours', type=int, default=24, help='Hour partitions to search back from --at')
+    parser.add_argument('--manifest-prefix', default=os.environ.get('MANIFEST_PREFIX', s3_layout.MANIFEST_PREFIX))
+    parser.add_argument('--probe', action='store_true', help='Fall back to HeadObject on the computed key')
+    parser.add_argument('--layout', choices=s3_layout.LAYOUTS, default=os.environ.get('S3_KEY_LAYOUT', 'hourly'),
+                        help='S3_KEY_LAYOUT the worker uses, for --probe')
+    parser.add_argument('--shard-chars', type=int, default=int(os.environ.get('S3_KEY_SHARD_CHARS', '2')),
+                        help='S3_KEY_SHARD_CHARS the worker uses, for --probe')
+    args = parser.parse_args(argv)
+    if not args.message_id and not args.sender:
+        parser.error('a message ID or --sender is required')
+    if not args.bucket:
+        parser.error('--bucket or S3_BUCKET_NAME is required')
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not lookup(aws_clients.create_client('s3'), args):
+        print('No matching message found', file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())